@@ -0,0 +1,6 @@
+"""
+Benchmarks of dplypy's pipeline verbs and of common pipelines, on synthetic data,
+against the plain pandas code computing the same results.
+
+    python -m benchmarks --rows 1e3 1e6 --output new.json --baseline old.json
+"""
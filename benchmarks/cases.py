@@ -0,0 +1,297 @@
+"""
+The benchmarked cases: each pipeline verb, and common multi-stage pipelines, with
+the plain pandas code computing the same result, to measure dplypy's overhead.
+"""
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import (
+    arrange,
+    compact,
+    count_null,
+    drop,
+    fill_na,
+    filter,
+    gather,
+    group_by,
+    head,
+    join,
+    mutate,
+    one_hot,
+    pivot_table,
+    row_name_subset,
+    select,
+    side_effect,
+    slice_column,
+    slice_row,
+    summarise,
+    tail,
+    write_file,
+)
+
+from benchmarks.data import lookup
+
+
+class Case:
+    """
+    A benchmarked operation, written with dplypy and with plain pandas
+    """
+
+    def __init__(self, name, dplypy, pandas, feasible=None):
+        """
+        :param name: the name of the case
+        :param dplypy: function(pandas_df, context) running the case with dplypy
+        :param pandas: function(pandas_df, context) running it with plain pandas
+        :param feasible: function(pandas_df, max_bytes) telling whether the case
+                         fits in memory, if it may not
+        """
+        self.name = name
+        self.dplypy = dplypy
+        self.pandas = pandas
+        self.feasible = feasible
+
+
+def context(pandas_df, directory):
+    """
+    :return: the inputs of the cases other than the data, prepared before timing
+    """
+    return {
+        "lookup": lookup(pandas_df),
+        "mask": pandas_df["y"] > 0,
+        "labels": pandas_df.index[::2],
+        "directory": directory,
+    }
+
+
+def _path(context, name):
+    return os.path.join(context["directory"], name)
+
+
+def _encodable(pandas_df, max_bytes):
+    # One byte per row and category
+    return len(pandas_df) * pandas_df["cat"].nunique() <= max_bytes
+
+
+def _pandas_compact(pandas_df):
+    """
+    :return: the DataFrame with the types `compact(columns=["key", "n"])` gives it
+    """
+    return pandas_df.assign(
+        key=pd.to_numeric(pandas_df["key"], downcast="signed"),
+        n=pd.to_numeric(pandas_df["n"], downcast="signed"),
+        cat=pandas_df["cat"].astype("category"),
+    )
+
+
+def _inspect(frame):
+    # The side effect of the side_effect case, given a DplyFrame by dplypy
+    return len(getattr(frame, "pandas_df", frame))
+
+
+def _run(pandas_df, *stages):
+    """
+    :return: the result of adding `stages` to a DplyFrame of `pandas_df`
+    """
+    frame = DplyFrame(pandas_df)
+    for stage in stages:
+        frame = frame + stage
+    return getattr(frame, "pandas_df", frame)
+
+
+CASES = [
+    Case(
+        "head",
+        lambda df, ctx: _run(df, head(100)),
+        lambda df, ctx: df.head(100),
+    ),
+    Case(
+        "tail",
+        lambda df, ctx: _run(df, tail(100)),
+        lambda df, ctx: df.tail(100),
+    ),
+    Case(
+        "select",
+        lambda df, ctx: _run(df, select("x > 0.5 and y < 0")),
+        lambda df, ctx: df.query("x > 0.5 and y < 0"),
+    ),
+    Case(
+        "filter",
+        lambda df, ctx: _run(df, filter(ctx["mask"])),
+        lambda df, ctx: df[ctx["mask"]],
+    ),
+    Case(
+        "mutate",
+        lambda df, ctx: _run(df, mutate(z="x * y + n")),
+        lambda df, ctx: df.assign(z=df["x"] * df["y"] + df["n"]),
+    ),
+    Case(
+        "drop",
+        lambda df, ctx: _run(df, drop(columns=["y", "n"])),
+        lambda df, ctx: df.drop(columns=["y", "n"]),
+    ),
+    Case(
+        "fill_na",
+        lambda df, ctx: _run(df, fill_na(value=0)),
+        lambda df, ctx: df.fillna(0),
+    ),
+    Case(
+        "count_null",
+        lambda df, ctx: _run(df, count_null()),
+        lambda df, ctx: df.isnull().sum().sum(),
+    ),
+    Case(
+        "join",
+        lambda df, ctx: _run(df, join(DplyFrame(ctx["lookup"]), on="key")),
+        lambda df, ctx: df.merge(ctx["lookup"], on="key"),
+    ),
+    Case(
+        "pivot_table",
+        lambda df, ctx: _run(df, pivot_table(values="x", index="key")),
+        lambda df, ctx: df.pivot_table(values="x", index="key"),
+    ),
+    Case(
+        "summarise",
+        lambda df, ctx: _run(
+            df, group_by("key"), summarise(n="size", mean_x=("x", "mean"))
+        ),
+        lambda df, ctx: df.groupby("key")
+        .agg(n=("x", "size"), mean_x=("x", "mean"))
+        .reset_index(),
+    ),
+    Case(
+        "summarise_many",
+        lambda df, ctx: _run(
+            df,
+            group_by("key"),
+            summarise(
+                n="size",
+                mean_x=("x", "mean"),
+                std_x=("x", "std"),
+                max_y=("y", "max"),
+                sum_n=("n", "sum"),
+                min_n=("n", "min"),
+            ),
+        ),
+        lambda df, ctx: df.groupby("key")
+        .agg(
+            n=("x", "size"),
+            mean_x=("x", "mean"),
+            std_x=("x", "std"),
+            max_y=("y", "max"),
+            sum_n=("n", "sum"),
+            min_n=("n", "min"),
+        )
+        .reset_index(),
+    ),
+    Case(
+        "gather",
+        lambda df, ctx: _run(df, gather(id_vars=["key"], value_vars=["x", "y"])),
+        lambda df, ctx: df.melt(id_vars=["key"], value_vars=["x", "y"]),
+    ),
+    Case(
+        "compact",
+        lambda df, ctx: _run(df, compact(columns=["key", "n"])),
+        lambda df, ctx: _pandas_compact(df),
+    ),
+    Case(
+        "one_hot",
+        lambda df, ctx: _run(df, one_hot(columns=["cat"])),
+        lambda df, ctx: pd.get_dummies(df, columns=["cat"], dtype=np.uint8),
+        feasible=_encodable,
+    ),
+    Case(
+        "one_hot_sparse",
+        lambda df, ctx: _run(df, one_hot(columns=["cat"], sparse=True)),
+        lambda df, ctx: pd.get_dummies(
+            df, columns=["cat"], dtype=np.uint8, sparse=True
+        ),
+        feasible=_encodable,
+    ),
+    Case(
+        "side_effect",
+        lambda df, ctx: _run(df, side_effect(_inspect)),
+        lambda df, ctx: df.pipe(_inspect),
+    ),
+    Case(
+        "arrange",
+        lambda df, ctx: _run(df, arrange(by="y")),
+        # arrange's sort is stable
+        lambda df, ctx: df.sort_values("y", kind="stable"),
+    ),
+    Case(
+        "slice_row",
+        lambda df, ctx: _run(df, slice_row(0, len(df) // 2)),
+        lambda df, ctx: df.iloc[0 : len(df) // 2],
+    ),
+    Case(
+        "slice_column",
+        lambda df, ctx: _run(df, slice_column(0, 3)),
+        lambda df, ctx: df.iloc[:, 0:3],
+    ),
+    Case(
+        "row_name_subset",
+        lambda df, ctx: _run(df, row_name_subset(ctx["labels"])),
+        lambda df, ctx: df.loc[ctx["labels"]],
+    ),
+    Case(
+        "write_file_csv",
+        lambda df, ctx: _run(df, write_file(_path(ctx, "dplypy.csv"))),
+        lambda df, ctx: df.to_csv(_path(ctx, "pandas.csv")),
+    ),
+    Case(
+        "pipeline_clean",
+        lambda df, ctx: _run(
+            df,
+            select("x > 0.1"),
+            mutate(z="x * y"),
+            drop(columns=["n"]),
+            arrange(by="z"),
+            head(1000),
+        ),
+        lambda df, ctx: df.query("x > 0.1")
+        .assign(z=lambda d: d["x"] * d["y"])
+        .drop(columns=["n"])
+        .sort_values("z")
+        .head(1000),
+    ),
+    Case(
+        "pipeline_join_summarise",
+        lambda df, ctx: _run(
+            df,
+            join(DplyFrame(ctx["lookup"]), on="key"),
+            mutate(weighted="x * weight"),
+            group_by("cat"),
+            summarise(total=("weighted", "sum"), mean_y=("y", "mean")),
+        ),
+        lambda df, ctx: df.merge(ctx["lookup"], on="key")
+        .assign(weighted=lambda d: d["x"] * d["weight"])
+        .groupby("cat")
+        .agg(total=("weighted", "sum"), mean_y=("y", "mean"))
+        .reset_index(),
+    ),
+    Case(
+        "pipeline_lazy",
+        lambda df, ctx: (
+            DplyFrame(df).lazy()
+            + select("y > 0")
+            + mutate(z="x + y")
+            + pivot_table(values="z", index="key", aggfunc="sum")
+        ).collect(),
+        lambda df, ctx: df.query("y > 0")
+        .assign(z=lambda d: d["x"] + d["y"])
+        .pivot_table(values="z", index="key", aggfunc="sum"),
+    ),
+]
+
+if importlib.util.find_spec("pyarrow") is not None:
+    CASES.append(
+        Case(
+            "write_file_parquet",
+            lambda df, ctx: _run(df, write_file(_path(ctx, "dplypy.parquet"))),
+            lambda df, ctx: df.to_parquet(_path(ctx, "pandas.parquet")),
+        )
+    )
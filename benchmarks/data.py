@@ -0,0 +1,57 @@
+"""
+Synthetic data for the benchmarks, generated offline from a seed.
+"""
+import numpy as np
+import pandas as pd
+
+# Schemas: the number of extra float columns added to the base columns
+SCHEMAS = {"narrow": 0, "wide": 50}
+
+# Key cardinalities: the number of distinct keys for a number of rows
+CARDINALITIES = {
+    "low": lambda rows: 10,
+    "high": lambda rows: max(rows // 10, 1),
+}
+
+
+def generate(rows, schema="narrow", cardinality="low", seed=0):
+    """
+    Generate a pandas DataFrame with an integer key, a string category, two float
+    measures (one with missing values) and an integer count, plus the extra float
+    columns of the schema.
+
+    :param rows: the number of rows
+    :param schema: "narrow" or "wide"
+    :param cardinality: "low" or "high", the number of distinct keys and categories
+    :param seed: the seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    keys = CARDINALITIES[cardinality](rows)
+    labels = np.array([f"cat{i}" for i in range(keys)], dtype=object)
+    x = rng.random(rows)
+    x[rng.random(rows) < 0.05] = np.nan
+    columns = {
+        "key": rng.integers(0, keys, rows),
+        "cat": labels[rng.integers(0, keys, rows)],
+        "x": x,
+        "y": rng.standard_normal(rows),
+        "n": rng.integers(0, 1000, rows),
+    }
+    for i in range(SCHEMAS[schema]):
+        columns[f"f{i}"] = rng.random(rows)
+    return pd.DataFrame(columns)
+
+
+def lookup(pandas_df):
+    """
+    :return: a table with one row per key of a generated DataFrame, to join it with
+    """
+    keys = np.unique(pandas_df["key"].to_numpy())
+    return pd.DataFrame({"key": keys, "weight": np.arange(len(keys)) % 7 + 1.0})
+
+
+def estimated_bytes(rows, schema):
+    """
+    :return: about how much memory a generated DataFrame takes, with its strings
+    """
+    return rows * (8 * (4 + SCHEMAS[schema]) + 60)
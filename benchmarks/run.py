@@ -0,0 +1,255 @@
+"""
+Run the benchmarks, store their results as JSON, and compare them to a baseline.
+"""
+import argparse
+import datetime
+import gc
+import json
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.cases import CASES, context
+from benchmarks.data import CARDINALITIES, SCHEMAS, estimated_bytes, generate
+
+# Row counts benchmarked by default; up to 1e8 can be asked for with --rows
+DEFAULT_ROWS = (10**3, 10**4, 10**5, 10**6)
+
+# Differences of less than this many seconds are never reported as slowdowns
+NOISE_SECONDS = 0.001
+
+
+def _time(func, repeat):
+    """
+    :return: the shortest of `repeat` timings of `func()`, in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(
+    rows=DEFAULT_ROWS,
+    schemas=tuple(SCHEMAS),
+    cardinalities=tuple(CARDINALITIES),
+    cases=None,
+    repeat=3,
+    max_bytes=4 * 2**30,
+    log=print,
+):
+    """
+    Time each case with dplypy and with plain pandas, on data of every size, schema
+    and key cardinality. Data larger than `max_bytes` (or cases that would produce
+    larger results) are skipped.
+
+    :param cases: names of the cases to run, by default all of them
+    :param repeat: the number of timings of each case, of which the shortest is kept
+    :param log: function(message) reporting progress
+    :return: a list of results: dictionaries of the case, rows, schema and
+             cardinality, and of the dplypy and pandas times in seconds and their
+             ratio (`overhead`), or of the exception (`error`) the case raised
+    """
+    selected = [case for case in CASES if cases is None or case.name in cases]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for count in rows:
+            for schema in schemas:
+                if estimated_bytes(count, schema) > max_bytes:
+                    log(f"Skipped {count} rows of the {schema} schema: too large")
+                    continue
+                for cardinality in cardinalities:
+                    pandas_df = generate(count, schema, cardinality)
+                    inputs = context(pandas_df, directory)
+                    for case in selected:
+                        if case.feasible and not case.feasible(pandas_df, max_bytes):
+                            log(f"Skipped {case.name} on {count} rows: too large")
+                            continue
+                        result = {
+                            "case": case.name,
+                            "rows": count,
+                            "schema": schema,
+                            "cardinality": cardinality,
+                        }
+                        try:
+                            result["dplypy"] = _time(
+                                lambda: case.dplypy(pandas_df, inputs), repeat
+                            )
+                            result["pandas"] = _time(
+                                lambda: case.pandas(pandas_df, inputs), repeat
+                            )
+                        except Exception as error:
+                            # Reported rather than raised, so that the other cases
+                            # still run
+                            log(f"Failed {case.name} on {count} rows: {error!r}")
+                            results.append(
+                                {
+                                    "case": case.name,
+                                    "rows": count,
+                                    "schema": schema,
+                                    "cardinality": cardinality,
+                                    "error": repr(error),
+                                }
+                            )
+                            continue
+                        result["overhead"] = result["dplypy"] / max(
+                            result["pandas"], 1e-9
+                        )
+                        log(
+                            f"{case.name:<24} {count:>10} {schema:<6} {cardinality:<4} "
+                            f"{result['dplypy']:.4f}s (pandas {result['pandas']:.4f}s)"
+                        )
+                        results.append(result)
+                    del pandas_df, inputs
+    return results
+
+
+def metadata():
+    """
+    :return: the versions and machine the benchmarks ran with
+    """
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.system(),
+    }
+
+
+def _timed(results):
+    """
+    :return: the results of the cases that did not fail
+    """
+    return [result for result in results if "error" not in result]
+
+
+def compare(results, baseline, threshold=1.25):
+    """
+    Compare results to those of a baseline run, for the same cases and data.
+    Cases that failed in either run are left out.
+
+    :param results: the results of `run`
+    :param baseline: the results of an earlier `run`
+    :param threshold: the ratio of the dplypy times beyond which a case slowed down
+    :return: a pandas DataFrame with one row per case found in both, with the
+             baseline and current dplypy times, their ratio (`change`), the current
+             overhead over pandas, and whether the case slowed down
+    """
+    keys = ["case", "rows", "schema", "cardinality"]
+    current = pd.DataFrame(
+        _timed(results), columns=keys + ["dplypy", "pandas", "overhead"]
+    )
+    previous = pd.DataFrame(_timed(baseline), columns=keys + ["dplypy"])
+    merged = previous.merge(current, on=keys, suffixes=("_baseline", ""))
+    merged = merged.rename(columns={"dplypy_baseline": "baseline"})
+    merged["change"] = merged["dplypy"] / merged["baseline"].clip(lower=1e-9)
+    merged["slowdown"] = (merged["change"] > threshold) & (
+        merged["dplypy"] - merged["baseline"] > NOISE_SECONDS
+    )
+    return merged[keys + ["baseline", "dplypy", "change", "overhead", "slowdown"]]
+
+
+def summary(results):
+    """
+    :return: the median overhead of dplypy over pandas per case, as a string
+    """
+    frame = pd.DataFrame(_timed(results), columns=["case", "overhead"])
+    overhead = frame.groupby("case", sort=False)["overhead"].median()
+    return overhead.to_frame("median overhead").to_string(float_format="{:.2f}x".format)
+
+
+def _rows(value):
+    # Accept 1e6 as well as 1000000
+    return int(float(value))
+
+
+def main(argv=None):
+    """
+    The command line interface: `python -m benchmarks --help`
+
+    :return: the exit status, 1 if a case failed or slowed down compared to the
+             baseline
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Time dplypy's pipeline verbs and pipelines against plain pandas.",
+    )
+    parser.add_argument(
+        "--rows", nargs="+", type=_rows, default=DEFAULT_ROWS, help="e.g. 1e3 1e8"
+    )
+    parser.add_argument(
+        "--schemas", nargs="+", choices=list(SCHEMAS), default=list(SCHEMAS)
+    )
+    parser.add_argument(
+        "--cardinalities",
+        nargs="+",
+        choices=list(CARDINALITIES),
+        default=list(CARDINALITIES),
+    )
+    parser.add_argument(
+        "--cases", nargs="+", choices=[case.name for case in CASES], default=None
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--max-bytes",
+        type=_rows,
+        default=4 * 2**30,
+        help="skip data and results larger than this (default: 4 GiB)",
+    )
+    parser.add_argument(
+        "--output", default="benchmarks.json", help="where to store the results"
+    )
+    parser.add_argument("--baseline", help="results of an earlier run to compare to")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="time ratio beyond which a case is a slowdown (default: 1.25)",
+    )
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.rows,
+        args.schemas,
+        args.cardinalities,
+        args.cases,
+        args.repeat,
+        args.max_bytes,
+    )
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump({"metadata": metadata(), "results": results}, file, indent=1)
+    print(summary(results))
+    status = 0
+    failures = [result for result in results if "error" in result]
+    if failures:
+        print(f"{len(failures)} failed cases:")
+        for result in failures:
+            print(f"  {result['case']} on {result['rows']} rows: {result['error']}")
+        status = 1
+    if args.baseline is None:
+        return status
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)["results"]
+    comparison = compare(results, baseline, args.threshold)
+    print(comparison.to_string(index=False, float_format="{:.4f}".format))
+    slowdowns = comparison[comparison["slowdown"]]
+    if slowdowns.empty:
+        print("No slowdown")
+        return status
+    print(f"{len(slowdowns)} slowdowns beyond {args.threshold}x")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
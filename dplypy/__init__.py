@@ -1,2 +1,5 @@
+from dplypy.background import flush_side_effects, flush_writes
 from dplypy.dplyframe import *
 from dplypy.pipeline import *
+from dplypy.profiling import profile
+from dplypy.readers import *
@@ -0,0 +1,568 @@
+"""
+Vectorized grouped aggregation.
+Group keys are factorized once into integer codes, and every aggregate is then
+computed in a single pass over its column with `numpy.bincount` indexed by the codes,
+or a ufunc's `reduceat` over the values sorted by group (the codes are argsorted
+once): no groupby per aggregate.
+Integer keys of a small range are factorized without hashing, the keys of the groups
+are taken from their distinct values, and the aggregations of a same column share its
+counts and sums.
+"""
+import numpy as np
+import pandas as pd
+
+# Aggregates computed with numpy kernels (on numeric and boolean columns)
+_KERNELS = ("count", "sum", "mean", "var", "std", "min", "max", "first", "last")
+
+# From numpy 1.25, `ufunc.at` is fast enough for minimums and maximums not to sort
+_FAST_AT = tuple(int(part) for part in np.__version__.split(".")[:2]) >= (1, 25)
+_AT_UFUNCS = (np.minimum, np.maximum, np.fmin, np.fmax)
+
+
+class Groups:
+    """
+    The groups of the rows of a DataFrame, as one integer code per row. Groups are
+    numbered in the sorted order of their keys, and rows with a missing key belong
+    to no group (code -1), as with `DataFrame.groupby`, unless `dropna` is False.
+    """
+
+    def __init__(self, pandas_df, keys, dropna=True):
+        """
+        :param pandas_df: the DataFrame whose rows are grouped
+        :param keys: list of the labels of the key columns (empty for a single group)
+        :param dropna: if false, missing keys form groups of their own, sorted last
+        """
+        codes = None
+        count = 1
+        # The distinct values of each key, and the number of each group's value
+        uniques, numbers = [], []
+        # The number of rows of each group, when factorizing counted them
+        sizes = None
+        for key in keys:
+            key_codes, key_uniques, sizes = _factorize(pandas_df[key])
+            missing = not dropna and bool((key_codes < 0).any())
+            if missing:
+                key_codes = np.where(key_codes < 0, len(key_uniques), key_codes)
+            size = len(key_uniques) + missing
+            uniques.append(key_uniques)
+            if not numbers:
+                codes, count = key_codes, size
+                numbers.append(np.arange(size))
+                continue
+            # Combine with the codes so far, then renumber to keep them small
+            codes, combinations = _combine(codes, key_codes, count, size)
+            numbers = [number[combinations // size] for number in numbers]
+            numbers.append(combinations % size)
+            count = len(combinations)
+            sizes = None
+        if codes is None:
+            codes = np.zeros(len(pandas_df), dtype=np.intp)
+        self.codes = codes
+        self.count = count
+        # Rows without a group are left out of the kernels
+        self.grouped = None if codes.min(initial=0) >= 0 else codes >= 0
+        if sizes is None:
+            sizes = np.bincount(self.select(codes), minlength=count)
+        self.sizes = sizes
+        # The rows that belong to a group sorted by group, and where each group starts
+        # (see `_sorted`)
+        self._order = None
+        self._starts = None
+        # The keys of the groups, out of the distinct values (a missing one last)
+        self.keys = pd.DataFrame(
+            {
+                key: pd.Series(key_uniques, dtype=pandas_df[key].dtype)
+                .reindex(number)
+                .reset_index(drop=True)
+                for key, key_uniques, number in zip(keys, uniques, numbers)
+            },
+            index=range(count),
+        )
+
+    def select(self, values):
+        """
+        :return: the values of the rows that belong to a group
+        """
+        return values if self.grouped is None else values[self.grouped]
+
+    def reduce(self, ufunc, values, initial):
+        """
+        Reduce the values of each group with a numpy ufunc.
+
+        :param values: one value per row that belongs to a group
+        :param initial: the result for groups without any row
+        :return: one value per group
+        """
+        reduced = np.full(self.count, initial, dtype=np.result_type(values, initial))
+        if _FAST_AT and ufunc in _AT_UFUNCS:
+            ufunc.at(reduced, self.select(self.codes), values)
+            return reduced
+        order, starts = self._sorted()
+        present = self.sizes > 0
+        if present.any():
+            reduced[present] = ufunc.reduceat(values[order], starts[present])
+        return reduced
+
+    def _sorted(self):
+        """
+        Sort the rows that belong to a group by group, once.
+
+        :return: their positions among these rows, sorted by group (stable), and the
+                 position in this order where each group starts
+        """
+        if self._order is None:
+            # Codes of 16 bits at most are radix sorted
+            codes = self.select(self.codes)
+            codes = codes.astype(np.min_scalar_type(max(self.count - 1, 0)))
+            self._order = np.argsort(codes, kind="stable")
+            self._starts = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+        return self._order, self._starts
+
+    def first(self, positions, last=False):
+        """
+        :param positions: one position per row
+        :return: the smallest (or largest) of `positions` in each group
+        """
+        if last:
+            return self.reduce(np.maximum, self.select(positions), -1)
+        return self.reduce(np.minimum, self.select(positions), len(self.codes))
+
+
+def _factorize(column):
+    """
+    Number the distinct values of a column in sorted order, like
+    `pd.factorize(column, sort=True)`. Integers spanning a range no wider than the
+    column is long are numbered by their offset from the smallest, without hashing.
+
+    :return: the number of each row's value (-1 for a missing one), the distinct
+             values, and the number of rows of each (None if they were not counted)
+    """
+    values = column.to_numpy() if isinstance(column.dtype, np.dtype) else None
+    if (
+        values is None
+        or values.dtype.kind not in "iu"
+        or values.dtype == np.uint64
+        or not len(values)
+    ):
+        codes, uniques = pd.factorize(column, sort=True)
+        return codes, uniques, None
+    smallest, largest = values.min(), values.max()
+    span = int(largest) - int(smallest) + 1
+    if span > max(len(values), 2**16):
+        codes, uniques = pd.factorize(column, sort=True)
+        return codes, uniques, None
+    offsets = values.astype(np.intp, copy=False) - np.intp(smallest)
+    found = np.bincount(offsets, minlength=span)
+    present = np.flatnonzero(found)
+    if len(present) == span:
+        # Every value of the range is there: the offsets number them already
+        return offsets, present + np.intp(smallest), found
+    numbers = np.full(span, -1, dtype=np.intp)
+    numbers[present] = np.arange(len(present))
+    return numbers[offsets], present + np.intp(smallest), found[present]
+
+
+def _combine(codes, key_codes, count, size):
+    """
+    Number the distinct pairs of group and key codes, in sorted order.
+
+    :param codes: the group of each row (from 0 to `count` - 1), or -1
+    :param key_codes: the code of each row's key (from 0 to `size` - 1), or -1
+    :return: the number of the pair of each row (-1 if either code is), and the
+             distinct pairs, sorted, as `code * size + key_code`
+    """
+    # Rows without a pair get one past the last, sorted after all the others
+    combined = codes * size + key_codes
+    absent = (codes < 0) | (key_codes < 0)
+    if absent.any():
+        combined[absent] = count * size
+    if count * size <= max(len(codes), 2**16):
+        # Few enough pairs to number them all, without hashing
+        found = np.bincount(combined, minlength=count * size + 1)[:-1]
+        combinations = np.flatnonzero(found)
+        numbers = np.full(count * size + 1, -1, dtype=np.intp)
+        numbers[combinations] = np.arange(len(combinations))
+        return numbers[combined], combinations
+    combined, combinations = pd.factorize(combined, sort=True)
+    if len(combinations) and combinations[-1] == count * size:
+        combined[combined == len(combinations) - 1] = -1
+        combinations = combinations[:-1]
+    return combined, combinations
+
+
+def summarise_frame(pandas_df, keys, aggregations, dropna=True):
+    """
+    Summarise the groups of a DataFrame.
+
+    :param pandas_df: the DataFrame to summarise
+    :param keys: list of the labels of the key columns (empty for a single group)
+    :param aggregations: dict of output column name to "size" (the number of rows of
+                         the group) or a (column, function) pair, where the function
+                         is the name of a pandas aggregation or any function accepted
+                         by `SeriesGroupBy.agg`
+    :param dropna: if false, rows with missing keys are summarised too
+    :return: a DataFrame with the key columns and one column per aggregation,
+             with one row per group, sorted by key
+    """
+    groups = Groups(pandas_df, keys, dropna)
+    output = dict(groups.keys.items())
+    # The counts and sums of each column, shared by its aggregations
+    moments = {}
+    for name, spec in aggregations.items():
+        if spec == "size":
+            output[name] = groups.sizes
+        else:
+            column, func = spec
+            output[name] = _aggregate(
+                groups, pandas_df[column], func, moments.setdefault(column, {})
+            )
+    # Built at once, rather than column by column
+    return pd.DataFrame(output, index=range(groups.count))
+
+
+def _aggregate(groups, series, func, moments=None):
+    """
+    :param moments: the counts and sums of `series` computed so far by the other
+                    aggregations of the column, which they share, as a dict
+    :return: the result of aggregating `series` with `func` in each group
+    """
+    if (
+        not isinstance(func, str)
+        or func not in _KERNELS
+        or not (isinstance(series.dtype, np.dtype) and series.dtype.kind in "biuf")
+    ):
+        codes = groups.select(groups.codes)
+        aggregated = groups.select(series).groupby(codes).agg(func)
+        return aggregated.reindex(range(groups.count)).to_numpy()
+
+    values = series.to_numpy()
+    if func in ("first", "last"):
+        positions = np.arange(len(values))
+        if values.dtype.kind == "f":
+            positions[np.isnan(values)] = -1 if func == "last" else len(values)
+        picked = groups.first(positions, last=func == "last")
+        found = (picked >= 0) & (picked < len(values))
+        if found.all():
+            return values[picked]
+        result = np.full(groups.count, np.nan)
+        result[found] = values[picked[found]]
+        return result
+
+    if func in ("min", "max"):
+        ufunc = np.fmin if func == "min" else np.fmax
+        values = groups.select(values)
+        full = bool(groups.sizes.all())
+        if full and values.dtype.kind in "biu":
+            # Every group has a row: starting from a bound of the type keeps the dtype
+            if values.dtype.kind == "b":
+                bound = func == "min"
+            else:
+                info = np.iinfo(values.dtype)
+                bound = values.dtype.type(info.max if func == "min" else info.min)
+            return groups.reduce(ufunc, values, bound)
+        values = values.astype(np.float64, copy=False)
+        if full and not np.isnan(values).any():
+            # Without missing values, the ufunc that propagates them is faster
+            ufunc = np.minimum if func == "min" else np.maximum
+            return groups.reduce(ufunc, values, np.inf if func == "min" else -np.inf)
+        return groups.reduce(ufunc, values, np.nan)
+
+    moments = {} if moments is None else moments
+    if not moments:
+        _moments(groups, values, moments)
+    counts = moments["counts"]
+    if func == "count":
+        return counts
+    if "sums" not in moments:
+        _sums(groups, moments)
+    sums = moments["sums"]
+    if func == "sum":
+        return sums
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+        if func == "mean":
+            return means
+        # Second pass over the deviations from the mean, for precision
+        codes = groups.select(groups.codes)
+        deviations = means[codes]
+        np.subtract(moments["values"], deviations, out=deviations)
+        if moments["missing"] is not None:
+            deviations[moments["missing"]] = 0
+        np.square(deviations, out=deviations)
+        squares = np.bincount(codes, weights=deviations, minlength=groups.count)
+        variances = squares / (counts - 1)
+    variances[counts < 2] = np.nan
+    return variances if func == "var" else np.sqrt(variances)
+
+
+def _moments(groups, values, moments):
+    """
+    Work out the values of the rows that belong to a group, with 0 for missing ones
+    ("values"), which of them are missing ("missing", None if none is), and the
+    number of the others in each group ("counts").
+    """
+    values = groups.select(values)
+    missing = None
+    if values.dtype.kind == "f":
+        missing = np.isnan(values)
+        if missing.any():
+            values = np.where(missing, 0, values)
+        else:
+            missing = None
+    else:
+        values = values.astype(np.int64, copy=False)
+    counts = groups.sizes
+    if missing is not None:
+        # Fewer rows are missing than not, usually
+        codes = groups.select(groups.codes)
+        counts = counts - np.bincount(codes[missing], minlength=groups.count)
+    moments.update(values=values, missing=missing, counts=counts)
+
+
+def _sums(groups, moments):
+    """
+    Work out the sum of the values of each group ("sums", see `_moments`).
+    """
+    codes = groups.select(groups.codes)
+    values = moments["values"]
+    if values.dtype.kind == "f":
+        sums = np.bincount(codes, weights=values, minlength=groups.count)
+        sums = sums.astype(np.float64, copy=False)
+    else:
+        # Integers are added exactly: as float weights while no sum can exceed the
+        # 53 bits of their mantissa, else in the order of the groups
+        largest = max(int(values.max(initial=0)), -int(values.min(initial=0)))
+        if largest * int(groups.sizes.max(initial=0)) < 2**53:
+            sums = np.bincount(codes, weights=values, minlength=groups.count)
+            sums = sums.astype(np.int64)
+        else:
+            sums = groups.reduce(np.add, values, np.int64(0))
+    moments["sums"] = sums
+
+
+# pandas 1 pivot tables leave out missing keys even with dropna=False, and give
+# aggregated values back the integer type of their column where they can take it
+_LEGACY_PIVOT = int(pd.__version__.split(".")[0]) < 2
+
+# Maximum number of partial summaries merged at once
+_FAN_IN = 16
+
+# The partial states summarising a chunk of rows for each decomposable aggregation
+_STATES = {
+    "size": ("size",),
+    "count": ("count",),
+    "sum": ("sum",),
+    "mean": ("count", "sum"),
+    "var": ("count", "sum", "m2"),
+    "std": ("count", "sum", "m2"),
+    "min": ("min",),
+    "max": ("max",),
+    "first": ("first",),
+    "last": ("last",),
+}
+
+# How the states of the chunks are merged, but for the sums of squared deviations
+_MERGES = {
+    "size": "sum",
+    "count": "sum",
+    "sum": "sum",
+    "min": "min",
+    "max": "max",
+    "first": "first",
+    "last": "last",
+}
+
+
+def decomposable(func):
+    """
+    :param func: an aggregation function, or the name of one
+    :return: the name of the aggregation if it can be computed from partial states of
+             chunks of rows (e.g. a mean from sums and counts), else None. Functions
+             (even np.mean) are opaque, and never decomposable.
+    """
+    if isinstance(func, str) and func in _STATES:
+        return func
+    return None
+
+
+def partial_summary(pandas_df, keys, aggregations, dropna=True):
+    """
+    Summarise the groups of a chunk of rows into partial states that can be merged
+    with those of other chunks by `merge_summaries`: counts and sums for means,
+    plus sums of squared deviations (M2) for variances, minimums, maximums...
+
+    :param pandas_df: the chunk of rows
+    :param keys: list of the labels of the key columns (empty for a single group)
+    :param aggregations: as for `summarise_frame`, with decomposable functions only
+    :param dropna: as for `summarise_frame`
+    :return: a DataFrame with the key columns and one (name, state) column per state
+    """
+    states = {}
+    for name, spec in aggregations.items():
+        if spec == "size":
+            states[(name, "size")] = "size"
+            continue
+        column, func = spec
+        for state in _STATES[decomposable(func)]:
+            states[(name, state)] = (column, "var" if state == "m2" else state)
+    summary = summarise_frame(pandas_df, keys, states, dropna)
+    for name, spec in aggregations.items():
+        if (name, "m2") in summary:
+            counts = summary[(name, "count")].to_numpy()
+            deviations = summary[(name, "m2")].to_numpy() * (counts - 1)
+            summary[(name, "m2")] = np.where(counts > 1, deviations, 0.0)
+    # Kept for aggregations whose results depend on the input types (see pivot_summary)
+    summary.attrs["dtypes"] = dict(pandas_df.dtypes)
+    return summary
+
+
+def merge_summaries(partials, keys, aggregations, dropna=True):
+    """
+    Merge the partial summaries of chunks of rows into the partial summary of all of
+    them. The partial summaries are merged 16 at a time as they come, so that only
+    a few are held in memory at once.
+
+    :param partials: iterable of the partial summaries (see `partial_summary`) of the
+                     chunks, in the order of the rows; at least one
+    :param keys: list of the labels of the key columns (empty for a single group)
+    :param aggregations: as for `partial_summary`
+    :param dropna: as for `partial_summary`
+    :return: a partial summary of all the rows
+    """
+    pending = []
+    for partial in partials:
+        pending.append(partial)
+        if len(pending) == _FAN_IN:
+            pending = [_merge(pending, keys, aggregations, dropna)]
+    if len(pending) == 1:
+        return pending[0]
+    return _merge(pending, keys, aggregations, dropna)
+
+
+def final_summary(summary, aggregations):
+    """
+    Work out the results of aggregations from their partial states.
+
+    :param summary: a partial summary of all the rows (see `merge_summaries`)
+    :param aggregations: as for `partial_summary`
+    :return: the same DataFrame `summarise_frame` returns for all the rows
+    """
+    output = summary[[column for column in summary if not isinstance(column, tuple)]]
+    output = output.copy()
+    output.attrs = {}
+    for name, spec in aggregations.items():
+        func = "size" if spec == "size" else decomposable(spec[1])
+        if func in _MERGES:
+            output[name] = summary[(name, func)]
+            continue
+        counts = summary[(name, "count")].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if func == "mean":
+                output[name] = summary[(name, "sum")].to_numpy() / counts
+                continue
+            variances = summary[(name, "m2")].to_numpy() / (counts - 1)
+        variances[counts < 2] = np.nan
+        output[name] = variances if func == "var" else np.sqrt(variances)
+    return output
+
+
+def _merge(partials, keys, aggregations, dropna):
+    """
+    :return: the partial summary of the rows of several partial summaries
+    """
+    combined = pd.concat(partials, ignore_index=True)
+    groups = Groups(combined, keys, dropna)
+    output = groups.keys.reset_index(drop=True)
+    for name, spec in aggregations.items():
+        func = "size" if spec == "size" else decomposable(spec[1])
+        for state in _STATES[func]:
+            if state in _MERGES:
+                merged = _aggregate(groups, combined[(name, state)], _MERGES[state])
+                output[(name, state)] = merged
+        if "m2" not in _STATES[func]:
+            continue
+        # Chan et al.'s update: M2 = sum of the parts' M2 + n_i (mean_i - mean)^2
+        counts = combined[(name, "count")].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = (
+                output[(name, "sum")].to_numpy() / output[(name, "count")].to_numpy()
+            )
+            shifts = combined[(name, "sum")].to_numpy() / counts - means[groups.codes]
+        terms = combined[(name, "m2")].to_numpy() + counts * shifts**2
+        terms = np.where(counts > 0, terms, 0.0)
+        output[(name, "m2")] = np.bincount(
+            groups.select(groups.codes),
+            weights=groups.select(terms),
+            minlength=groups.count,
+        )
+    output.attrs["dtypes"] = partials[0].attrs["dtypes"]
+    return output
+
+
+def pivot_aggregations(values, index, columns, aggfunc, dropna=True):
+    """
+    Decompose `DataFrame.pivot_table(values, index, columns, aggfunc, dropna=dropna)`
+    into a grouped summary (see `partial_summary`) laid out by `pivot_summary`.
+
+    :return: the key columns, the aggregations (one per value column, named after it)
+             and whether rows with missing keys are left out; or None if the pivot
+             table cannot be decomposed (its values or keys are not labels, or its
+             `aggfunc` is a function or is not decomposable)
+    """
+    func = decomposable(aggfunc)
+    labels = [
+        labels if isinstance(labels, list) else [labels]
+        for labels in (values, index, columns)
+    ]
+    if func is None or func == "size" or values is None:
+        return None
+    for label in labels[0] + labels[1] + labels[2]:
+        if isinstance(label, (list, tuple, np.ndarray, pd.Series, pd.Grouper)):
+            return None
+    keys = [key for key in labels[1] + labels[2] if key is not None]
+    aggregations = {value: (value, func) for value in labels[0]}
+    return keys, aggregations, dropna or _LEGACY_PIVOT
+
+
+def pivot_summary(
+    summary, dtypes, values, index, columns, fill_value=None, dropna=True
+):
+    """
+    Lay out the summary of the groups of the `index` and `columns` keys (see
+    `final_summary`, with one aggregation per value column, named after it) as
+    `DataFrame.pivot_table` would.
+
+    :param summary: the summary
+    :param dtypes: the types of the columns of the rows, by label (kept by
+                   `partial_summary` in the `attrs["dtypes"]` of its result)
+
+    :param values: the `values` argument of pivot_table: a label or list of labels
+    :param index: the `index` argument of pivot_table: None, a label or list of labels
+    :param columns: the `columns` argument of pivot_table: None, a label or list of labels
+    :return: the pivot table, as a DataFrame
+    """
+    names = [
+        labels if isinstance(labels, list) else [labels]
+        for labels in (values, index, columns)
+    ]
+    value_names, keys = names[0], [
+        key for labels in names[1:] for key in labels if key is not None
+    ]
+    if dropna:
+        # As pivot_table does: drop empty groups (and with pandas 1, give results
+        # back the integer type of their column where they can take it)
+        summary = summary.dropna(how="all", subset=value_names).copy()
+        for value in value_names if _LEGACY_PIVOT else []:
+            result = summary[value]
+            if dtypes[value].kind in "iu" and result.dtype.kind == "f":
+                if result.notna().all() and (result == result.round()).all():
+                    summary[value] = result.astype(dtypes[value])
+    # Each group is a single row now, which "first" passes through as is
+    return summary[keys + value_names].pivot_table(
+        values=values,
+        index=index,
+        columns=columns,
+        aggfunc="first",
+        fill_value=fill_value,
+        dropna=dropna,
+    )
@@ -0,0 +1,319 @@
+"""
+Background execution of side effects (see `pipeline.side_effect`) and file writes
+(see `pipeline.write_file`).
+Each pipeline keeps its own background work in a Tasks object: the one of the
+DplyFrame it runs on, shared with the DplyFrames it returns (a lazy DplyFrame has its
+own). Waiting for a pipeline's work, as its `collect()` and `write_file` do, neither
+waits for the work of other pipelines nor raises their exceptions.
+Callbacks run in a small pool of threads shared by all the pipelines. At most 16 of
+them are pending at once: submitting more waits for one to finish, so that slow side
+effects hold back the pipeline instead of piling up snapshots in memory. Their return
+values and exceptions are kept until the pipeline's side effects are flushed.
+Writes are double-buffered: one is written in the background while the pipeline
+computes the next one, which waits for it (and raises its exception, if any)
+before being submitted. `collect()` and `flush_writes` wait for the last one.
+Exceptions that are never raised because nothing waited for their side effect or
+write are reported as warnings when the interpreter exits.
+"""
+import atexit
+import contextlib
+import contextvars
+import itertools
+import multiprocessing
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Number of threads running side effects, and writes
+_WORKERS = 4
+
+# Maximum number of side effects submitted but not finished yet
+_MAX_PENDING = 16
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(_MAX_PENDING)
+_executor = None
+_writer = None
+_processes = None
+
+# The Tasks of the pipeline running in this thread, if any (see `running`)
+_current = contextvars.ContextVar("dplypy_tasks", default=None)
+# The Tasks of work submitted outside any pipeline
+_default = None
+# The Tasks holding work not waited for yet, for the flushes made outside any pipeline
+_holding = set()
+# Futures that failed, or may still fail, and that nothing has waited for yet
+_unreported = set()
+# Submission order of side effects across all Tasks
+_numbers = itertools.count()
+
+
+class Tasks:
+    """
+    The side effects and writes a pipeline runs in the background.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (number, future) of the side effects submitted and not flushed yet
+        self._submitted = []
+        self._write = None
+
+    def submit(self, func, *args):
+        """
+        Run `func(*args)` in the background, waiting for a slot if too many side
+        effects are pending.
+
+        :return: a concurrent.futures.Future of the result
+        """
+        global _executor
+        _slots.acquire()
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    _WORKERS, thread_name_prefix="dplypy-side-effect"
+                )
+            future = _executor.submit(func, *args)
+            number = next(_numbers)
+            _holding.add(self)
+        with self._lock:
+            self._submitted.append((number, future))
+        _track(future)
+        future.add_done_callback(lambda _: _slots.release())
+        return future
+
+    def flush_side_effects(self):
+        """
+        Wait for the side effects submitted so far to finish.
+
+        :return: the list of their return values, in the order they were submitted
+        :raises: the first exception one of them raised (once all of them are done)
+        """
+        with self._lock:
+            submitted = list(self._submitted)
+            self._submitted.clear()
+        self._release()
+        return _results([future for _, future in submitted])
+
+    def write(self, func, *args, backend="thread"):
+        """
+        Run `func(*args)`, which writes data to a file, in the background once the
+        previous write is done.
+
+        :param backend: "thread" to write in a thread, or "process" to write in a
+                        child process (the same one for every write), forked where
+                        the platform allows it, for writers that hold the GIL (e.g.
+                        CSV serialization); `func` and its arguments are pickled
+        :raises: the exception the previous write raised, if any
+        :return: a concurrent.futures.Future of the result
+        """
+        global _writer, _processes
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Unknown backend: {backend!r}")
+        self.flush_writes()
+        with _lock:
+            if backend == "thread":
+                if _writer is None:
+                    _writer = ThreadPoolExecutor(
+                        _WORKERS, thread_name_prefix="dplypy-writer"
+                    )
+                executor = _writer
+            else:
+                if _processes is None:
+                    fork = "fork" in multiprocessing.get_all_start_methods()
+                    _processes = ProcessPoolExecutor(
+                        1,
+                        mp_context=multiprocessing.get_context(
+                            "fork" if fork else None
+                        ),
+                    )
+                executor = _processes
+            future = executor.submit(func, *args)
+            _holding.add(self)
+        self._write = future
+        _track(future)
+        return future
+
+    def flush_writes(self):
+        """
+        Wait for the write running in the background, if any, to finish.
+
+        :raises: the exception it raised, if any
+        """
+        future, self._write = self._write, None
+        self._release()
+        if future is not None:
+            _results([future])
+
+    def _release(self):
+        with _lock:
+            if not self._submitted and self._write is None:
+                _holding.discard(self)
+
+    def flush(self):
+        """
+        Wait for the side effects, then for the write, running in the background.
+
+        :raises: the first exception one of them raised (once all of them are done)
+        """
+        try:
+            self.flush_side_effects()
+        finally:
+            self.flush_writes()
+
+
+@contextlib.contextmanager
+def running(tasks):
+    """
+    Run the side effects and writes submitted in the block (by `submit` and `write`)
+    as part of `tasks`.
+    """
+    token = _current.set(tasks)
+    try:
+        yield tasks
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """
+    :return: the Tasks of the pipeline running in this thread, or None
+    """
+    return _current.get()
+
+
+def submit(func, *args):
+    """
+    Run `func(*args)` in the background, as a side effect of the running pipeline
+    (see `Tasks.submit`).
+
+    :return: a concurrent.futures.Future of the result
+    """
+    return _tasks().submit(func, *args)
+
+
+def write(func, *args, backend="thread"):
+    """
+    Run `func(*args)`, which writes data to a file, in the background once the
+    running pipeline's previous write is done (see `Tasks.write`).
+
+    :raises: the exception the previous write raised, if any
+    :return: a concurrent.futures.Future of the result
+    """
+    return _tasks().write(func, *args, backend=backend)
+
+
+def flush_side_effects():
+    """
+    Wait for the side effects of the running pipeline, or outside any pipeline, for
+    all the side effects submitted so far, to finish.
+
+    :return: the list of their return values, in the order they were submitted
+    :raises: the first exception one of them raised (once all of them are done)
+    """
+    tasks = current()
+    if tasks is not None:
+        return tasks.flush_side_effects()
+    submitted = []
+    for tasks in _all():
+        with tasks._lock:
+            submitted.extend(tasks._submitted)
+            tasks._submitted.clear()
+        tasks._release()
+    submitted.sort(key=lambda pair: pair[0])
+    return _results([future for _, future in submitted])
+
+
+def flush_writes():
+    """
+    Wait for the write of the running pipeline, or outside any pipeline, for the
+    writes of all the pipelines, running in the background to finish.
+
+    :raises: the first exception one of them raised
+    """
+    tasks = current()
+    if tasks is not None:
+        tasks.flush_writes()
+        return
+    futures = []
+    for tasks in _all():
+        future, tasks._write = tasks._write, None
+        tasks._release()
+        if future is not None:
+            futures.append(future)
+    _results(futures)
+
+
+def _tasks():
+    """
+    :return: the Tasks of the running pipeline, or of work outside any pipeline
+    """
+    global _default
+    tasks = current()
+    if tasks is not None:
+        return tasks
+    with _lock:
+        if _default is None:
+            _default = Tasks()
+        return _default
+
+
+def _all():
+    with _lock:
+        return list(_holding)
+
+
+def _track(future):
+    """
+    Keep a future until something waits for it, unless it succeeds.
+    """
+    with _lock:
+        _unreported.add(future)
+
+    def done(future):
+        if not future.cancelled() and future.exception() is None:
+            with _lock:
+                _unreported.discard(future)
+
+    future.add_done_callback(done)
+
+
+def _results(futures):
+    """
+    Wait for futures to finish.
+
+    :return: the list of their results (None for those that failed)
+    :raises: the first exception one of them raised (once all of them are done)
+    """
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as exception:  # pylint: disable=broad-except
+            results.append(None)
+            error = error or exception
+        finally:
+            with _lock:
+                _unreported.discard(future)
+    if error is not None:
+        raise error
+    return results
+
+
+@atexit.register
+def _report():
+    """
+    Warn about the side effects and writes that failed without anything waiting for
+    them, once they are done.
+    """
+    with _lock:
+        futures = list(_unreported)
+        _unreported.clear()
+    for future in futures:
+        try:
+            future.result()
+        except Exception as exception:  # pylint: disable=broad-except
+            warnings.warn(
+                f"A background side effect or write failed: {exception!r}",
+                RuntimeWarning,
+            )
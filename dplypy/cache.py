@@ -0,0 +1,292 @@
+"""
+Persistent cache of the results of logical plans (see `DplyFrame.cache`).
+Results are keyed by a fingerprint of the plan's source (the contents of a pandas
+DataFrame, or the path, size and modification time of a file) and of each of its
+stages (the pipeline method and its arguments, with the code and captured variables
+of functions). They are stored as column directories (see `writers.write_columns`),
+which are memory-mapped when they are reused, and the least recently used ones are
+evicted once the cache exceeds its size limit.
+Reused results are reported with the `logging` module (logger "dplypy.cache").
+"""
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import types
+
+import numpy as np
+import pandas as pd
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import Stage
+from dplypy.readers import ColumnsSource
+from dplypy.writers import COLUMNS_SUFFIX, LAYOUT_FILE, write_columns
+
+_logger = logging.getLogger(__name__)
+
+# Cache directory used when none is given
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "dplypy")
+
+
+def fingerprint(value):
+    """
+    :return: a hexadecimal digest of the contents of a value: plain Python values,
+             pandas and numpy data, functions (their code, default arguments, and
+             the variables they capture or the globals they use), pipeline stages,
+             or any picklable object
+    :raises TypeError: if the value cannot be fingerprinted
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    _update(digest, value, set())
+    return digest.hexdigest()
+
+
+def _update(digest, value, seen):
+    """
+    Feed the contents of `value` into `digest`.
+
+    :param seen: ids of the functions being fingerprinted, which may refer to
+                 themselves
+    """
+    digest.update(type(value).__qualname__.encode())
+    if value is None or isinstance(
+        value, (bool, int, float, complex, str, bytes, np.generic, np.dtype)
+    ):
+        digest.update(repr(value).encode())
+    elif isinstance(value, (list, tuple)):
+        digest.update(str(len(value)).encode())
+        for item in value:
+            _update(digest, item, seen)
+    elif isinstance(value, dict):
+        _update(digest, list(value.items()), seen)
+    elif isinstance(value, (set, frozenset)):
+        for item in sorted(fingerprint(item) for item in value):
+            digest.update(item.encode())
+    elif isinstance(value, Stage):
+        _update(digest, (value.verb, value.params), seen)
+    elif isinstance(value, DplyFrame):
+        _update(digest, value.pandas_df, seen)
+    elif isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        _update_pandas(digest, value)
+    elif isinstance(value, np.ndarray):
+        digest.update(f"{value.dtype}{value.shape}".encode())
+        if value.dtype == object:
+            digest.update(_pickle(value))
+        else:
+            digest.update(np.ascontiguousarray(value).view(np.uint8))
+    elif isinstance(value, types.FunctionType):
+        _update_function(digest, value, seen)
+    elif isinstance(value, types.CodeType):
+        _update(digest, (value.co_code, value.co_consts, value.co_names), seen)
+    elif isinstance(value, functools.partial):
+        _update(digest, (value.func, value.args, value.keywords), seen)
+    elif isinstance(value, types.MethodType):
+        _update(digest, (value.__self__, value.__func__), seen)
+    elif isinstance(value, types.ModuleType):
+        digest.update(value.__name__.encode())
+    elif isinstance(value, (type, types.BuiltinFunctionType, np.ufunc)):
+        name = getattr(value, "__qualname__", value.__name__)
+        digest.update(f"{getattr(value, '__module__', None)}.{name}".encode())
+    else:
+        digest.update(_pickle(value))
+
+
+def _update_pandas(digest, value):
+    names = value.columns if isinstance(value, pd.DataFrame) else [value.name]
+    dtypes = value.dtypes if isinstance(value, pd.DataFrame) else [value.dtype]
+    _update(digest, (value.shape, list(names), [str(dtype) for dtype in dtypes]), set())
+    try:
+        hashes = pd.util.hash_pandas_object(value, index=True)
+    except TypeError:
+        # Unhashable values, e.g. lists
+        digest.update(_pickle(value))
+    else:
+        digest.update(hashes.to_numpy())
+
+
+def _update_function(digest, func, seen):
+    if id(func) in seen:
+        return
+    seen.add(id(func))
+    code = func.__code__
+    _update(
+        digest,
+        (func.__module__, func.__qualname__, code, func.__defaults__),
+        seen,
+    )
+    _update(digest, func.__kwdefaults__, seen)
+    for cell in func.__closure__ or ():
+        try:
+            _update(digest, cell.cell_contents, seen)
+        except ValueError:
+            # An empty cell: a variable the function captures but that is not set yet
+            pass
+    for name in sorted(_global_names(code)):
+        if name in func.__globals__:
+            _update(digest, (name, func.__globals__[name]), seen)
+
+
+def _global_names(code):
+    """
+    :return: the names a code object and the functions it defines may look up in
+             their globals (as well as attribute names, which are ignored)
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+
+def _pickle(value):
+    try:
+        return pickle.dumps(value, protocol=4)
+    except Exception as error:
+        raise TypeError(f"Cannot fingerprint {type(value).__name__} objects") from error
+
+
+def _name(stage):
+    return getattr(stage, "verb", getattr(stage, "__name__", type(stage).__name__))
+
+
+class ResultCache:
+    """
+    A directory of the results of logical plans, and of the plans they end.
+    """
+
+    def __init__(self, directory=None, max_bytes=2**30, every_stage=False):
+        """
+        :param directory: the directory of the cache, by default ~/.cache/dplypy
+        :param max_bytes: the size of the results kept in the cache, in bytes
+        :param every_stage: if true, cache the result of every stage, by running
+                            plans one stage at a time, rather than only the result
+                            of whole plans (which are optimized)
+        """
+        self.directory = directory or DEFAULT_DIRECTORY
+        self.max_bytes = max_bytes
+        self.every_stage = every_stage
+
+    def run(self, source, stages, execute):
+        """
+        Run a logical plan from the result of its longest prefix found in the cache,
+        and cache its result. A final sink (e.g. `write_file`) is run on the result,
+        rather than cached.
+
+        :param source: a pandas DataFrame, or a source object such as
+                       readers.CsvSource, with a `fingerprint()` method
+        :param stages: the stages of the plan, in execution order
+        :param execute: function(source, stages) running a plan
+        :return: what `execute` returns for the whole plan
+        """
+        sink = stages[-1] if stages and getattr(stages[-1], "sink", False) else None
+        body = stages[:-1] if sink is not None else list(stages)
+        keys = self._keys(source, body)
+
+        reused = 0
+        for length in range(len(body), 0, -1):
+            cached = self._load(keys[length])
+            if cached is not None:
+                source, reused = cached, length
+                break
+        if reused:
+            _logger.info(
+                "Reused the result of %d of %d stages (%s) from %s",
+                reused,
+                len(body),
+                ", ".join(_name(stage) for stage in body[:reused]),
+                self._path(keys[reused]),
+            )
+        else:
+            _logger.info("No cached result for any of %d stages", len(body))
+
+        pending = body[reused:]
+        if pending and self.every_stage:
+            result = source
+            for position, stage in enumerate(pending, reused + 1):
+                result = execute(result, [stage])
+                self._store(keys[position], result)
+        elif pending or not isinstance(source, pd.DataFrame):
+            result = execute(source, pending)
+            if pending:
+                self._store(keys[len(body)], result)
+        else:
+            result = source
+        if sink is None:
+            return result
+        return execute(result, [sink])
+
+    def _keys(self, source, stages):
+        """
+        :return: the keys of the results of each prefix of the plan, from the empty
+                 one, or None from the first stage that cannot be fingerprinted
+        """
+        keys = [None] * (len(stages) + 1)
+        try:
+            if isinstance(source, (pd.DataFrame, pd.Series)):
+                keys[0] = fingerprint(source)
+            else:
+                keys[0] = fingerprint(source.fingerprint())
+            for position, stage in enumerate(stages, 1):
+                keys[position] = fingerprint((keys[position - 1], stage))
+        except (AttributeError, TypeError) as error:
+            _logger.debug("Cannot cache the rest of the plan: %s", error)
+        return keys
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + COLUMNS_SUFFIX)
+
+    def _load(self, key):
+        """
+        :return: the memory-mapped result stored under `key`, or None
+        """
+        if key is None:
+            return None
+        layout = os.path.join(self._path(key), LAYOUT_FILE)
+        try:
+            # The modification time of the layout records when the result was used
+            os.utime(layout)
+            return ColumnsSource(self._path(key)).read()
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _store(self, key, pandas_df):
+        """
+        Store a result under `key`, then evict the least recently used results
+        """
+        if key is None or not isinstance(pandas_df, pd.DataFrame):
+            return
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        staging = f"{path}.{os.getpid()}.tmp"
+        write_columns(pandas_df, staging)
+        try:
+            os.replace(staging, path)
+        except OSError:
+            # Stored by another process in the meantime
+            shutil.rmtree(staging, ignore_errors=True)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(COLUMNS_SUFFIX):
+                continue
+            try:
+                used = os.path.getmtime(os.path.join(path, LAYOUT_FILE))
+                size = sum(
+                    os.path.getsize(os.path.join(path, file))
+                    for file in os.listdir(path)
+                )
+            except OSError:
+                continue
+            entries.append((used, size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,155 @@
+"""
+Compaction of the column types of DataFrames (see `compact` in pipeline.py).
+Strings with few distinct values become categoricals (and, optionally, the others
+Arrow-backed strings). Numbers keep their types unless asked for: arithmetic on
+narrower types can overflow or lose precision (e.g. `price * qty` in int8), so only
+the numeric columns named by the caller are downcast, integers to the smallest
+signed type holding all their values and floats to float32 when no value changes.
+The memory saved is reported with the `logging` module (logger "dplypy.compaction").
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+_logger = logging.getLogger(__name__)
+
+# Integer types, from the smallest. Unsigned types are not used: subtracting from
+# them wraps around instead of going negative
+_SIGNED = (np.int8, np.int16, np.int32, np.int64)
+
+# The pandas integer types with missing values, by numpy type
+_NULLABLE = {
+    np.int8: pd.Int8Dtype(),
+    np.int16: pd.Int16Dtype(),
+    np.int32: pd.Int32Dtype(),
+    np.int64: pd.Int64Dtype(),
+}
+
+
+def _smallest_integer(values, nullable):
+    """
+    :param values: the non-missing values of an integer column
+    :return: the smallest signed integer type holding them
+    """
+    if not len(values):
+        return None
+    low, high = values.min(), values.max()
+    for dtype in _SIGNED:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return _NULLABLE[dtype] if nullable else np.dtype(dtype)
+    return None
+
+
+def _compact_column(column, numeric, max_cardinality, arrow_strings):
+    """
+    :param numeric: whether a numeric column may be downcast
+    :return: the column with a smaller type, or None if it cannot be made smaller
+    """
+    dtype = column.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return None
+    if pd.api.types.is_integer_dtype(dtype):
+        if not numeric:
+            return None
+        nullable = isinstance(dtype, pd.api.extensions.ExtensionDtype)
+        values = column.dropna().to_numpy() if nullable else column.to_numpy()
+        smaller = _smallest_integer(values, nullable)
+        if smaller is None or smaller.itemsize >= dtype.itemsize:
+            return None
+        return column.astype(smaller)
+    if dtype == np.float64:
+        if not numeric:
+            return None
+        values = column.to_numpy()
+        downcast = values.astype(np.float32)
+        # Only if every value (including infinities and NaN) is kept exactly
+        if not np.array_equal(downcast.astype(np.float64), values, equal_nan=True):
+            return None
+        return pd.Series(downcast, index=column.index, name=column.name)
+    if dtype == object and pd.api.types.infer_dtype(column, skipna=True) == "string":
+        if column.nunique(dropna=True) <= max_cardinality * len(column):
+            return column.astype("category")
+        if arrow_strings:
+            return column.astype("string[pyarrow]")
+    return None
+
+
+def _convert_column(label, column, dtype):
+    """
+    :return: the column stored in `dtype`, or None if it already is
+    :raise ValueError: if that changes some of its values
+    """
+    try:
+        converted = column.astype(dtype)
+        unchanged = converted.astype(column.dtype).equals(column)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"Column {label!r} cannot be stored as {dtype}") from error
+    if not unchanged:
+        raise ValueError(
+            f"Column {label!r} cannot be stored as {dtype} without changing its values"
+        )
+    return None if converted.dtype == column.dtype else converted
+
+
+def compact_frame(
+    pandas_df, max_cardinality=0.5, arrow_strings=False, columns=None, dtypes=None
+):
+    """
+    Store the columns of a DataFrame in smaller types, without changing their values.
+    Numeric columns keep their types unless they are in `columns` or `dtypes`.
+
+    :param pandas_df: the DataFrame
+    :param max_cardinality: string columns whose number of distinct values is at
+                            most this fraction of their length become categoricals
+    :param arrow_strings: whether the other string columns become Arrow-backed
+                          strings (which requires pyarrow)
+    :param columns: numeric columns to downcast, integers to the smallest signed type
+                    holding their values and floats to float32 if no value changes
+    :param dtypes: a dictionary of the types to store columns in
+    :return: the compacted DataFrame, and a dictionary reporting the memory used
+             before and after (`before`, `after`, in bytes) and the labels of the
+             columns whose type changed (`columns`)
+    :raise KeyError: if `columns` or `dtypes` name a column the DataFrame lacks
+    :raise ValueError: if a type of `dtypes` changes values of its column
+    """
+    numeric = set(columns or ())
+    dtypes = dtypes or {}
+    missing = [c for c in list(numeric) + list(dtypes) if c not in pandas_df.columns]
+    if missing:
+        raise KeyError(f"Columns not found: {missing}")
+    before = int(pandas_df.memory_usage(index=True, deep=True).sum())
+    arrays, compacted = {}, []
+    for position, (label, column) in enumerate(pandas_df.items()):
+        if label in dtypes:
+            smaller = _convert_column(label, column, dtypes[label])
+        else:
+            smaller = _compact_column(
+                column, label in numeric, max_cardinality, arrow_strings
+            )
+        if smaller is not None:
+            compacted.append(label)
+        # Arrays rather than Series, which would be aligned on a (possibly not
+        # unique) index
+        arrays[position] = (column if smaller is None else smaller).array
+    result = pandas_df
+    if compacted:
+        # Columns are keyed by position until the frame is built: labels may repeat
+        result = pd.DataFrame(arrays, index=pandas_df.index, copy=False)
+        result.columns = pandas_df.columns
+    after = int(result.memory_usage(index=True, deep=True).sum())
+    report = {
+        "before": before,
+        "after": after,
+        "columns": compacted,
+    }
+    _logger.info(
+        "Compacted %d of %d columns from %d to %d bytes (%.0f%% saved)",
+        len(compacted),
+        pandas_df.shape[1],
+        before,
+        after,
+        100 * (before - after) / before if before else 0,
+    )
+    return result, report
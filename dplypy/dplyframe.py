@@ -1,6 +1,14 @@
 """DplyFrame represents the dataframe we want to transform."""
+import os
+import weakref
+
+import numpy as np
 import pandas as pd
 
+from dplypy.background import Tasks, current, running
+from dplypy.keyindex import KeyIndex
+from dplypy.profiling import call
+
 
 class DplyFrame:
     """
@@ -9,18 +17,293 @@ class DplyFrame:
     See pipeline.py for pipeline-function-specific documentation.
     """
 
-    def __init__(self, pandas_df: pd.DataFrame):
+    def __init__(self, pandas_df: pd.DataFrame, lazy=False):
         """
         Create a DplyFrame from a pandas DataFrame
         :param pandas_df: the data frame we wish to wrap
+        :param lazy: if true, `+` records pipeline stages in a logical plan
+                     instead of running them; see `collect()`
+        """
+        self._pandas_df = pandas_df
+        self._source = None
+        self._stages = [] if lazy else None
+        self._parallel = None
+        self._cache = None
+        # The lazy DplyFrame this one extends, the ones extending this one (by id),
+        # and the result of this one's plan while they share it (see `_shared_prefix`)
+        self._parent = None
+        self._children = weakref.WeakValueDictionary()
+        self._shared = None
+        self._ran = False
+        # Key columns set by `group_by`, for the `summarise` that follows
+        self._groups = []
+        # Indexes of join keys (see `index_keys`), by tuple of key columns: None when
+        # the data changed since the index was built
+        self._key_indexes = {}
+        # The side effects and writes this DplyFrame's pipeline runs in the background
+        # (see `_background`)
+        self._tasks = None
+
+    @classmethod
+    def _from_source(cls, source):
+        """
+        Create a lazy DplyFrame reading from a source that is not (yet) a pandas
+        DataFrame, e.g. the chunked CSV reader returned by `dplypy.readers.read_csv`
         """
-        self.pandas_df = pandas_df
+        frame = cls(None, lazy=True)
+        frame._source = source
+        return frame
+
+    @property
+    def pandas_df(self):
+        """
+        The wrapped pandas DataFrame.
+        Accessing it on a lazy DplyFrame runs (and caches) the pending plan.
+        """
+        if self._stages or self._source is not None:
+            self._pandas_df = self._execute(self._stages)
+            self._source = None
+            self._stages = []
+        return self._pandas_df
+
+    @pandas_df.setter
+    def pandas_df(self, pandas_df):
+        self._pandas_df = pandas_df
+        self._source = None
+        self._invalidate_key_indexes()
+        if self._stages is not None:
+            self._stages = []
+
+    @property
+    def is_lazy(self):
+        return self._stages is not None
+
+    @property
+    def stages(self):
+        """
+        The stages recorded in the logical plan that have not run yet.
+        Always empty for an eager DplyFrame.
+        """
+        return list(self._stages or [])
+
+    def lazy(self):
+        """
+        Return a lazy DplyFrame over the same data.
+        Stages added to it with `+` are only run by `collect()` or by a sink
+        (`write_file`, `count_null`).
+        """
+        if self.is_lazy:
+            return self
+        return DplyFrame(self._pandas_df, lazy=True)
+
+    def parallel(self, workers=None, backend="process"):
+        """
+        Return a lazy DplyFrame over the same data whose plan runs its row-local stages
+        (`select`, `filter`, `mutate` with expressions or `axis=1`, `drop`, `fill_na`,
+        `one_hot` with fixed categories...) in parallel: the rows are split into one
+        partition per worker (or, for a chunked source, handed to the workers chunk by
+        chunk), and the results are concatenated in the original order. Workers also
+        summarise their rows for decomposable aggregations (e.g. a `pivot_table` of
+        means), and the partial summaries are merged.
+
+        :param workers: number of workers, by default the number of CPUs
+        :param backend: "process" for a pool of processes (forked where the platform
+                        allows it, so that stages can use lambdas), or "thread" for a
+                        pool of threads (for stages that release the GIL)
+        """
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Unknown backend: {backend!r}")
+        frame = DplyFrame(self._pandas_df, lazy=True)
+        frame._source = self._source
+        frame._stages = self.stages
+        frame._parallel = (workers or os.cpu_count() or 1, backend)
+        frame._cache = self._cache
+        return frame
+
+    def cache(self, directory=None, max_bytes=2**30, every_stage=False):
+        """
+        Return a lazy DplyFrame over the same data whose plan results are cached on
+        disk (see cache.py). Running a plan reuses the result of its longest prefix
+        found in the cache, i.e. a plan with the same source data (the contents of a
+        pandas DataFrame, or the same unmodified file) and the same first stages
+        (pipeline methods and arguments, including the code of functions), and
+        caches its own result. A final sink runs on the cached result, which is then
+        materialized even for a chunked source. Reused results are logged (at the
+        INFO level, by the "dplypy.cache" logger).
+
+        :param directory: the directory of the cache, by default ~/.cache/dplypy
+        :param max_bytes: the size of the results kept in the cache, in bytes: the
+                          least recently used ones are evicted beyond it
+        :param every_stage: if true, cache the result of every stage, so that plans
+                            sharing only their first stages reuse them, at the cost
+                            of running plans one stage at a time (without the
+                            optimizations of `pipeline.optimize`)
+        """
+        # Deferred import: the cache module imports this one
+        from dplypy.cache import ResultCache
+
+        frame = DplyFrame(self._pandas_df, lazy=True)
+        frame._source = self._source
+        frame._stages = self.stages
+        frame._parallel = self._parallel
+        frame._cache = ResultCache(directory, max_bytes, every_stage)
+        return frame
+
+    def collect(self):
+        """
+        Run the pending logical plan and return an eager DplyFrame with the result.
+        For an eager DplyFrame, this is a no-op.
+        Either way, the side effects and writes its pipeline runs in the background are
+        waited for (not those of other pipelines).
+        """
+        if not self.is_lazy:
+            collected = self
+        else:
+            stages = self._stages
+            collected = DplyFrame(self.pandas_df)
+            if stages and getattr(stages[-1], "verb", None) == "group_by":
+                # Still grouped, for a `summarise` added to the collected DplyFrame
+                collected = stages[-1](collected)
+        if self._tasks is not None:
+            self._tasks.flush()
+        return collected
+
+    def index_keys(self, keys):
+        """
+        Build, once, an index of the rows of this DplyFrame by the values of its key
+        columns, which `join` then reuses whenever this DplyFrame is its right-hand
+        side and joined `on` these keys with `how="left"` (or, from pandas 2.2,
+        `"inner"`): only the keys of the left side are hashed (in the order of its
+        rows), and the matching rows are taken by position, rather than running the
+        whole `DataFrame.merge` machinery on both sides for each join. This suits
+        small lookup tables joined with many frames, or with the chunks of a chunked
+        source.
+        Setting a column (`frame[key] = value`) or the `pandas_df` of this DplyFrame
+        discards the index, which is rebuilt by the next join; changing the wrapped
+        pandas DataFrame in place does not, and must be followed by `index_keys`.
+
+        :param keys: the key column, or a list of key columns
+        :return: this DplyFrame (a lazy DplyFrame's plan is run)
+        """
+        keys = tuple(keys) if isinstance(keys, (list, tuple)) else (keys,)
+        self._key_indexes[keys] = KeyIndex(self.pandas_df, keys)
+        return self
+
+    def _key_index(self, keys):
+        """
+        :return: the index of the key columns `keys` (rebuilt if the data changed),
+                 or None if `index_keys` was not called for them
+        """
+        keys = tuple(keys)
+        if keys not in self._key_indexes:
+            return None
+        if self._key_indexes[keys] is None:
+            self._key_indexes[keys] = KeyIndex(self.pandas_df, keys)
+        return self._key_indexes[keys]
+
+    def _invalidate_key_indexes(self):
+        for keys in self._key_indexes:
+            self._key_indexes[keys] = None
+
+    def _background(self):
+        """
+        :return: the Tasks of the side effects and writes this DplyFrame's pipeline
+                 runs in the background: those of the pipeline it runs in, if any, or
+                 its own
+        """
+        if self._tasks is None:
+            self._tasks = current() or Tasks()
+        return self._tasks
+
+    def _extend(self, stage):
+        """
+        Return a new lazy DplyFrame whose plan is this one's followed by `stage`.
+        """
+        extended = DplyFrame(self._pandas_df, lazy=True)
+        extended._source = self._source
+        extended._stages = self._stages + [stage]
+        extended._parallel = self._parallel
+        extended._cache = self._cache
+        if self._stages:
+            extended._parent = self
+            self._children[id(extended)] = extended
+        return extended
+
+    def _shared_prefix(self, stages):
+        """
+        Find the longest prefix of a plan that several branches share, i.e. the plan
+        of the closest lazy DplyFrame this one was extended from that was extended
+        more than once, and run it only once: its result is kept until all the
+        branches have run.
+
+        :param stages: the stages this DplyFrame is about to run
+        :return: the number of stages of the prefix and its result, or None
+        """
+        # This DplyFrame, and the ones it extends up to the ancestor, have now run
+        self._ran = True
+        ancestor = self._parent
+        while ancestor is not None:
+            if ancestor._shared is not None or len(ancestor._children) > 1:
+                break
+            ancestor._ran = True
+            ancestor = ancestor._parent
+        else:
+            return None
+        prefix = ancestor._stages
+        if not prefix or any(a is not b for a, b in zip(prefix, stages)):
+            # The ancestor was materialized since
+            return None
+        if ancestor._shared is None:
+            result = ancestor._execute(prefix)
+            if not isinstance(result, (pd.DataFrame, pd.Series)):
+                return None
+            ancestor._shared = result
+        result = ancestor._shared
+        if not ancestor._pending():
+            ancestor._shared = None
+        return len(prefix), result
+
+    def _pending(self):
+        """
+        :return: whether a DplyFrame extended from this one has not run yet
+        """
+        for child in list(self._children.values()):
+            if child._stages and not child._ran or child._pending():
+                return True
+        return False
+
+    def _execute(self, stages):
+        """
+        Run `stages` in order on the source data and return the result of the last one:
+        the pandas DataFrame of a DplyFrame, or a sink's return value as-is
+        (None if the sink consumed the data chunk by chunk).
+        A prefix of the plan shared with other branches is only run once.
+        """
+        # Deferred import: the execution module imports this one
+        from dplypy.execution import execute
+
+        with running(self._background()):
+            shared = self._shared_prefix(stages)
+            if shared is not None:
+                # The branch runs on a read-only snapshot of the shared result, so that
+                # it cannot change it for the other branches, and what it returns is
+                # copied if it is (a view of) that snapshot
+                length, result = shared
+                if isinstance(result, pd.DataFrame):
+                    result = DplyFrame(result).snapshot().pandas_df
+                else:
+                    result = result.copy()
+                output = execute(result, stages[length:], self._parallel, self._cache)
+                return _writable(output)
+            source = self._source if self._source is not None else self._pandas_df
+            return execute(source, stages, self._parallel, self._cache)
 
     def __getitem__(self, item):
         return self.pandas_df[item]
 
     def __setitem__(self, key, value):
         self.pandas_df[key] = value
+        self._invalidate_key_indexes()
 
     def __eq__(d1, other):
         return d1.pandas_df == other
@@ -44,6 +327,9 @@ class DplyFrame:
         """
         Chain two or more pipline operations together.
         Important: here, `+` operator is NOT commutative
+        On a lazy DplyFrame, the operation is appended to the logical plan instead of
+        being run, unless it is a sink (e.g. `write_file`, `count_null`),
+        which runs the whole plan
         Example:
         ```
         read_csv("foo.csv") + drop(['X']) + query("A" > 1337) + write_csv("transformed_foo.csv")
@@ -52,10 +338,84 @@ class DplyFrame:
         :param d2_func: lazily evaluated DplyFrame (DplyFrame wrapped in a function)
                   returned by a pipeline method
         """
-        return d2_func(d1)
+        last = d1._stages[-1] if d1._stages else None
+        if d1._groups or getattr(last, "verb", None) == "group_by":
+            # Deferred import: the pipeline module imports this one
+            from dplypy.pipeline import _check_grouped
+
+            for stage in getattr(d2_func, "stages", [d2_func])[:1]:
+                _check_grouped(stage)
+        if not d1.is_lazy:
+            with running(d1._background()) as tasks:
+                if hasattr(d2_func, "stages"):
+                    # A pipeline.Pipeline: its stages are profiled one by one
+                    result = d2_func(d1)
+                else:
+                    result = call(d2_func, d1)
+            if isinstance(result, DplyFrame) and result._tasks is None:
+                # The same pipeline goes on with the result
+                result._tasks = tasks
+            return result
+        if hasattr(d2_func, "stages"):
+            # A pipeline.Pipeline: its stages are added to the plan one by one
+            for stage in d2_func.stages:
+                d1 = d1 + stage
+            return d1
+        if not getattr(d2_func, "sink", False):
+            return d1._extend(d2_func)
+        result = d1._execute(d1._stages + [d2_func])
+        if result is None:
+            # Streamed into the sink: nothing was materialized
+            return d1
+        if isinstance(result, pd.DataFrame):
+            output = DplyFrame(result, lazy=True)
+            output._parallel = d1._parallel
+            output._cache = d1._cache
+            output._tasks = d1._tasks
+            return output
+        return result
 
     def deep_copy(self):
         return DplyFrame(self.pandas_df.copy(deep=True))
 
+    def snapshot(self):
+        """
+        Return a DplyFrame sharing this one's data without being able to change it.
+        Its columns are read-only views of this DplyFrame's arrays (extension arrays,
+        e.g. categoricals, cannot be made read-only and are copied): columns can be
+        added, dropped or replaced on the snapshot, but writing values in place
+        raises a ValueError ("assignment destination is read-only").
+        """
+        pandas_df = self.pandas_df
+        manager = pandas_df._mgr.apply(_read_only)
+        if hasattr(pandas_df, "_constructor_from_mgr"):
+            # pandas >= 2.1 deprecates passing a manager to the constructor
+            return DplyFrame(pandas_df._constructor_from_mgr(manager, manager.axes))
+        return DplyFrame(pandas_df._constructor(manager))
+
     def __repr__(self):
         return self.pandas_df.to_string()
+
+
+def _read_only(values):
+    """
+    :return: a read-only view of a numpy array, or a copy of an extension array
+    """
+    if isinstance(values, np.ndarray):
+        values = values.view()
+        values.flags.writeable = False
+        return values
+    return values.copy()
+
+
+def _writable(output):
+    """
+    :return: a pandas object whose arrays are read-only (views), copied, or any other
+             value as-is
+    """
+    if isinstance(output, (pd.DataFrame, pd.Series)) and any(
+        isinstance(values, np.ndarray) and not values.flags.writeable
+        for values in output._mgr.arrays
+    ):
+        return output.copy()
+    return output
@@ -0,0 +1,606 @@
+"""
+Execution of the logical plans recorded by lazy DplyFrames.
+Plans are optimized (see `pipeline.optimize`), then run on the plan's source:
+a pandas DataFrame, or a chunked source (see readers.py) whose leading row-local
+stages and out-of-core sorts and joins are streamed chunk by chunk.
+Grouped aggregations with decomposable functions (e.g. means, from sums and counts)
+are computed from partial summaries of the chunks.
+Runs of row-local stages, and the partial summaries, can be spread over a pool of
+workers (see `DplyFrame.parallel`). Aggregations that cannot be decomposed run on all
+the rows at once, with an UndecomposableWarning.
+"""
+import collections
+import functools
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dplypy.aggregate import (
+    decomposable,
+    final_summary,
+    merge_summaries,
+    partial_summary,
+    pivot_aggregations,
+    pivot_summary,
+)
+from dplypy.background import flush_side_effects, flush_writes, write
+from dplypy.dplyframe import DplyFrame
+from dplypy.external import join_chunks, sort_chunks, split_rows
+from dplypy.pipeline import (
+    Stage,
+    optimize,
+    _as_list,
+    _check_groups,
+    _drops_columns_only,
+    _has_fixed_categories,
+    _is_expression_mutate,
+    _right_frame,
+)
+from dplypy.profiling import call
+from dplypy.writers import COLUMNAR_SUFFIXES, ColumnarWriter
+
+
+class UndecomposableWarning(UserWarning):
+    """
+    Warned when a grouped aggregation of a chunked or parallel plan cannot be computed
+    from partial summaries, and runs on all its rows at once instead
+    """
+
+
+def execute(source, stages, parallel=None, cache=None, optimized=False):
+    """
+    Optimize and run a logical plan.
+
+    :param source: a pandas DataFrame, or a source object such as readers.CsvSource
+    :param stages: the stages of the plan, in execution order
+    :param parallel: None, or the number of workers and the backend ("process" or
+                     "thread") to run row-local stages with
+    :param cache: None, or the cache.ResultCache to reuse and store results in
+    :param optimized: whether the stages are already optimized for the source's
+                      columns (see `pipeline.Pipeline.compile`)
+    :return: the pandas DataFrame the plan produces, or the return value of its
+             final sink (None if the sink consumed the data chunk by chunk)
+    :raises ValueError: if a `group_by` is followed by a stage other than `summarise`
+    """
+    if not optimized:
+        _check_groups(stages)
+    if cache is not None:
+        run = functools.partial(execute, parallel=parallel, optimized=optimized)
+        return cache.run(source, stages, run)
+
+    if isinstance(source, (pd.DataFrame, pd.Series)):
+        columns = getattr(source, "columns", None)
+        if not optimized:
+            stages = optimize(stages, None if columns is None else list(columns))
+        return _run(DplyFrame(source), stages, parallel)
+
+    if not optimized:
+        stages = optimize(stages, list(source.columns))
+    columns, stages = _select_at_source(source, stages)
+    if not source.chunksize:
+        return _run(DplyFrame(source.read(columns)), stages, parallel)
+
+    chunks, rest = _stream(source.chunks(columns), stages, parallel)
+    if len(rest) == 1 and _is_streamable_sink(rest[0]):
+        return _stream_into(rest[0], chunks)
+    if rest and parallel is None:
+        # Streaming may have stopped at an aggregation that cannot be decomposed
+        # (_run warns about those of parallel plans)
+        _warn_undecomposable(rest, 0)
+    return _run(DplyFrame(pd.concat(chunks)), rest, parallel)
+
+
+def iter_chunks(frame, memory_limit):
+    """
+    Produce the rows of a DplyFrame as a stream of pandas DataFrames.
+    A lazy DplyFrame reading a chunked source is streamed chunk by chunk if its whole
+    plan can be; otherwise the DplyFrame is split into chunks of about `memory_limit`
+    bytes.
+
+    :param frame: a DplyFrame
+    :param memory_limit: the size of the chunks, in bytes, for split DplyFrames
+    :return: an iterable of pandas DataFrames
+    """
+    source = frame._source
+    if source is not None and source.chunksize:
+        stages = optimize(frame.stages, list(source.columns))
+        columns, stages = _select_at_source(source, stages)
+        chunks, rest = _stream(source.chunks(columns), stages, frame._parallel)
+        if not rest:
+            return chunks
+    return split_rows(frame.pandas_df, memory_limit)
+
+
+def _select_at_source(source, stages):
+    """
+    Let the source select the columns of a leading projection, if it can.
+
+    :return: the columns to read (None for all of them), and the remaining stages
+    """
+    if stages and _is_projection(stages[0]) and source.can_select():
+        return stages[0].params["columns"], stages[1:]
+    return None, stages
+
+
+def _stream(chunks, stages, parallel=None):
+    """
+    Run the leading stages of a plan that can be streamed (row-local stages, and
+    out-of-core sorts and joins) on a stream of chunks.
+
+    :return: the stream of resulting chunks, and the stages left to run
+    """
+    streamed = 0
+    while streamed < len(stages):
+        stage = stages[streamed]
+        params = getattr(stage, "params", None)
+        if is_row_local(stage) or _aggregation(stages, streamed) is not None:
+            local = _row_local_run(stages, streamed)
+            streamed += len(local)
+            aggregation = _aggregation(stages, streamed)
+            if aggregation is not None:
+                # Chunks are summarised as they come, then merged
+                local = local + [aggregation.partial]
+                streamed += aggregation.length
+            if parallel is None:
+                chunks = map(functools.partial(_run_local, stages=local), chunks)
+            else:
+                chunks = _parallel_map(local, chunks, *parallel)
+            if aggregation is not None:
+                chunks = iter([aggregation.merge(chunks)])
+            continue
+        if _is_out_of_core(stage, "arrange"):
+            chunks = sort_chunks(
+                chunks,
+                params["by"],
+                params["ascending"],
+                params["memory_limit"],
+                params["spill_dir"],
+            )
+        elif _is_out_of_core(stage, "join"):
+            chunks = join_chunks(
+                chunks,
+                iter_chunks(_right_frame(params), params["memory_limit"]),
+                params["how"],
+                params["on"],
+                params["left_on"],
+                params["right_on"],
+                params["sort"],
+                params["suffixes"],
+                params["memory_limit"],
+                params["spill_dir"],
+            )
+        else:
+            break
+        streamed += 1
+    return chunks, stages[streamed:]
+
+
+def _run(frame, stages, parallel=None):
+    """
+    Run `stages` in order on `frame`.
+
+    :return: the pandas DataFrame of the result, or a sink's return value as-is
+    """
+    position = 0
+    while position < len(stages):
+        stage = stages[position]
+        aggregation = _aggregation(stages, position)
+        if parallel is not None and (is_row_local(stage) or aggregation is not None):
+            local = _row_local_run(stages, position)
+            position += len(local)
+            aggregation = _aggregation(stages, position)
+            if aggregation is None:
+                results = _run_partitioned(frame.pandas_df, local, *parallel)
+                frame = DplyFrame(pd.concat(results))
+            else:
+                local = local + [aggregation.partial]
+                results = _run_partitioned(frame.pandas_df, local, *parallel)
+                frame = DplyFrame(aggregation.merge(results))
+                position += aggregation.length
+        else:
+            if parallel is not None:
+                _warn_undecomposable(stages, position)
+            frame = call(stage, frame)
+            position += 1
+    if isinstance(frame, DplyFrame):
+        return frame.pandas_df
+    return frame
+
+
+def _row_local_run(stages, start):
+    """
+    :return: the longest run of row-local stages starting at `start`
+    """
+    end = start
+    while end < len(stages) and is_row_local(stages[end]):
+        end += 1
+    return stages[start:end]
+
+
+def _run_local(chunk, stages):
+    """
+    Run row-local `stages` on a chunk of rows.
+
+    :return: the resulting pandas DataFrame
+    """
+    for stage in stages:
+        if stage.verb == "filter":
+            # The boolean Series covers all the rows, not just this chunk's
+            mask = stage.params["boolean_series"].reindex(chunk.index)
+            chunk = chunk[mask]
+        else:
+            chunk = call(stage, DplyFrame(chunk)).pandas_df
+    return chunk
+
+
+def _run_partitioned(pandas_df, stages, workers, backend):
+    """
+    Run row-local `stages` on a DataFrame split into one partition of rows per worker.
+
+    :return: the list of the results for each partition, in order
+    """
+    count = min(workers, len(pandas_df))
+    if count <= 1:
+        return [_run_local(pandas_df, stages)]
+    bounds = np.linspace(0, len(pandas_df), count + 1).astype(int)
+    partitions = (pandas_df.iloc[start:end] for start, end in zip(bounds, bounds[1:]))
+    return list(_parallel_map(stages, partitions, workers, backend))
+
+
+class _Aggregation:
+    """
+    A grouped aggregation (`pivot_table`, or `summarise` and the `group_by` before it)
+    computed from partial summaries of chunks of rows (see aggregate.py).
+    """
+
+    def __init__(self, keys, aggregations, dropna, finish, length):
+        """
+        :param keys: list of the labels of the key columns
+        :param aggregations: the aggregations, as for `aggregate.partial_summary`
+        :param dropna: whether rows with missing keys are left out
+        :param finish: function building the result of the stages from the final
+                       summary and the types of the columns of the rows
+        :param length: number of stages of the plan the aggregation stands for
+        """
+        self.keys = keys
+        self.aggregations = aggregations
+        self.dropna = dropna
+        self.finish = finish
+        self.length = length
+        # Row-local, for _run_local (the boolean Series of filters aside)
+        self.partial = Stage(
+            lambda d1: DplyFrame(
+                partial_summary(d1.pandas_df, keys, aggregations, dropna)
+            ),
+            "partial_summary",
+            {"keys": keys, "aggregations": aggregations, "dropna": dropna},
+        )
+
+    def merge(self, partials):
+        """
+        :param partials: iterable of the partial summaries of the chunks, in order
+        :return: the pandas DataFrame the aggregation produces
+        """
+        summary = merge_summaries(partials, self.keys, self.aggregations, self.dropna)
+        return self.finish(
+            final_summary(summary, self.aggregations), summary.attrs["dtypes"]
+        )
+
+
+def _aggregation(stages, position):
+    """
+    :return: an _Aggregation for the grouped aggregation at `position` in the plan,
+             if its functions are decomposable; else None
+    """
+    if position >= len(stages) or not isinstance(stages[position], Stage):
+        return None
+    stage = stages[position]
+    params = stage.params
+    if stage.verb == "pivot_table":
+        decomposed = pivot_aggregations(
+            params["values"],
+            params["index"],
+            params["columns"],
+            params["aggfunc"],
+            params["dropna"],
+        )
+        if decomposed is None:
+            return None
+
+        def finish(summary, dtypes):
+            return pivot_summary(
+                summary,
+                dtypes,
+                params["values"],
+                params["index"],
+                params["columns"],
+                params["fill_value"],
+                params["dropna"],
+            )
+
+        return _Aggregation(*decomposed, finish, 1)
+
+    keys, length = [], 1
+    if stage.verb == "group_by":
+        keys, length = _as_list(params["keys"]), 2
+        stage = stages[position + 1] if position + 1 < len(stages) else None
+    if not isinstance(stage, Stage) or stage.verb != "summarise":
+        return None
+    aggregations = stage.params["aggregations"]
+    if not all(
+        spec == "size" or decomposable(spec[1]) for spec in aggregations.values()
+    ):
+        return None
+    return _Aggregation(keys, aggregations, True, lambda summary, _: summary, length)
+
+
+def _warn_undecomposable(stages, position):
+    """
+    Warn if the stage at `position` in the plan is a grouped aggregation (the
+    `group_by` of a `summarise`, or a `pivot_table`) that cannot be computed from
+    partial summaries, naming it and its aggregation functions.
+    """
+    if _aggregation(stages, position) is not None:
+        return
+    stage = stages[position]
+    if not isinstance(stage, Stage):
+        return
+    if stage.verb == "group_by" and position + 1 < len(stages):
+        stage = stages[position + 1]
+    elif stage.verb == "summarise" and position > 0:
+        # Warned about at its group_by
+        previous = stages[position - 1]
+        if isinstance(previous, Stage) and previous.verb == "group_by":
+            return
+    if not isinstance(stage, Stage):
+        return
+    if stage.verb == "pivot_table":
+        funcs = [stage.params["aggfunc"]]
+        if decomposable(funcs[0]) not in (None, "size"):
+            funcs = []
+    elif stage.verb == "summarise":
+        funcs = [
+            spec[1]
+            for spec in stage.params["aggregations"].values()
+            if spec != "size" and decomposable(spec[1]) is None
+        ]
+    else:
+        return
+    if funcs:
+        names = ", ".join(
+            repr(func)
+            if isinstance(func, str)
+            else getattr(func, "__name__", repr(func))
+            for func in funcs
+        )
+        reason = f"aggfunc {names}"
+    else:
+        reason = "values or keys that are not column labels"
+    warnings.warn(
+        f"{stage.verb} with {reason} cannot be computed from partial summaries of "
+        "chunks or partitions of rows: it runs on all the rows at once",
+        UndecomposableWarning,
+    )
+
+
+# The stages run by the processes of a pool (set when they start)
+_worker_stages = None
+
+# The pipeline applied by the processes of a pool, and its inputs (set when they start)
+_worker_pipeline = None
+_worker_inputs = None
+
+
+def _start_worker(stages):
+    global _worker_stages
+    _worker_stages = stages
+
+
+def _run_in_worker(chunk):
+    return _run_local(chunk, _worker_stages)
+
+
+def _parallel_map(stages, chunks, workers, backend):
+    """
+    Run row-local `stages` on each chunk of a stream in a pool of `workers` threads
+    or processes. Processes are forked where the platform allows it, so that the
+    stages (often closures or lambdas) do not have to be pickled: only the chunks are.
+    At most two chunks per worker are in flight at once.
+
+    :return: a generator of the resulting pandas DataFrames, in order
+    """
+    if backend == "thread":
+        executor = ThreadPoolExecutor(workers)
+        run = functools.partial(_run_local, stages=stages)
+    else:
+        fork = "fork" in multiprocessing.get_all_start_methods()
+        executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("fork" if fork else None),
+            initializer=_start_worker,
+            initargs=(stages,),
+        )
+        run = _run_in_worker
+    with executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(run, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _apply(data, pipeline):
+    """
+    Apply a pipeline to a DplyFrame or a pandas DataFrame.
+
+    :return: the pandas DataFrame of the result, or a sink's return value as-is
+    """
+    frame = data if isinstance(data, DplyFrame) else DplyFrame(data)
+    result = frame + pipeline
+    if isinstance(result, DplyFrame):
+        return result.pandas_df
+    return result
+
+
+def _start_pipeline_worker(pipeline, inputs):
+    global _worker_pipeline, _worker_inputs
+    _worker_pipeline, _worker_inputs = pipeline, inputs
+
+
+def _apply_in_worker(position):
+    return _apply(_worker_inputs[position], _worker_pipeline)
+
+
+def map_pipeline(pipeline, inputs, workers, backend):
+    """
+    Apply a pipeline to each of `inputs` in a pool of `workers` threads or processes.
+    Processes are forked where the platform allows it, so that neither the pipeline
+    nor the inputs have to be pickled: only the results are.
+
+    :param inputs: a list of DplyFrames (possibly lazy) or pandas DataFrames
+    :return: the list of the results, in order: DplyFrames, or sinks' return values
+    """
+    if backend == "thread":
+        executor = ThreadPoolExecutor(workers)
+        run = functools.partial(_apply, pipeline=pipeline)
+        arguments = inputs
+    else:
+        fork = "fork" in multiprocessing.get_all_start_methods()
+        executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("fork" if fork else None),
+            initializer=_start_pipeline_worker,
+            initargs=(pipeline, inputs),
+        )
+        run = _apply_in_worker
+        arguments = range(len(inputs))
+    with executor:
+        results = list(executor.map(run, arguments))
+    return [
+        DplyFrame(result) if isinstance(result, (pd.DataFrame, pd.Series)) else result
+        for result in results
+    ]
+
+
+def _is_projection(stage):
+    return isinstance(stage, Stage) and stage.verb == "project"
+
+
+def is_row_local(stage):
+    """
+    :return: whether running `stage` on consecutive chunks of rows and concatenating
+             the results gives the same result as running it on all rows at once
+    """
+    if not isinstance(stage, Stage):
+        return False
+    params = stage.params
+    if stage.verb in ("select", "project"):
+        return True
+    if stage.verb == "filter":
+        return isinstance(params["boolean_series"], pd.Series)
+    if stage.verb == "mutate":
+        if params["exprs"]:
+            return _is_expression_mutate(stage)
+        return params["axis"] in (1, "columns")
+    if stage.verb == "drop":
+        return _drops_columns_only(params)
+    if stage.verb == "drop_na":
+        return params["axis"] in (0, "index")
+    if stage.verb == "fill_na":
+        return (
+            params["method"] is None
+            and params["limit"] is None
+            and params["axis"] in (0, "index")
+        )
+    if stage.verb == "one_hot":
+        # Without fixed categories, the indicator columns depend on the chunk
+        return _has_fixed_categories(params) and "query_str" not in params
+    return False
+
+
+def _is_out_of_core(stage, verb):
+    """
+    :return: whether a stage is an out-of-core `arrange` or `join` (given a
+             `memory_limit`), which can consume and produce a stream of chunks
+    """
+    return (
+        isinstance(stage, Stage)
+        and stage.verb == verb
+        and stage.params["memory_limit"] is not None
+        and not {"head", "tail", "slice_row", "query_str"} & set(stage.params)
+    )
+
+
+def _is_streamable_sink(stage):
+    """
+    :return: whether a sink can consume a plan's output chunk by chunk
+    """
+    if not isinstance(stage, Stage):
+        return False
+    if stage.verb == "count_null":
+        return stage.params["index"] is None
+    if stage.verb == "write_file":
+        return stage.params["file_path"].endswith((".csv",) + COLUMNAR_SUFFIXES)
+    return False
+
+
+def _stream_into(sink, chunks):
+    """
+    Feed the chunks of a plan's output into a streamable sink.
+
+    :return: the total for `count_null`, None for `write_file`
+    """
+    if sink.verb == "count_null":
+        return sum(call(sink, DplyFrame(chunk)) for chunk in chunks)
+
+    flush_side_effects()
+    params = sink.params
+    path, sep, index = params["file_path"], params["sep"], params["index"]
+    # A columnar file stays open from one chunk to the next, in this process
+    backend = params["backend"] if path.endswith(".csv") else "thread"
+
+    def run(func, *args):
+        if params["background"]:
+            # The next chunk is computed while this one is written
+            write(func, *args, backend=backend)
+        else:
+            flush_writes()
+            func(*args)
+
+    if path.endswith(".csv"):
+        for number, chunk in enumerate(chunks):
+            run(_append_csv, chunk, path, sep, index, number)
+        return None
+
+    writer = ColumnarWriter(
+        path, index, params["compression"], params["row_group_size"]
+    )
+    try:
+        for chunk in chunks:
+            run(writer.write, chunk)
+    except Exception:
+        try:
+            flush_writes()
+        finally:
+            writer.close()
+        raise
+    run(writer.close)
+    return None
+
+
+def _append_csv(chunk, file_path, sep, index, number):
+    """
+    Write the `number`-th chunk of a stream to a CSV file
+    """
+    chunk.to_csv(
+        file_path,
+        sep=sep,
+        index=index,
+        mode="w" if number == 0 else "a",
+        header=number == 0,
+    )
@@ -0,0 +1,578 @@
+"""
+Out-of-core algorithms for data that does not fit in memory.
+Data flows through them as iterables of pandas DataFrames ("chunks"), and whatever
+does not fit in the memory budget is spilled to temporary files.
+"""
+import itertools
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Hidden column holding the original position of each row, used to break ties
+_ROW = "__dplypy_row__"
+
+# Maximum number of sorted runs merged at once
+_FAN_IN = 16
+
+# Minimum number of rows per spilled block, so that tiny budgets do not make
+# the merge go one row at a time
+_MIN_BLOCK_ROWS = 1000
+
+
+def split_rows(pandas_df, memory_limit):
+    """
+    Split a DataFrame into chunks of consecutive rows using about `memory_limit` bytes.
+
+    :param pandas_df: the DataFrame to split
+    :param memory_limit: the size of the chunks, in bytes
+    :return: a generator of DataFrames
+    """
+    nbytes = max(int(pandas_df.memory_usage(deep=True).sum()), 1)
+    rows = max(1, len(pandas_df) * memory_limit // nbytes)
+    for start in range(0, max(len(pandas_df), 1), rows):
+        yield pandas_df.iloc[start : start + rows]
+
+
+def sort_chunks(chunks, by, ascending=True, memory_limit=2**30, spill_dir=None):
+    """
+    Sort a stream of chunks with an external merge sort: rows are buffered until they
+    use `memory_limit` bytes, sorted and spilled to a temporary file, and the sorted
+    runs are then merged (at most 16 at a time) back into a stream of chunks.
+    Like `arrange`, the sort is stable and places missing values last.
+
+    :param chunks: iterable of DataFrames, the rows to sort in order
+    :param by: label or list of labels to sort by
+    :param ascending: bool or list of bools, one per label
+    :param memory_limit: number of bytes of rows to hold in memory at once
+    :param spill_dir: directory for the temporary files (default: the system's)
+    :return: a generator of sorted DataFrames; at least one, possibly empty
+    """
+    keys = list(by) if isinstance(by, (list, tuple)) else [by]
+    if isinstance(ascending, (list, tuple)):
+        orders = list(ascending)
+    else:
+        orders = [ascending] * len(keys)
+
+    def sort(pandas_df):
+        # Ties are already in the order of the original positions
+        return pandas_df.sort_values(keys, ascending=orders, kind="stable")
+
+    with tempfile.TemporaryDirectory(dir=spill_dir, prefix="dplypy-sort-") as tmp:
+        empty, runs = None, []
+        buffered, nbytes, position = [], 0, 0
+        for chunk in chunks:
+            if empty is None:
+                empty = chunk.iloc[:0]
+            if not len(chunk):
+                continue
+            chunk = chunk.assign(**{_ROW: np.arange(position, position + len(chunk))})
+            position += len(chunk)
+            buffered.append(chunk)
+            nbytes += int(chunk.memory_usage(deep=True).sum())
+            if nbytes >= memory_limit:
+                runs.append(_spill(sort(pd.concat(buffered)), tmp, memory_limit))
+                buffered, nbytes = [], 0
+        if buffered:
+            runs.append(_spill(sort(pd.concat(buffered)), tmp, memory_limit))
+
+        while len(runs) > _FAN_IN:
+            runs = [
+                _spill_blocks(
+                    _merge_runs(
+                        runs[i : i + _FAN_IN], keys + [_ROW], orders + [True], sort
+                    ),
+                    tmp,
+                )
+                for i in range(0, len(runs), _FAN_IN)
+            ]
+        produced = False
+        for block in _merge_runs(runs, keys + [_ROW], orders + [True], sort):
+            produced = True
+            yield block.drop(columns=_ROW)
+        if not produced and empty is not None:
+            yield empty
+
+
+def _spill(sorted_df, directory, memory_limit):
+    """
+    Write a sorted run to a temporary file, in blocks small enough for
+    `_FAN_IN` of them to be merged within `memory_limit` bytes
+    (but of at least `_MIN_BLOCK_ROWS` rows).
+
+    :return: the path of the file
+    """
+    nbytes = max(int(sorted_df.memory_usage(deep=True).sum()), 1)
+    block_rows = max(
+        _MIN_BLOCK_ROWS, len(sorted_df) * memory_limit // (2 * _FAN_IN * nbytes)
+    )
+    return _spill_blocks(
+        (
+            sorted_df.iloc[start : start + block_rows]
+            for start in range(0, len(sorted_df), block_rows)
+        ),
+        directory,
+    )
+
+
+def _spill_blocks(blocks, directory):
+    """
+    Write a sequence of DataFrames to a temporary file, one pickle after another.
+
+    :return: the path of the file
+    """
+    descriptor, path = tempfile.mkstemp(dir=directory, suffix=".pkl")
+    with os.fdopen(descriptor, "wb") as file:
+        for block in blocks:
+            if len(block):
+                pickle.dump(block, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_blocks(path):
+    """
+    Read back the DataFrames written by `_spill_blocks`, one at a time,
+    and delete the file once they have all been read.
+    """
+    with open(path, "rb") as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                break
+    os.remove(path)
+
+
+def _merge_runs(paths, keys, orders, sort):
+    """
+    Merge sorted runs into a single sorted stream of blocks.
+    Rows are totally ordered (the original position breaks ties), so all the loaded
+    rows that sort before the last loaded row of every run can be output: the rows
+    still on disk sort after it. Since the loaded rows of each run are sorted, they
+    are found with a binary search on each key in turn (see `_count_up_to`), and
+    only the rows output are sorted again.
+    Runs hold consecutive rows, so `sort` only has to sort by the labels (not by
+    the original position) if the rows of earlier runs are placed first.
+
+    :param paths: the files holding the runs
+    :param keys: the labels to sort by, ending with the original position
+    :param orders: whether each label is sorted in ascending order
+    :param sort: function sorting a DataFrame by the labels, with a stable sort
+    """
+    readers = [_read_blocks(path) for path in paths]
+    # Runs are spilled in blocks small enough for _FAN_IN of them to fit in memory
+    count = max(1, _FAN_IN // max(len(paths), 1))
+    loaded = {}
+    for number, reader in enumerate(readers):
+        run = _load(reader, keys, count)
+        if run is not None:
+            loaded[number] = run
+    while loaded:
+        bound_run, bound = None, None
+        for number, (_, values, _) in loaded.items():
+            end = _last_row(values)
+            if bound is None or _count_up_to(end, orders, bound):
+                bound_run, bound = number, end
+
+        output = []
+        for number, (pandas_df, values, start) in loaded.items():
+            end = _count_up_to(values, orders, bound)
+            output.append(pandas_df.iloc[start:end])
+            loaded[number][2] = end
+        yield sort(pd.concat(output))
+
+        run = _load(readers[bound_run], keys, count)
+        if run is None:
+            del loaded[bound_run]
+        else:
+            loaded[bound_run] = run
+
+
+def _load(reader, keys, count):
+    """
+    Read the next `count` blocks of a sorted run.
+
+    :return: a list holding the rows, their sort keys (see `_key_values`), and the
+             position of the first row not yet output; None if the run is finished
+    """
+    blocks = [block for _, block in zip(range(count), reader)]
+    if not blocks:
+        return None
+    pandas_df = pd.concat(blocks)
+    return [pandas_df, _key_values(pandas_df, keys), 0]
+
+
+def _key_values(pandas_df, keys):
+    """
+    :return: the sort keys of the rows, as one (values, missing) pair of arrays per
+             key: the values as they are sorted (the category codes of categorical
+             keys), and whether each of them is missing (None if none is)
+    """
+    columns = []
+    for key in keys:
+        column = pandas_df[key]
+        missing = column.isna().to_numpy()
+        missing = missing if missing.any() else None
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            columns.append((column.cat.codes.to_numpy(), missing))
+        else:
+            columns.append((column.to_numpy(), missing))
+    return columns
+
+
+def _last_row(values):
+    """
+    :param values: the sort keys of rows (see `_key_values`)
+    :return: the sort keys of the last row, in the same form
+    """
+    last = []
+    for column, missing in values:
+        if missing is not None and missing[-1]:
+            last.append((column[-1:], missing[-1:]))
+        else:
+            last.append((column[-1:], None))
+    return last
+
+
+def _count_up_to(values, orders, bound):
+    """
+    Count the rows of a sorted run that sort before a row, or are equal to it, in the
+    order of `DataFrame.sort_values` (missing values last).
+
+    :param values: the sort keys of the rows (see `_key_values`), sorted
+    :param orders: whether each key is sorted in ascending order
+    :param bound: the sort keys of the row, as for `values`
+    :return: the number of rows
+    """
+    # The rows from `low` to `high` have the same keys as the row so far
+    low, high = 0, len(values[0][0]) if values else 0
+    for (column, missing), ascending, (value, value_missing) in zip(
+        values, orders, bound
+    ):
+        # Within rows with equal previous keys, missing values come last
+        present = high
+        if missing is not None:
+            present = low + int(np.searchsorted(missing[low:high], True))
+        if value_missing is not None:
+            low = present
+            continue
+        column = column[low:present]
+        if ascending:
+            first = np.searchsorted(column, value[0], "left")
+            last = np.searchsorted(column, value[0], "right")
+        else:
+            reverse = column[::-1]
+            first = len(column) - np.searchsorted(reverse, value[0], "right")
+            last = len(column) - np.searchsorted(reverse, value[0], "left")
+        low, high = low + int(first), low + int(last)
+    return high
+
+
+# Hidden columns holding the original positions of the rows of each side of a join
+_LEFT = "__dplypy_left__"
+_RIGHT = "__dplypy_right__"
+
+# Hidden columns holding the first positions, on each side, of the key of each row
+_FIRST_LEFT = "__dplypy_first_left__"
+_FIRST_RIGHT = "__dplypy_first_right__"
+
+# Maximum number of times a partition too large for the memory budget is split again
+_MAX_DEPTH = 3
+
+# From pandas 2.2, merges follow their documented order: inner joins keep the order of
+# the left rows, and outer joins sort the keys; before, both group the rows by key, in
+# the order the keys first appear on the left side, then on the right side
+_DOCUMENTED_MERGE_ORDER = tuple(
+    int(part) for part in pd.__version__.split(".")[:2]
+) >= (2, 2)
+
+
+def join_chunks(
+    left_chunks,
+    right_chunks,
+    how="inner",
+    on=None,
+    left_on=None,
+    right_on=None,
+    sort=False,
+    suffixes=("_x", "_y"),
+    memory_limit=2**30,
+    spill_dir=None,
+):
+    """
+    Join two streams of chunks with a grace hash join: the rows of both sides are
+    hash-partitioned on the join keys into 16 temporary files each, and matching pairs
+    of partitions are then joined one at a time with `DataFrame.merge`. Pairs that do
+    not fit in `memory_limit` bytes are partitioned again (up to 3 times, as rows with
+    equal keys cannot be split). The joined rows are put back in the order of
+    `DataFrame.merge` with an external sort: by keys with `sort`, then in the order of
+    the right rows for a right join, and of the left rows otherwise. Without `sort`,
+    inner joins follow the left rows and outer joins are sorted by keys from pandas
+    2.2; before, both are grouped by key, in the order the keys first appear on the
+    left side, then on the right side (unless a side has no rows).
+
+    :param left_chunks: iterable of DataFrames, the rows of the left side in order
+    :param right_chunks: iterable of DataFrames, the rows of the right side in order
+    :param how: accepts {'left', 'right', 'outer', 'inner'}, default 'inner'
+    :param on: column or list of columns to join on, found on both sides
+               (by default, the columns found on both sides)
+    :param left_on: column or list of columns of the left side to join on
+    :param right_on: column or list of columns of the right side to join on
+    :param sort: if true, sort the rows by their join keys
+    :param suffixes: suffixes for the columns found on both sides
+    :param memory_limit: number of bytes of rows to hold in memory at once
+    :param spill_dir: directory for the temporary files (default: the system's)
+    :return: a generator of joined DataFrames, numbered from 0; at least one,
+             possibly empty
+    """
+    left_chunks, right_chunks = iter(left_chunks), iter(right_chunks)
+    if on is None and left_on is None and right_on is None:
+        # Like `DataFrame.merge`, join on the columns found on both sides
+        left_first, right_first = next(left_chunks), next(right_chunks)
+        on = [c for c in left_first.columns if c in set(right_first.columns)]
+        left_chunks = itertools.chain([left_first], left_chunks)
+        right_chunks = itertools.chain([right_first], right_chunks)
+    if on is not None:
+        left_keys = right_keys = _labels(on)
+        merge_keys = dict(on=left_keys)
+    else:
+        left_keys, right_keys = _labels(left_on), _labels(right_on)
+        merge_keys = dict(left_on=left_keys, right_on=right_keys)
+    if how not in ("left", "right", "outer", "inner") or not left_keys:
+        raise ValueError("a partitioned join needs join keys and a non-cross `how`")
+
+    grouped = not sort and how in ("inner", "outer") and not _DOCUMENTED_MERGE_ORDER
+    by_keys = sort or how == "outer" and not grouped
+    copy_keys = by_keys or grouped
+    key_columns = [f"__dplypy_key{i}__" for i in range(len(left_keys))]
+    hidden = key_columns + [_LEFT, _RIGHT] if copy_keys else [_LEFT, _RIGHT]
+    if grouped:
+        hidden += [_FIRST_LEFT, _FIRST_RIGHT]
+
+    def merge(left, right, merge_how=how):
+        merged = left.merge(right, merge_how, suffixes=suffixes, **merge_keys)
+        if copy_keys:
+            # Keys to sort by, taken from the right side for unmatched right rows
+            for i, column in enumerate(key_columns):
+                left_key = merged.pop(f"{_LEFT}{i}")
+                right_key = merged.pop(f"{_RIGHT}{i}")
+                merged[column] = left_key.where(merged[_LEFT].notna(), right_key)
+        if grouped:
+            # Rows with equal keys are always in the same pair of partitions
+            groups = merged.groupby(key_columns, dropna=False, sort=False)
+            first = groups[[_LEFT, _RIGHT]].transform("min")
+            merged[_FIRST_LEFT] = first[_LEFT]
+            merged[_FIRST_RIGHT] = first[_RIGHT]
+        return merged
+
+    def order(left_rows, right_rows):
+        """
+        :return: the hidden columns to sort the joined rows by, given the number of
+                 rows of each side
+        """
+        by = [_RIGHT, _LEFT] if how == "right" else [_LEFT, _RIGHT]
+        if by_keys:
+            return key_columns + by
+        if grouped and left_rows and right_rows:
+            return [_FIRST_LEFT, _FIRST_RIGHT] + by
+        return by
+
+    left_chunks, left_rest = _buffer(
+        _number_rows(left_chunks, left_keys, _LEFT, copy_keys), memory_limit // 2
+    )
+    right_chunks, right_rest = _buffer(
+        _number_rows(right_chunks, right_keys, _RIGHT, copy_keys), memory_limit // 2
+    )
+    if left_rest is None and right_rest is None:
+        # Both sides fit in memory: no need to partition them
+        left, right = pd.concat(left_chunks), pd.concat(right_chunks)
+        merged = merge(left, right)
+        by = order(len(left), len(right))
+        merged = merged.sort_values(by, kind="stable").drop(columns=hidden)
+        if len(merged):
+            merged.index = pd.RangeIndex(len(merged))
+        yield merged
+        return
+
+    with tempfile.TemporaryDirectory(dir=spill_dir, prefix="dplypy-join-") as tmp:
+        left_paths, left_counts, left_empty, left_sample = _spill_partitions(
+            itertools.chain(left_chunks, left_rest or []), left_keys, 0, tmp
+        )
+        right_paths, right_counts, right_empty, _ = _spill_partitions(
+            itertools.chain(right_chunks, right_rest or []), right_keys, 0, tmp
+        )
+
+        # Merging an empty left side moves the key columns, unlike merging rows
+        empty = merge(left_empty, right_empty)
+        if left_sample is not None and not sum(right_counts):
+            # Without right rows, the types are those of merging the left rows
+            empty = merge(left_sample, right_empty).iloc[:0]
+        elif left_sample is not None:
+            empty = empty[list(merge(left_sample, right_empty, "left").columns)]
+        columns = list(empty.columns)
+
+        def joined():
+            yield empty
+            pairs = zip(left_paths, left_counts, right_paths, right_counts)
+            for left_path, left_count, right_path, right_count in pairs:
+                for left, right in _partition_pairs(
+                    (left_path, left_count, left_keys, left_empty),
+                    (right_path, right_count, right_keys, right_empty),
+                    memory_limit,
+                    tmp,
+                ):
+                    if len(left) or how in ("right", "outer"):
+                        if len(right) or how in ("left", "outer"):
+                            yield merge(left, right)[columns]
+
+        start = 0
+        by = order(sum(left_counts), sum(right_counts))
+        for chunk in sort_chunks(joined(), by, True, memory_limit, tmp):
+            chunk = chunk.drop(columns=hidden)
+            if len(chunk):
+                chunk.index = pd.RangeIndex(start, start + len(chunk))
+                start += len(chunk)
+            yield chunk
+
+
+def _buffer(chunks, nbytes):
+    """
+    Read chunks from a stream until they use more than `nbytes` bytes.
+
+    :return: the list of chunks read, and the stream of the chunks left
+             (None if the stream was read to the end)
+    """
+    chunks = iter(chunks)
+    buffered, total = [], 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        total += int(chunk.memory_usage(deep=True).sum())
+        if total > nbytes:
+            return buffered, chunks
+    return buffered, None
+
+
+def _labels(labels):
+    """
+    Normalize a single label or list of labels into a list
+    """
+    if labels is None:
+        return []
+    return list(labels) if isinstance(labels, (list, tuple)) else [labels]
+
+
+def _number_rows(chunks, keys, position, copy_keys):
+    """
+    Add the original position of each row to a stream of chunks, in the column
+    `position`, followed by copies of the key columns if `copy_keys` is true.
+    """
+    start = 0
+    for chunk in chunks:
+        chunk = chunk.assign(**{position: np.arange(start, start + len(chunk))})
+        start += len(chunk)
+        if copy_keys:
+            for i, key in enumerate(keys):
+                chunk[f"{position}{i}"] = chunk[key]
+        yield chunk
+
+
+def _partition_codes(pandas_df, keys, depth):
+    """
+    Hash the join keys of each row into one of `_FAN_IN` partitions, with a different
+    hash function at each `depth`. Keys that `DataFrame.merge` finds equal have equal
+    hashes (numbers are hashed as floats, so that e.g. 1 and 1.0 go together).
+    """
+    columns = {}
+    for i, key in enumerate(keys):
+        column = pandas_df[key]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column = pd.Series(np.asarray(column)).infer_objects()
+        if pd.api.types.is_numeric_dtype(column):
+            column = column.to_numpy(dtype="float64", na_value=np.nan)
+        columns[i] = np.asarray(column)
+    hashes = pd.util.hash_pandas_object(
+        pd.DataFrame(columns), index=False, hash_key=f"dplypy-depth-{depth:03d}"
+    )
+    return hashes.to_numpy() % _FAN_IN
+
+
+def _spill_partitions(chunks, keys, depth, directory):
+    """
+    Hash-partition a stream of chunks on `keys` into `_FAN_IN` temporary files.
+
+    :return: the paths of the files and the numbers of rows (one per partition),
+             an empty DataFrame with the columns of the chunks, and the first row
+             of the chunks (or None)
+    """
+    paths, files, counts = [], [], [0] * _FAN_IN
+    for _ in range(_FAN_IN):
+        descriptor, path = tempfile.mkstemp(dir=directory, suffix=".pkl")
+        paths.append(path)
+        files.append(os.fdopen(descriptor, "wb"))
+    empty = sample = None
+    try:
+        for chunk in chunks:
+            if empty is None:
+                empty = chunk.iloc[:0]
+            if not len(chunk):
+                continue
+            if sample is None:
+                sample = chunk.iloc[:1]
+            codes = _partition_codes(chunk, keys, depth)
+            for code, part in chunk.groupby(codes, sort=False):
+                pickle.dump(part, files[code], protocol=pickle.HIGHEST_PROTOCOL)
+                counts[code] += len(part)
+    finally:
+        for file in files:
+            file.close()
+    return paths, counts, empty, sample
+
+
+def _partition_pairs(left, right, memory_limit, directory, depth=1):
+    """
+    Read back a pair of matching partitions, splitting it again first if it is larger
+    than `memory_limit` bytes on disk (and `_MIN_BLOCK_ROWS` rows).
+
+    :param left: the path, number of rows, key columns and empty DataFrame
+                 of the left partition
+    :param right: the same for the right partition
+    :return: a generator of (left DataFrame, right DataFrame) pairs to merge
+    """
+    (left_path, left_count, left_keys, left_empty) = left
+    (right_path, right_count, right_keys, right_empty) = right
+    size = os.path.getsize(left_path) + os.path.getsize(right_path)
+    if (
+        size > memory_limit
+        and left_count + right_count > _MIN_BLOCK_ROWS
+        and depth <= _MAX_DEPTH
+    ):
+        left_paths, left_counts, _, _ = _spill_partitions(
+            _read_blocks(left_path), left_keys, depth, directory
+        )
+        right_paths, right_counts, _, _ = _spill_partitions(
+            _read_blocks(right_path), right_keys, depth, directory
+        )
+        # Rows with equal keys always stay together: stop once nothing is split
+        split = sum(l + r > 0 for l, r in zip(left_counts, right_counts)) > 1
+        pairs = zip(left_paths, left_counts, right_paths, right_counts)
+        for left_path, left_count, right_path, right_count in pairs:
+            yield from _partition_pairs(
+                (left_path, left_count, left_keys, left_empty),
+                (right_path, right_count, right_keys, right_empty),
+                memory_limit,
+                directory,
+                depth + 1 if split else _MAX_DEPTH + 1,
+            )
+        return
+    yield (_read_all(left_path, left_empty), _read_all(right_path, right_empty))
+
+
+def _read_all(path, empty):
+    """
+    Read back all the DataFrames written to a temporary file, as a single DataFrame
+    (`empty` if there are none), and delete the file.
+    """
+    blocks = list(_read_blocks(path))
+    return pd.concat(blocks) if blocks else empty
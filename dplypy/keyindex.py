@@ -0,0 +1,106 @@
+"""
+Indexes of the join keys of DplyFrames (see `DplyFrame.index_keys`).
+A KeyIndex is built once from the key columns of a DataFrame: the distinct keys, in
+pandas Indexes whose hash tables are built on their first lookup and then kept, and
+the positions of the rows holding each key. Joining a frame with it only hashes the
+keys of the other frame, and takes the matching rows by position.
+"""
+import numpy as np
+import pandas as pd
+
+
+class KeyIndex:
+    """
+    The positions of the rows of a DataFrame, by the values of its key columns.
+    Missing keys match each other, like they do in `DataFrame.merge`.
+    """
+
+    def __init__(self, pandas_df, keys):
+        """
+        :param pandas_df: the DataFrame to index
+        :param keys: the key columns, as a list
+        """
+        self.keys = list(keys)
+        self.dtypes = [pandas_df[key].dtype for key in self.keys]
+        # The distinct values of each key, whether it has missing values, and the
+        # number of each row's value (missing values are numbered after the others)
+        self.uniques, self.missing = [], []
+        codes = []
+        for key in self.keys:
+            column = pandas_df[key]
+            missing = column.isna().to_numpy()
+            uniques = pd.Index(column[~missing]).unique()
+            code = uniques.get_indexer(column)
+            code[missing] = len(uniques)
+            codes.append(code)
+            self.uniques.append(uniques)
+            self.missing.append(bool(missing.any()))
+        if len(codes) == 1:
+            self._combinations = None
+            groups, count = codes[0], len(self.uniques[0]) + self.missing[0]
+        elif len(pandas_df) == 0:
+            # MultiIndex.factorize cannot build the levels of no combination
+            groups, count = codes[0], 0
+            self._combinations = pd.MultiIndex.from_arrays(codes)
+        else:
+            # The distinct combinations of the numbers of the values of the keys
+            groups, self._combinations = pd.MultiIndex.from_arrays(codes).factorize()
+            count = len(self._combinations)
+        sizes = np.bincount(groups, minlength=count)
+        # The positions of the rows, grouped by key, and where each group starts
+        self.order = np.argsort(groups, kind="stable")
+        self.starts = np.concatenate([[0], np.cumsum(sizes)])
+        self.unique = bool((sizes <= 1).all())
+
+    def groups(self, pandas_df, keys):
+        """
+        :param pandas_df: a DataFrame to look up the keys of
+        :param keys: its key columns, in the order of the indexed ones
+        :return: for each of its rows, the number of the group of indexed rows with
+                 the same key, or -1 if there is none
+        """
+        codes = []
+        for uniques, missing, key in zip(self.uniques, self.missing, keys):
+            column = pandas_df[key]
+            code = uniques.get_indexer(column)
+            code[column.isna().to_numpy()] = len(uniques) if missing else -1
+            codes.append(code)
+        if self._combinations is None:
+            return codes[0]
+        found = np.logical_and.reduce([code >= 0 for code in codes])
+        groups = np.full(len(pandas_df), -1, dtype=np.intp)
+        if found.any():
+            groups[found] = self._combinations.get_indexer(
+                pd.MultiIndex.from_arrays([code[found] for code in codes])
+            )
+        return groups
+
+    def positions(self, groups, keep_unmatched=False):
+        """
+        Match rows with the indexed rows of their group, like a join.
+
+        :param groups: the groups of the rows, as returned by `groups`
+        :param keep_unmatched: whether rows without a group are kept (as in a left
+                               join) rather than dropped (as in an inner join)
+        :return: the positions of the rows and of the indexed rows they are matched
+                 with, in the order of the rows then of the indexed rows; -1 stands
+                 for no indexed row
+        """
+        matched = groups >= 0
+        sizes = np.zeros(len(groups), dtype=np.intp)
+        first = np.zeros(len(groups), dtype=np.intp)
+        sizes[matched] = np.diff(self.starts)[groups[matched]]
+        first[matched] = self.starts[groups[matched]]
+        repeats = np.maximum(sizes, 1) if keep_unmatched else sizes
+        rows = np.repeat(np.arange(len(groups)), repeats)
+        if self.unique:
+            # At most one indexed row per key: a plain lookup
+            indexed = np.where(sizes > 0, first, -1)[rows]
+        else:
+            ends = np.cumsum(repeats)
+            within = np.arange(len(rows)) - np.repeat(ends - repeats, repeats)
+            indexed = np.repeat(np.where(sizes > 0, first, -1), repeats)
+            indexed[indexed >= 0] += within[indexed >= 0]
+        found = indexed >= 0
+        indexed[found] = self.order[indexed[found]]
+        return rows, indexed
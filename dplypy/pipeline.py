@@ -2,12 +2,225 @@
 This module is entirely composed of functions.
 The literal sum (DplyFrame.__add__()) of these functions is a data pipeline.
 """
+import ast
+import functools
+import inspect
+import json
+import os
+import re
 from typing import Callable
 import pandas as pd
 import numpy as np
 from dplypy import DplyFrame
+from dplypy.aggregate import summarise_frame
+from dplypy.background import flush_side_effects, flush_writes, submit, write
+from dplypy.compaction import compact_frame
+from dplypy.external import join_chunks, sort_chunks, split_rows
+from dplypy.profiling import _label
+from dplypy.writers import (
+    COLUMNAR_SUFFIXES,
+    COLUMNS_SUFFIX,
+    write_columnar,
+    write_columns,
+)
+
+
+class Stage:
+    """
+    A single step of a pipeline: the function returned by a pipeline method,
+    tagged with the name and arguments of the method that built it.
+    Calling a Stage runs it, so it can be used anywhere a plain function can.
+    """
+
+    def __init__(self, func, verb, params, sink=False):
+        """
+        :param func: the function that transforms a DplyFrame
+        :param verb: name of the pipeline method that built this stage
+        :param params: the arguments the pipeline method was called with
+        :param sink: whether the stage forces a lazy DplyFrame to be evaluated
+        """
+        self.func = func
+        self.verb = verb
+        self.params = params
+        self.sink = sink
+
+    def __call__(self, d1):
+        return self.func(d1)
+
+    def __add__(self, other):
+        """
+        Compose this stage with another stage or pipeline into a Pipeline
+        """
+        return Pipeline([self]) + other
+
+    def __repr__(self):
+        args = ", ".join(
+            f"{key}={_param_repr(value)}" for key, value in self.params.items()
+        )
+        return f"{self.verb}({args})"
+
+
+class Pipeline:
+    """
+    A sequence of stages that is not tied to any data, built by adding pipeline
+    methods to each other: `select("x > 1") + drop(columns="y")`.
+    It can be applied to many DplyFrames with `+` (or a pool of workers, see `map`),
+    and is only validated and optimized once for all the data with the same columns.
+    """
+
+    def __init__(self, stages=()):
+        """
+        :param stages: the stages (or plain functions) of the pipeline, in order
+        """
+        self.stages = list(stages)
+        # Optimized stages, by the columns of the data they run on
+        self._compiled = {}
+
+    def __add__(self, other):
+        """
+        Compose this pipeline with a stage, a plain function or another pipeline
+        """
+        if isinstance(other, Pipeline):
+            return Pipeline(self.stages + other.stages)
+        if callable(other):
+            return Pipeline(self.stages + [other])
+        return NotImplemented
+
+    def __call__(self, d1):
+        """
+        Apply the pipeline to a DplyFrame: an eager one runs the stages optimized for
+        its columns, a lazy one adds them to its plan.
+        """
+        if d1.is_lazy:
+            return d1 + self
+        if d1._groups:
+            # Grouped by an earlier stage, for a `summarise` of this pipeline
+            for stage in self.stages:
+                d1 = d1 + stage
+            return d1
+        # Deferred import: the execution module imports this one
+        from dplypy.execution import execute
+
+        pandas_df = d1.pandas_df
+        stages = self.compile(getattr(pandas_df, "columns", None))
+        result = execute(pandas_df, stages, optimized=True)
+        if isinstance(result, (pd.DataFrame, pd.Series)):
+            return DplyFrame(result)
+        return result
+
+    def validate(self, columns=None):
+        """
+        Check that the pipeline can run, before running it: only its last stage may
+        be a sink that does not return a DplyFrame (e.g. `count_null`), and if the
+        columns of the data are given, the columns the stages refer to must exist
+        (as far as they can be known before running).
+
+        :param columns: the columns of the data the pipeline will run on
+        :raises ValueError: if a sink is followed by other stages, or a `group_by` by
+                            anything other than a `summarise`
+        :raises KeyError: if a stage refers to a missing column
+        """
+        for stage in self.stages[:-1]:
+            if getattr(stage, "sink", False) and stage.verb != "write_file":
+                raise ValueError(f"{stage!r} must be the last stage of the pipeline")
+        _check_groups(self.stages)
+        if columns is None:
+            return
+        received = _plan_columns(self.stages, list(columns))
+        for stage, stage_columns in zip(self.stages, received):
+            if stage_columns is None or isinstance(stage_columns, _OpenColumns):
+                continue
+            # The columns the stage itself reads, whatever the next stages need
+            _, needed = _needed_columns(stage, set(), stage_columns)
+            missing = [label for label in needed or () if label not in stage_columns]
+            if missing:
+                raise KeyError(f"{stage!r} refers to missing columns {missing}")
+
+    def compile(self, columns=None):
+        """
+        Validate and optimize the pipeline (see `optimize`) for data with the given
+        columns, once: the result is kept for the next data with the same columns.
+
+        :param columns: the columns of the data the pipeline will run on
+        :return: the list of optimized stages
+        """
+        key = None if columns is None else tuple(columns)
+        if key not in self._compiled:
+            self.validate(columns)
+            columns = None if columns is None else list(columns)
+            self._compiled[key] = optimize(self.stages, columns)
+        return self._compiled[key]
+
+    def map(self, inputs, workers=None, backend="process"):
+        """
+        Apply the pipeline to each of `inputs` in a pool of workers. The pipeline is
+        compiled beforehand for the columns of the eager inputs.
+
+        :param inputs: an iterable of DplyFrames (possibly lazy, e.g. returned by
+                       `read_csv`) or pandas DataFrames
+        :param workers: number of workers, by default the number of CPUs
+        :param backend: "process" for a pool of processes (forked where the platform
+                        allows it, so that stages can use lambdas), or "thread" for a
+                        pool of threads
+        :return: the list of the results, in order: DplyFrames, or the return values
+                 of a final sink such as `count_null`
+        """
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Unknown backend: {backend!r}")
+        # Deferred import: the execution module imports this one
+        from dplypy.execution import map_pipeline
+
+        inputs = list(inputs)
+        for data in inputs:
+            if isinstance(data, DplyFrame) and data.is_lazy:
+                continue
+            pandas_df = data.pandas_df if isinstance(data, DplyFrame) else data
+            self.compile(getattr(pandas_df, "columns", None))
+        return map_pipeline(self, inputs, workers or os.cpu_count() or 1, backend)
+
+    def __repr__(self):
+        return " + ".join(repr(stage) for stage in self.stages)
+
+
+def _param_repr(value):
+    """
+    Short representation of a stage argument; data is summarized by its shape
+    """
+    if isinstance(value, DplyFrame):
+        if value.is_lazy:
+            # Do not run the plan just to print it
+            return "<lazy DplyFrame>"
+        value = value.pandas_df
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return f"<{type(value).__name__} {value.shape}>"
+    return repr(value)
+
+
+def _verb(sink=False):
+    """
+    Decorator for pipeline methods: wraps the returned function in a Stage
+    recording the method name and its (default-filled) arguments.
+
+    :param sink: whether the stage forces a lazy DplyFrame to be evaluated
+    """
+
+    def decorate(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return Stage(
+                method(*args, **kwargs), method.__name__, dict(bound.arguments), sink
+            )
 
+        return wrapper
 
+    return decorate
+
+
+@_verb()
 def head(n):
     """
     Returns the first n rows of a DplyFrame
@@ -18,6 +231,7 @@ def head(n):
     return lambda d1: DplyFrame(d1.pandas_df.head(n))
 
 
+@_verb()
 def tail(n):
     """
     Returns the last n rows of a DplyFrame
@@ -28,6 +242,7 @@ def tail(n):
     return lambda d1: DplyFrame(d1.pandas_df.tail(n))
 
 
+@_verb()
 def select(query_str: str):
     """
     Query the columns of a DplyFrame with a boolean expression
@@ -38,17 +253,42 @@ def select(query_str: str):
     return lambda d1: DplyFrame(d1.pandas_df.query(query_str))
 
 
-def mutate(func, axis=0):
+@_verb()
+def mutate(func=None, axis=0, **exprs):
     """
-    Apply a function along an axis of the DplyFrame
+    Apply a function along an axis of the DplyFrame, or add columns computed from
+    expressions, e.g. mutate(total="price * qty", margin="(price - cost) / price")
+
+    Expressions are evaluated on whole columns at once by `DataFrame.eval` (with
+    numexpr if it is installed), in order, so that they can refer to the columns
+    created before them.
 
     :param func: the function to appply to each column or row
     :param axis: specifies the axis to which `func` is applied, 0 for 'index', 1 for 'columns'
+    :param exprs: names of the columns to create (or replace), and the expressions
+                  computing them: strings accepted by `DataFrame.eval`, or, as in
+                  `DataFrame.assign`, functions of the DataFrame or plain values
     :return: a function that returns a new DplyFrame
     """
+    if exprs:
+        if func is not None:
+            raise ValueError("mutate takes either a function or expressions, not both")
+        columns = {
+            name: _evaluator(expr) if isinstance(expr, str) else expr
+            for name, expr in exprs.items()
+        }
+        return lambda d1: DplyFrame(d1.pandas_df.assign(**columns))
     return lambda d1: DplyFrame(d1.pandas_df.apply(func=func, axis=axis))
 
 
+def _evaluator(expr):
+    """
+    :return: a function evaluating the expression `expr` on a pandas DataFrame
+    """
+    return lambda pandas_df: pandas_df.eval(expr)
+
+
+@_verb()
 def drop(labels=None, axis=0, index=None, columns=None):
     """
     Drop rows or columns from the DplyFrame
@@ -66,6 +306,7 @@ def drop(labels=None, axis=0, index=None, columns=None):
     )
 
 
+@_verb(sink=True)
 def count_null(column=None, index=None):
     """
     Get total number of null values in a DplyFrame,
@@ -86,6 +327,7 @@ def count_null(column=None, index=None):
     return lambda d1: _count_null(d1, column, index)
 
 
+@_verb()
 def drop_na(axis=0, how="any", thresh=None, subset=None):
     """
     Remove missing values of a DplyFrame
@@ -102,6 +344,7 @@ def drop_na(axis=0, how="any", thresh=None, subset=None):
     )
 
 
+@_verb()
 def fill_na(value=None, method=None, axis=0, limit=None):
     """
     Fill missing values in a DplyFrame with value
@@ -122,6 +365,37 @@ def fill_na(value=None, method=None, axis=0, limit=None):
     )
 
 
+@_verb()
+def compact(max_cardinality=0.5, arrow_strings=False, columns=None, dtypes=None):
+    """
+    Store the columns of a DplyFrame in smaller types, so that the following stages
+    (`join`, `arrange`, `pivot_table`, `one_hot`...) move fewer bytes: string columns
+    with few distinct values become categoricals.
+    Numeric columns keep their types unless they are named in `columns` or `dtypes`:
+    the stages that follow compute in the types of their inputs, so arithmetic on
+    downcast columns (e.g. `mutate(total="price * qty")` in int8) can overflow or
+    lose precision.
+    The memory saved is logged (at the INFO level, by the "dplypy.compaction" logger).
+    As in pandas, categoricals keep their categories when rows are filtered out:
+    `pivot_table` and `one_hot` on them still produce a row or column for each one.
+
+    :param max_cardinality: string columns whose number of distinct values is at most
+                            this fraction of their number of rows become categoricals
+    :param arrow_strings: whether the other string columns become Arrow-backed strings
+                          (which requires pyarrow)
+    :param columns: numeric columns to downcast: integers to the smallest signed type
+                    holding all their values, floats to float32 if no value changes
+    :param dtypes: a dictionary of the types to store columns in, e.g.
+                   `{"qty": "int16"}`; a ValueError is raised if the values of a
+                   column change
+    :return: a function that returns a new DplyFrame
+    """
+    return lambda d1: DplyFrame(
+        compact_frame(d1.pandas_df, max_cardinality, arrow_strings, columns, dtypes)[0]
+    )
+
+
+@_verb()
 def join(
     right: DplyFrame,
     how="inner",
@@ -132,10 +406,22 @@ def join(
     right_index=False,
     sort=False,
     suffixes=("_x", "_y"),
+    memory_limit=None,
+    spill_dir=None,
 ):
     """
     Combines two DplyFrames together based on a join key
     Functions like a SQL join.
+    With `memory_limit`, the DplyFrames are joined out of core with a grace hash join
+    (see `external.join_chunks`): both sides are partitioned on the join keys into
+    temporary files, and pairs of partitions are joined one at a time. A lazy `right`
+    reading a chunked source is partitioned chunk by chunk, and so is the left side
+    in the lazy plan of a chunked source.
+    If `right` has an index of its `on` keys (see `DplyFrame.index_keys`), left joins
+    without `sort` look up the keys of each left row in that index instead of merging,
+    and so do inner joins from pandas 2.2 (before, `DataFrame.merge` groups the rows
+    of inner joins by key, which a lookup does not). The rows come in the same order
+    as with `DataFrame.merge`.
 
     :param right: the other DplyFrame to be merged against
     :param how: accepts {‘left’, ‘right’, ‘outer’, ‘inner’, ‘cross’}, default ‘inner’
@@ -146,62 +432,134 @@ def join(
     :param right_index: index of the right DplyFrame to be used as the join key
     :param sort: if true, sort the keys in lexigraphical order
     :param suffixes: suffix to be applied to variables in left and right DplyFrames
+    :param memory_limit: number of bytes of rows to join in memory at once,
+                         or None to join all the rows in memory
+    :param spill_dir: directory for the temporary files of the partitioned join
     :return: a function that returns a new DplyFrame
     """
-    return lambda d1: DplyFrame(
-        d1.pandas_df.merge(
-            right.pandas_df,
+    if memory_limit is None:
+        params = {
+            "how": how,
+            "on": on,
+            "left_on": left_on,
+            "right_on": right_on,
+            "left_index": left_index,
+            "right_index": right_index,
+            "sort": sort,
+            "suffixes": suffixes,
+        }
+
+        def d2_func(d1):
+            left = d1.pandas_df
+            key_index = _lookup_index(left, right, params)
+            if key_index is not None:
+                return DplyFrame(_lookup_join(left, right.pandas_df, key_index, params))
+            return DplyFrame(_merge(left, right.pandas_df, params))
+
+        return d2_func
+    if how == "cross" or left_index or right_index:
+        raise ValueError("memory_limit needs join keys (on, or left_on and right_on)")
+
+    def partitioned_join(d1):
+        # Deferred import: the execution module imports this one
+        from dplypy.execution import iter_chunks
+
+        chunks = join_chunks(
+            split_rows(d1.pandas_df, memory_limit),
+            iter_chunks(right, memory_limit),
             how,
             on,
             left_on,
             right_on,
-            left_index,
-            right_index,
             sort,
             suffixes,
+            memory_limit,
+            spill_dir,
         )
-    )
+        return DplyFrame(pd.concat(chunks))
 
+    return partitioned_join
 
-def write_file(file_path, sep=",", index=True):
+
+def _write_frame(pandas_df, file_path, sep, index, compression, row_group_size):
+    """
+    Write a pandas DataFrame to a file whose type is given by the suffix of its path
+    """
+    if file_path.endswith(".csv"):
+        pandas_df.to_csv(file_path, sep=sep, index=index)
+    elif file_path.endswith(".xlsx"):
+        pandas_df.to_excel(file_path, index=index)
+    elif file_path.endswith(".json"):
+        pandas_df.to_json(file_path)
+    elif file_path.endswith(".pkl"):
+        pandas_df.to_pickle(file_path)
+    elif file_path.endswith(COLUMNS_SUFFIX):
+        write_columns(pandas_df, file_path, index)
+    else:
+        write_columnar(pandas_df, file_path, index, compression, row_group_size)
+
+
+@_verb(sink=True)
+def write_file(
+    file_path,
+    sep=",",
+    index=True,
+    background=False,
+    backend="thread",
+    compression=None,
+    row_group_size=None,
+):
     """
     Write DplyFrame to file.
     Write the DplyFrame to the following file types depending on the file path given:
-    .csv, .xlsx, .json and .pkl
+    .csv, .xlsx, .json, .pkl, .columns (a directory of memory-mappable columns, see
+    `read_columns`), and (with pyarrow) .parquet, .feather and .arrow (Feather is the
+    Arrow IPC file format)
+    Side effects the pipeline runs in the background are waited for first (see
+    `side_effect`).
+    With `background`, the file is written in the background while the pipeline
+    goes on (chunk by chunk for a CSV, Parquet or Feather file written from a chunked
+    source, see `read_csv`). The pipeline's next write or `collect()`, or
+    `flush_writes()`, waits for it, and raises its exception if it failed.
+    Exceptions nothing waited for are reported as warnings at exit.
 
     :param file_path: the path of the file with proper suffix
     :param sep: the separator for csv files. Default to be comma
     :param index: Write the row name by the index of the DplyFrame. Default to be true
+    :param background: if true, write the file in the background
+    :param backend: "thread" to write in a thread, or "process" to write in a
+                    (forked) child process, reused from one write to the next, so
+                    that serialization uses another core (Parquet and Feather files
+                    written chunk by chunk are always written in a thread)
+    :param compression: for Parquet and Feather files, "zstd", "lz4", "snappy"
+                        (Parquet only), "gzip" (Parquet only) or "uncompressed".
+                        Default to be snappy for Parquet and lz4 for Feather
+    :param row_group_size: for Parquet and Feather files, the maximum number of rows
+                           per row group (or record batch). Default to be one per
+                           DplyFrame or chunk written
     :return: a function that returns the original DplyFrame
     """
-
-    def to_csv(d1):
-        d1.pandas_df.to_csv(file_path, sep=sep, index=index)
-        return d1
-
-    def to_excel(d1):
-        d1.pandas_df.to_excel(file_path, index=index)
-        return d1
-
-    def to_json(d1):
-        d1.pandas_df.to_json(file_path)
+    suffixes = (".csv", ".xlsx", ".json", ".pkl", COLUMNS_SUFFIX) + COLUMNAR_SUFFIXES
+    if not file_path.endswith(suffixes):
+        raise IOError("The file format is not supported.")
+    if backend not in ("process", "thread"):
+        raise ValueError(f"Unknown backend: {backend!r}")
+    options = (file_path, sep, index, compression, row_group_size)
+
+    def d2_func(d1):
+        flush_side_effects()
+        if background:
+            # The snapshot keeps later stages from changing what is being written
+            write(_write_frame, d1.snapshot().pandas_df, *options, backend=backend)
+        else:
+            flush_writes()
+            _write_frame(d1.pandas_df, *options)
         return d1
 
-    def to_pickle(d1):
-        d1.pandas_df.to_pickle(file_path)
-        return d1
-
-    if file_path.endswith(".csv"):
-        return to_csv
-    if file_path.endswith(".xlsx"):
-        return to_excel
-    if file_path.endswith(".json"):
-        return to_json
-    if file_path.endswith(".pkl"):
-        return to_pickle
-    raise IOError("The file format is not supported.")
+    return d2_func
 
 
+@_verb()
 def pivot_table(
     values=None, index=None, columns=None, aggfunc="mean", fill_value=None, dropna=True
 ):
@@ -228,39 +586,118 @@ def pivot_table(
     )
 
 
+@_verb()
+def group_by(keys):
+    """
+    Group the rows of a DplyFrame by the values of key columns, for the `summarise`
+    that follows. No other stage can take a grouped DplyFrame: adding one raises a
+    ValueError, rather than dropping the grouping.
+
+    :param keys: label or list of labels of the key columns
+    :return: a function that returns a new, grouped DplyFrame
+    """
+
+    def d2_func(d1):
+        d2 = DplyFrame(d1.pandas_df)
+        d2._groups = _as_list(keys)
+        return d2
+
+    return d2_func
+
+
+def _check_groups(stages):
+    """
+    Check that each `group_by` of a plan is followed by the `summarise` it groups the
+    rows for (or ends the plan): other stages would drop the grouping, and the
+    `summarise` would then summarise all the rows.
+
+    :param stages: the stages of the plan, in execution order
+    :raises ValueError: if a `group_by` is followed by another stage
+    """
+    for stage, following in zip(stages, stages[1:]):
+        if getattr(stage, "verb", None) == "group_by":
+            _check_grouped(following)
+
+
+def _check_grouped(stage):
+    """
+    :raises ValueError: unless the stage can run on a grouped DplyFrame
+    """
+    if getattr(stage, "verb", None) not in ("group_by", "summarise"):
+        raise ValueError(f"{_label(stage)} cannot follow group_by, only summarise can")
+
+
+@_verb()
+def summarise(**aggregations):
+    """
+    Summarise each group of a DplyFrame grouped by `group_by` (or all its rows) into
+    one row, e.g. summarise(n="size", mean_fare=("fare", "mean"))
+
+    Keys are factorized once and every aggregate is computed in a single vectorized
+    pass over its column (see aggregate.py); "size", "count", "sum", "mean", "var",
+    "std", "min", "max", "first" and "last" of numeric columns use numpy kernels, and
+    other aggregations fall back to pandas.
+
+    :param aggregations: names of the columns to create, and either "size" (the number
+                         of rows of the group) or a (column, function) pair, where the
+                         function is a pandas aggregation name or a function
+    :return: a function that returns a new DplyFrame with the key columns and one
+             column per aggregation, with one row per group sorted by key
+    """
+    for name, spec in aggregations.items():
+        if spec != "size" and not (isinstance(spec, tuple) and len(spec) == 2):
+            raise ValueError(f"Invalid aggregation for {name!r}: {spec!r}")
+
+    return lambda d1: DplyFrame(summarise_frame(d1.pandas_df, d1._groups, aggregations))
+
+
+@_verb()
 def side_effect(
-    side_effect_func: Callable[[DplyFrame], None]
+    side_effect_func: Callable[[DplyFrame], None], deep_copy=False, background=False
 ) -> Callable[[DplyFrame], DplyFrame]:
     """
     Allows user to inject arbitrary side effects into the pipeline,
     e.g. render a plot or do network operation.
-    Note that the input function receives a copy of the data frame
-    i.e. modifications will not be preserved.
+    Note that the input function receives a read-only snapshot of the data frame
+    (see `DplyFrame.snapshot`), which shares its data instead of copying it:
+    columns can be added, dropped or replaced, but such modifications will not be
+    preserved, and writing values in place raises a ValueError.
 
     :param side_effect_func: performs the side effect
+    :param deep_copy: if true, the function receives a deep copy instead, which it
+                      can modify in place
+    :param background: if true, the function runs in a bounded pool of threads (see
+                       background.py) while the pipeline goes on; the pipeline's
+                       `collect()` and `write_file`, and `flush_side_effects()`, wait
+                       for it, and raise its exception if it failed
     :return: a function that returns the original DplyFrame
     """
 
     def d2_func(d1: DplyFrame):
         """
-        The deep copy prevents side_effect_func from modifying the Data Frame,
-        in a way that is preserved down the pipeline
+        The snapshot (or deep copy) prevents side_effect_func from modifying the
+        Data Frame, in a way that is preserved down the pipeline
         """
-        side_effect_func(d1.deep_copy())
+        copy = d1.deep_copy() if deep_copy else d1.snapshot()
+        if background:
+            submit(side_effect_func, copy)
+        else:
+            side_effect_func(copy)
         return d1
 
     return d2_func
 
 
 def s(
-    side_effect_func: Callable[[DplyFrame], None]
+    side_effect_func: Callable[[DplyFrame], None], deep_copy=False, background=False
 ) -> Callable[[DplyFrame], DplyFrame]:
     """
     Convenience method for `side_effect()`. See `side_effect` for operational details.
     """
-    return side_effect(side_effect_func)
+    return side_effect(side_effect_func, deep_copy, background)
 
 
+@_verb()
 def gather(
     id_vars=None, value_vars=None, var_name=None, value_name="value", ignore_index=True
 ):
@@ -286,6 +723,7 @@ def gather(
     )
 
 
+@_verb()
 def one_hot(
     prefix=None,
     prefix_sep="_",
@@ -293,6 +731,8 @@ def one_hot(
     columns=None,
     drop_first=False,
     dtype=np.uint8,
+    categories=None,
+    sparse=False,
 ):
     """
     Convert categorical variables to indicators and return a new DplyFrame
@@ -303,21 +743,127 @@ def one_hot(
     :param columns: column names being encoded with default None, i.e. considering everything
     :param drop_first: if removing first indicator column
     :param dtype: only one type for new columns with default unsigned 8-bit integer
+    :param categories: dictionary of column name to the list of its categories.
+                       Those columns get one indicator per listed category, whatever
+                       values the data holds (other values count as missing), e.g.
+                       the categories learnt by a OneHotEncoder
+    :param sparse: if true, the indicator columns are sparse (pandas.SparseDtype),
+                   storing only their non-zero values
     :return: a function that returns a new DplyFrame
     """
-    return lambda d1: DplyFrame(
-        pd.get_dummies(
-            d1.pandas_df,
-            prefix=prefix,
-            prefix_sep=prefix_sep,
-            dummy_na=dummy_na,
-            columns=columns,
-            drop_first=drop_first,
-            dtype=dtype,
+
+    def d2_func(d1):
+        pandas_df = d1.pandas_df
+        if categories is not None:
+            pandas_df = pandas_df.astype(
+                {
+                    column: pd.CategoricalDtype(column_categories)
+                    for column, column_categories in categories.items()
+                }
+            )
+        return DplyFrame(
+            pd.get_dummies(
+                pandas_df,
+                prefix=prefix,
+                prefix_sep=prefix_sep,
+                dummy_na=dummy_na,
+                columns=columns,
+                drop_first=drop_first,
+                dtype=dtype,
+                sparse=sparse,
+            )
         )
-    )
 
+    return d2_func
+
+
+class OneHotEncoder:
+    """
+    The categories of columns to encode with `one_hot`, learnt once from the data
+    (`fit`) and reused for every later DplyFrame, chunk or partition (`one_hot`),
+    which then all get the same indicator columns in the same order. The categories
+    can be saved to a JSON file and loaded back, e.g. by a serving pipeline.
+    """
 
+    def __init__(self, columns, categories=None):
+        """
+        :param columns: label or list of labels of the columns to encode
+        :param categories: dictionary of column name to the list of its categories,
+                           if already known
+        """
+        self.columns = _as_list(columns)
+        self.categories = categories
+
+    def fit(self, data):
+        """
+        Learn the categories of the columns: the values they hold (all the
+        categories of categoricals), sorted as `one_hot` sorts them.
+
+        :param data: a DplyFrame or a pandas DataFrame. A lazy DplyFrame reading a
+                     chunked source (see `read_csv`) is read chunk by chunk, and
+                     only its encoded columns are read.
+        :return: the encoder
+        """
+        if isinstance(data, DplyFrame) and getattr(data._source, "chunksize", None):
+            # Deferred import: the execution module imports this one
+            from dplypy.execution import iter_chunks
+
+            chunks = iter_chunks(data + _project(self.columns), 2**30)
+        else:
+            chunks = [getattr(data, "pandas_df", data)]
+        found = {column: [] for column in self.columns}
+        for chunk in chunks:
+            for column in self.columns:
+                values = chunk[column]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    found[column].append(values.cat.categories)
+                else:
+                    found[column].append(pd.factorize(values, sort=True)[1])
+        self.categories = {
+            column: pd.factorize(pd.Index([]).append(uniques), sort=True)[1].tolist()
+            for column, uniques in found.items()
+        }
+        return self
+
+    def one_hot(self, **kwargs):
+        """
+        :param kwargs: other arguments of `one_hot`, e.g. `sparse=True`
+        :return: a `one_hot` stage encoding the columns with the learnt categories
+        """
+        if self.categories is None:
+            raise ValueError("The encoder must be fitted first")
+        return one_hot(columns=self.columns, categories=self.categories, **kwargs)
+
+    def save(self, file_path):
+        """
+        Save the columns and their categories (strings, numbers or booleans) to a
+        JSON file
+        """
+        if self.categories is None:
+            raise ValueError("The encoder must be fitted first")
+        # Lists of pairs rather than objects: column names need not be strings
+        state = {
+            "columns": self.columns,
+            "categories": [
+                [column, self.categories[column]] for column in self.columns
+            ],
+        }
+        with open(file_path, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        :return: the encoder saved to a JSON file by `save`
+        """
+        with open(file_path, encoding="utf-8") as file:
+            state = json.load(file)
+        return cls(
+            state["columns"], {column: values for column, values in state["categories"]}
+        )
+
+
+@_verb()
 def filter(boolean_series):
     """
     Cull rows by boolean series and return a new DplyFrame. Works similarly to DplyFrame.__get__()
@@ -329,21 +875,44 @@ def filter(boolean_series):
     return lambda d1: DplyFrame(d1[boolean_series])
 
 
-def arrange(by, axis=0, ascending=True):
+@_verb()
+def arrange(by, axis=0, ascending=True, memory_limit=None, spill_dir=None):
     """
-    Sort the DplyFrame and return a new DplyFrame
+    Sort the DplyFrame and return a new DplyFrame.
+    The sort is stable: rows with equal keys keep their original order,
+    and missing values are placed last.
+    With `memory_limit`, rows are sorted out of core with an external merge sort
+    (see `external.sort_chunks`); in the lazy plan of a chunked source, the sorted
+    rows are streamed on to the next stages without being all in memory at once.
 
     :param by: mapping, function, label, or list of labels
     :param axis: 0 for index, 1 for columns
     :param ascending: whether or not the data should be sorted in ascending order
                       (False for descending)
+    :param memory_limit: number of bytes of rows to sort in memory at once,
+                         or None to sort all the rows in memory
+    :param spill_dir: directory for the temporary files of the external sort
     :return: a function that returns a new DplyFrame
     """
-    return lambda d1: DplyFrame(
-        d1.pandas_df.sort_values(by=by, axis=axis, ascending=ascending)
-    )
+    if memory_limit is None:
+        return lambda d1: DplyFrame(
+            d1.pandas_df.sort_values(
+                by=by, axis=axis, ascending=ascending, kind="stable"
+            )
+        )
+    if axis not in (0, "index"):
+        raise ValueError("memory_limit is only supported when sorting rows (axis=0)")
 
+    def d2_func(d1):
+        chunks = split_rows(d1.pandas_df, memory_limit)
+        return DplyFrame(
+            pd.concat(sort_chunks(chunks, by, ascending, memory_limit, spill_dir))
+        )
+
+    return d2_func
 
+
+@_verb()
 def row_name_subset(arg):
     """
     Slice a DplyFrame access rows by index names and return a new DplyFrame
@@ -356,6 +925,7 @@ def row_name_subset(arg):
     return lambda d1: DplyFrame(d1.pandas_df.loc[arg])
 
 
+@_verb()
 def slice_row(*args):
     """
     Purely integer-location based indexing for row selection by position.
@@ -370,6 +940,7 @@ def slice_row(*args):
     return lambda d1: DplyFrame(d1.pandas_df.iloc[args[0]])
 
 
+@_verb()
 def slice_column(*args):
     """
     Purely integer-location based indexing for column selection by position.
@@ -382,3 +953,900 @@ def slice_column(*args):
     if len(args) == 2:
         return lambda d1: DplyFrame(d1.pandas_df.iloc[:, args[0] : args[1]])
     return lambda d1: DplyFrame(d1.pandas_df.iloc[:, args[0]])
+
+
+def optimize(stages, columns=None):
+    """
+    Rewrite the stages of a logical plan into an equivalent plan that does less work.
+    Only rewrites that leave the result unchanged (values, dtypes, index and row order)
+    are applied; plain functions and stages the optimizer knows nothing about are
+    left in place and act as barriers.
+
+    :param stages: the stages of the plan, in execution order
+    :param columns: the columns of the data the plan runs on, if known
+    :return: a new list of stages
+    """
+    stages = _push_down_projections(list(stages), columns)
+    stages = _push_down_predicates(stages, columns)
+    return _fuse_top_k(stages)
+
+
+def _as_list(labels):
+    """
+    Normalize a single label or list-like of labels into a list
+    """
+    if labels is None:
+        return []
+    if isinstance(labels, (list, tuple, set, pd.Index, np.ndarray)):
+        return list(labels)
+    return [labels]
+
+
+def _query_columns(query_str):
+    """
+    Find the names a `select` query string refers to.
+
+    :param query_str: a query string accepted by `DataFrame.query`
+    :return: a set of names, or None if the query cannot be analyzed
+             (e.g. it uses `@` local variables)
+    """
+    if "@" in query_str:
+        return None
+    placeholder = "__dplypy_backtick__"
+    names = set(re.findall(r"`([^`]*)`", query_str))
+    expr = re.sub(r"`[^`]*`", placeholder, query_str).strip()
+    try:
+        tree = ast.parse(expr, mode="eval")
+    except SyntaxError:
+        return None
+    names.update(
+        node.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and node.id != placeholder
+    )
+    return names
+
+
+def _join_keys(params):
+    """
+    :return: the left and right key columns of a `join` stage, as lists
+    """
+    if params["on"] is not None:
+        return _as_list(params["on"]), _as_list(params["on"])
+    return _as_list(params["left_on"]), _as_list(params["right_on"])
+
+
+def _join_columns(left_columns, right_columns, params):
+    """
+    Work out the columns `DataFrame.merge` produces for a `join` stage.
+
+    :return: a list of (output column, "left" or "right", input column) tuples
+    """
+    left_keys, right_keys = _join_keys(params)
+    shared_keys = set()
+    if params["how"] != "cross":
+        shared_keys = {lk for lk, rk in zip(left_keys, right_keys) if lk == rk}
+    overlap = (set(left_columns) & set(right_columns)) - shared_keys
+    left_suffix, right_suffix = params["suffixes"]
+    output = [
+        (f"{c}{left_suffix}" if c in overlap else c, "left", c) for c in left_columns
+    ]
+    output += [
+        (f"{c}{right_suffix}" if c in overlap else c, "right", c)
+        for c in right_columns
+        if c not in shared_keys
+    ]
+    return output
+
+
+def _right_columns(params):
+    """
+    :return: the columns of the right-hand side of a `join` stage, once projected on
+             those the optimizer kept (see `_prune_join`)
+    """
+    if "right_columns" in params:
+        return list(params["right_columns"])
+    return _frame_columns(params["right"])
+
+
+def _right_frame(params):
+    """
+    :return: the right-hand side of a `join` stage, projected on the columns the
+             optimizer kept (see `_prune_join`) from the data it holds now
+    """
+    right = params["right"]
+    if "right_columns" not in params:
+        return right
+    return DplyFrame(right.pandas_df[params["right_columns"]])
+
+
+def _frame_columns(frame):
+    """
+    :return: the columns of a DplyFrame, worked out from its logical plan
+             (without running it) if it is lazy and they can be
+    """
+    if frame.is_lazy:
+        source = frame._source if frame._source is not None else frame._pandas_df
+        columns = getattr(source, "columns", None)
+        for stage in frame.stages:
+            columns = _output_columns(stage, None if columns is None else list(columns))
+        if columns is not None and not isinstance(columns, _OpenColumns):
+            return list(columns)
+    return list(frame.pandas_df.columns)
+
+
+class _OpenColumns(list):
+    """
+    Columns known to pass through a stage unchanged, when the stage may also
+    produce others that cannot be known before running (e.g. `one_hot` dummies).
+    """
+
+
+def _output_columns(stage, columns):
+    """
+    Infer the columns a stage produces from the columns it receives.
+
+    :return: a list of column names (an _OpenColumns if only partly known),
+             or None if they cannot be known before running
+    """
+    if columns is None or not isinstance(stage, Stage):
+        return None
+    params = stage.params
+    output = None
+    if stage.verb in (
+        "head",
+        "tail",
+        "select",
+        "filter",
+        "side_effect",
+        "write_file",
+        "group_by",
+        "compact",
+    ):
+        output = columns
+    elif stage.verb == "fill_na" and params["axis"] in (0, "index"):
+        output = columns
+    elif stage.verb in ("drop_na", "arrange") and params["axis"] in (0, "index"):
+        output = columns
+    elif stage.verb == "project":
+        output = params["columns"]
+    elif stage.verb == "mutate" and params["exprs"]:
+        output = list(columns) + [c for c in params["exprs"] if c not in columns]
+    elif stage.verb == "drop" and _drops_columns_only(params):
+        dropped = set(_as_list(params["columns"]) + _as_list(params["labels"]))
+        output = [c for c in columns if c not in dropped]
+    elif stage.verb == "one_hot" and params["columns"] is not None:
+        encoded = set(_as_list(params["columns"]))
+        return _OpenColumns(c for c in columns if c not in encoded)
+    elif stage.verb == "join" and not isinstance(columns, _OpenColumns):
+        if params["left_index"] or params["right_index"]:
+            return None
+        right_columns = _right_columns(params)
+        output = [name for name, _, _ in _join_columns(columns, right_columns, params)]
+    if output is not None and isinstance(columns, _OpenColumns):
+        return _OpenColumns(output)
+    return output
+
+
+def _has_fixed_categories(params):
+    """
+    :return: whether the parameters of a `one_hot` stage fix the categories of every
+             encoded column, so that the indicator columns do not depend on the data
+    """
+    return (
+        params["columns"] is not None
+        and params["categories"] is not None
+        and set(_as_list(params["columns"])) <= set(params["categories"])
+    )
+
+
+def _drops_columns_only(params):
+    """
+    :return: whether the parameters of a `drop` stage only remove columns
+    """
+    if params["index"] is not None:
+        return False
+    return params["labels"] is None or params["axis"] in (1, "columns")
+
+
+def _plan_columns(stages, columns):
+    """
+    :return: the columns each stage of the plan receives (None where unknown)
+    """
+    received = []
+    for stage in stages:
+        received.append(columns)
+        columns = _output_columns(stage, columns)
+    return received
+
+
+# Verbs that copy every column they are handed
+# (`gather` and `pivot_table` already only read the columns they use)
+_COLUMN_HEAVY_VERBS = ("join", "one_hot", "arrange", "mutate")
+
+
+def _project(columns):
+    """
+    Keep only `columns` (in the given order); inserted by the optimizer
+    """
+    return Stage(
+        lambda d1: DplyFrame(d1.pandas_df[columns]), "project", {"columns": columns}
+    )
+
+
+def _labels(value, columns):
+    """
+    :return: the column labels referenced by a stage argument, or None if it is not
+             (only) made of labels of `columns`, e.g. an array or a Grouper
+    """
+    labels = _as_list(value)
+    try:
+        if columns is not None and not set(labels) <= set(columns):
+            return None
+    except TypeError:
+        return None
+    return set(labels)
+
+
+def _push_down_projections(stages, columns):
+    """
+    Work out, from the end of the plan backwards, which columns each stage needs,
+    and drop all the others as early as possible: at the source of the plan, before
+    column-heavy verbs and on the right-hand side of joins.
+    """
+    received = _plan_columns(stages, columns)
+    needed = None  # None stands for every column
+    rewritten = []
+    for stage, stage_columns in reversed(list(zip(stages, received))):
+        stage, needed = _needed_columns(stage, needed, stage_columns)
+        rewritten.append(stage)
+        if isinstance(stage, Stage) and stage.verb in _COLUMN_HEAVY_VERBS:
+            projection = _projection(needed, stage_columns)
+            if projection is not None:
+                rewritten.append(projection)
+    projection = _projection(needed, columns)
+    if projection is not None and not (
+        rewritten and rewritten[-1].params == projection.params
+    ):
+        rewritten.append(projection)
+    return rewritten[::-1]
+
+
+def _projection(needed, columns):
+    """
+    :return: a stage keeping the `needed` columns out of `columns`,
+             or None if it would not drop anything (or cannot be built safely)
+    """
+    if (
+        needed is None
+        or columns is None
+        or isinstance(columns, _OpenColumns)
+        or len(set(columns)) != len(columns)
+        or not set(columns) - needed
+    ):
+        return None
+    return _project([c for c in columns if c in needed])
+
+
+def _needed_columns(stage, needed, columns):
+    """
+    Work out which input columns a stage needs to produce the `needed` output columns.
+
+    :param stage: the stage
+    :param needed: the set of output columns later stages need, or None for all
+    :param columns: the columns the stage receives, if known
+    :return: the stage (rewritten to drop unneeded columns of a join's right-hand side)
+             and the set of columns it needs, or None for all of them
+    """
+    if not isinstance(stage, Stage):
+        return stage, None
+    params = stage.params
+    if stage.verb == "pivot_table":
+        if params["values"] is None or params["index"] is None:
+            return stage, None
+        labels = [
+            _labels(params[key], columns) for key in ("values", "index", "columns")
+        ]
+        return stage, None if None in labels else set().union(*labels)
+    if stage.verb == "gather":
+        if params["value_vars"] is None:
+            return stage, None
+        labels = [_labels(params[key], columns) for key in ("id_vars", "value_vars")]
+        return stage, None if None in labels else set().union(*labels)
+    if stage.verb == "summarise":
+        labels = [
+            _labels(spec[0], columns)
+            for spec in params["aggregations"].values()
+            if spec != "size"
+        ]
+        return stage, None if None in labels else set().union(*labels)
+    if stage.verb == "count_null":
+        if params["column"] is None or params["index"] is not None:
+            return stage, None
+        return stage, _labels(params["column"], columns)
+    if needed is None:
+        return stage, None
+    if stage.verb in ("head", "tail", "filter", "project"):
+        return stage, needed
+    if stage.verb == "compact":
+        # Columns are compacted independently of each other: those no later stage
+        # needs are not read, nor converted
+        numeric, dtypes = params["columns"], params["dtypes"]
+        if numeric is not None:
+            numeric = [c for c in numeric if c in needed]
+        if dtypes is not None:
+            dtypes = {c: dtype for c, dtype in dtypes.items() if c in needed}
+        return compact(**dict(params, columns=numeric, dtypes=dtypes)), needed
+    if stage.verb == "group_by":
+        labels = _labels(params["keys"], columns)
+        return stage, None if labels is None else needed | labels
+    if stage.verb == "fill_na" and params["axis"] in (0, "index"):
+        return stage, needed
+    if stage.verb == "select":
+        used = _query_columns(params["query_str"])
+        return stage, None if used is None else needed | used
+    if stage.verb in ("arrange", "drop_na") and params["axis"] in (0, "index"):
+        key = "by" if stage.verb == "arrange" else "subset"
+        labels = _labels(params[key], columns)
+        if params[key] is None or labels is None:
+            return stage, None
+        return stage, needed | labels
+    if stage.verb == "drop" and _drops_columns_only(params):
+        # Dropped columns are kept until the drop so that it still finds them
+        return stage, needed | set(
+            _as_list(params["columns"]) + _as_list(params["labels"])
+        )
+    if (
+        stage.verb == "one_hot"
+        and params["columns"] is not None
+        and columns is not None
+    ):
+        encoded = _labels(params["columns"], columns)
+        if encoded is None:
+            return stage, None
+        return stage, {c for c in needed if c in columns} | encoded
+    if stage.verb == "join":
+        return _prune_join(stage, needed, columns)
+    if _is_expression_mutate(stage):
+        # Walk the expressions backwards: a column created by one expression is
+        # not needed from the input, unless an earlier expression reads it
+        for name, expr in reversed(list(params["exprs"].items())):
+            used = _query_columns(expr)
+            if used is None:
+                return stage, None
+            needed = (needed - {name}) | used
+        return stage, needed
+    return stage, None
+
+
+def _is_expression_mutate(stage):
+    """
+    :return: whether a stage is a `mutate` that only creates columns from expression
+             strings, which compute every row from that row's values alone
+    """
+    return (
+        isinstance(stage, Stage)
+        and stage.verb == "mutate"
+        and bool(stage.params["exprs"])
+        and all(isinstance(expr, str) for expr in stage.params["exprs"].values())
+    )
+
+
+def _prune_join(stage, needed, columns):
+    """
+    Work out which columns of each side of a join are needed to produce the `needed`
+    columns, and drop the others from the right-hand side. Join keys and columns found
+    on both sides (whose suffixes depend on each other) are always kept.
+    """
+    params = stage.params
+    if (
+        columns is None
+        or isinstance(columns, _OpenColumns)
+        or params["left_index"]
+        or params["right_index"]
+    ):
+        return stage, None
+    right_columns = _frame_columns(params["right"])
+    left_keys, right_keys = _join_keys(params)
+    overlap = set(columns) & set(right_columns)
+    keep = {"left": set(left_keys) | overlap, "right": set(right_keys) | overlap}
+    for name, side, source in _join_columns(columns, right_columns, params):
+        if name in needed:
+            keep[side].add(source)
+    if (
+        len(set(right_columns)) == len(right_columns)
+        and set(right_columns) - keep["right"]
+        # Projecting the right-hand side would lose the index of its keys
+        and not params["right"]._key_indexes
+    ):
+        kept = [c for c in right_columns if c in keep["right"]]
+        if params["right"].is_lazy:
+            # Projected by the right-hand side's own plan, when it runs
+            stage = join(**dict(params, right=params["right"] + _project(kept)))
+        else:
+            stage = _projected_join(params, kept)
+    return stage, keep["left"]
+
+
+def _projected_join(params, right_columns):
+    """
+    A `join` stage whose (eager) right-hand side is projected on `right_columns` when
+    the stage runs, rather than when the plan is optimized: a plan optimized once
+    (see `Pipeline.compile`) then sees later changes to the right-hand side.
+    """
+    params = dict(params, right_columns=right_columns)
+    join_params = {
+        key: value for key, value in params.items() if key != "right_columns"
+    }
+
+    def d2_func(d1):
+        return join(**dict(join_params, right=_right_frame(params)))(d1)
+
+    return Stage(d2_func, "join", params)
+
+
+def _push_down_predicates(stages, columns):
+    """
+    Move `select` and `filter` stages as close to the source of the plan as possible,
+    so that later stages (in particular joins) process fewer rows.
+    """
+    rewritten = True
+    while rewritten:
+        rewritten = False
+        received = _plan_columns(stages, columns)
+        for i in range(1, len(stages)):
+            pushed = _push_below(stages[i - 1], stages[i], received[i - 1])
+            if pushed is not None:
+                stages[i - 1 : i + 1] = pushed
+                rewritten = True
+                break
+    return stages
+
+
+def _push_below(stage, predicate, columns):
+    """
+    Try to rewrite `stage + predicate` so that the predicate runs first.
+
+    :param stage: the stage preceding the predicate
+    :param predicate: a `select` or `filter` stage
+    :param columns: the columns `stage` receives, if known
+    :return: the stages replacing the pair, or None if the predicate has to stay put
+    """
+    if not isinstance(stage, Stage) or not isinstance(predicate, Stage):
+        return None
+    if predicate.verb == "filter":
+        if _filter_commutes(stage, predicate.params["boolean_series"]):
+            return [predicate, stage]
+        return None
+    if predicate.verb != "select":
+        return None
+    query_str = predicate.params["query_str"]
+    if stage.verb == "select":
+        return [select(f"({stage.params['query_str']}) and ({query_str})")]
+    used = _query_columns(query_str)
+    if used is None or columns is None:
+        return None
+    if stage.verb == "join":
+        return _push_into_join(stage, query_str, used, columns)
+    if not used <= set(columns):
+        return None
+    if stage.verb == "gather":
+        return _push_into_gather(stage, query_str, used)
+    if stage.verb == "one_hot" and not _has_fixed_categories(stage.params):
+        return _push_into_one_hot(stage, query_str, used)
+    if _select_commutes(stage, used):
+        return [predicate, stage]
+    return None
+
+
+def _select_commutes(stage, used):
+    """
+    :return: whether a `select` reading the columns `used` can run before `stage`
+             without changing the result
+    """
+    params = stage.params
+    if stage.verb == "one_hot":
+        return _has_fixed_categories(params) and not used & set(
+            _as_list(params["columns"])
+        )
+    if _is_expression_mutate(stage):
+        return not used & set(params["exprs"])
+    if stage.verb == "drop_na":
+        return params["axis"] in (0, "index")
+    if stage.verb == "drop":
+        dropped = set(_as_list(params["columns"]) + _as_list(params["labels"]))
+        return _drops_columns_only(params) and not used & dropped
+    if stage.verb == "fill_na":
+        return (
+            params["method"] is None
+            and params["limit"] is None
+            and params["axis"] in (0, "index")
+            and isinstance(params["value"], dict)
+            and not used & set(params["value"])
+        )
+    return False
+
+
+def _filter_commutes(stage, boolean_series):
+    """
+    :return: whether a `filter` on `boolean_series` can run before `stage`
+             without changing the result
+    """
+    params = stage.params
+    if stage.verb == "drop":
+        return _drops_columns_only(params)
+    if _is_expression_mutate(stage):
+        return True
+    if stage.verb == "fill_na":
+        return (
+            params["method"] is None
+            and params["limit"] is None
+            and params["axis"] in (0, "index")
+        )
+    if stage.verb == "drop_na":
+        # Label-aligned masks survive dropped rows, positional ones do not
+        return params["axis"] in (0, "index") and isinstance(boolean_series, pd.Series)
+    return False
+
+
+def _unfuse(stage, query_str):
+    """
+    Split a stage a predicate has already been pushed into back into its own
+    parameters and the query to push, combined with the one already pushed.
+    """
+    params = dict(stage.params)
+    if "query_str" in params:
+        query_str = f"({params.pop('query_str')}) and ({query_str})"
+    return params, query_str
+
+
+def _push_into_one_hot(stage, query_str, used):
+    """
+    Rewrite `one_hot + select` so that the rows are filtered before being encoded.
+    The encoded columns keep the categories of the unfiltered data, so that the same
+    indicator columns are produced. Only predicates on other columns qualify. With
+    `dummy_na`, only object and categorical columns are encoded after the filter.
+    """
+    params, query_str = _unfuse(stage, query_str)
+    if params["columns"] is None or used & set(_as_list(params["columns"])):
+        return None
+
+    def d2_func(d1):
+        mask = np.asarray(d1.pandas_df.eval(query_str), dtype=bool)
+        encoded = d1.pandas_df[_as_list(params["columns"])]
+        if params["dummy_na"] and not all(
+            dtype == object or isinstance(dtype, pd.CategoricalDtype)
+            for dtype in encoded.dtypes
+        ):
+            # get_dummies names the indicators of other columns after categories
+            # upcast by the missing one (e.g. "num_1.0", "num_<NA>"): encode first
+            return DplyFrame(one_hot(**params)(d1).pandas_df[mask])
+        categories = {
+            column: pd.CategoricalDtype(pd.factorize(values, sort=True)[1])
+            for column, values in encoded.items()
+            if not isinstance(values.dtype, pd.CategoricalDtype)
+        }
+        filtered = d1.pandas_df[mask].astype(categories)
+        return one_hot(**params)(DplyFrame(filtered))
+
+    return [Stage(d2_func, "one_hot", dict(params, query_str=query_str))]
+
+
+def _push_into_gather(stage, query_str, used):
+    """
+    Rewrite `gather + select` so that the rows are filtered before being unpivoted.
+    Only predicates on identifier variables (which `gather` copies as-is) qualify.
+    """
+    params, query_str = _unfuse(stage, query_str)
+    if not used <= set(_as_list(params["id_vars"])):
+        return None
+    if not params["ignore_index"]:
+        return [select(query_str), stage]
+
+    def d2_func(d1):
+        mask = np.asarray(d1.pandas_df.eval(query_str), dtype=bool)
+        melted = gather(**params)(DplyFrame(d1.pandas_df[mask])).pandas_df
+        # Number the rows as if they had been filtered after unpivoting
+        n_values = len(_as_list(params["value_vars"])) or len(
+            d1.pandas_df.columns.difference(_as_list(params["id_vars"]))
+        )
+        full_mask = np.tile(mask, n_values)
+        melted.index = pd.RangeIndex(len(full_mask))[full_mask]
+        return DplyFrame(melted)
+
+    return [Stage(d2_func, "gather", dict(params, query_str=query_str))]
+
+
+def _push_into_join(stage, query_str, used, columns):
+    """
+    Rewrite `join + select` so that one side of the join is filtered before merging.
+    This is only done where `DataFrame.merge` keeps the row order of the filtered side
+    (left, right and cross joins; the row order of inner joins depends on the pandas
+    version and on the relative sizes of the inputs). The rows are then renumbered and
+    re-typed as if they had been filtered after the merge.
+    """
+    params, query_str = _unfuse(stage, query_str)
+    how = params["how"]
+    if params["left_index"] or params["right_index"] or params["sort"]:
+        return None
+    if params["memory_limit"] is not None:
+        return None
+    right_columns = _right_columns(params)
+    shared_keys = set(_as_list(params["on"]))
+    if isinstance(columns, _OpenColumns):
+        # Unknown left columns could collide with (and rename) right ones
+        return None
+    if how in ("left", "cross"):
+        side, side_columns, other_columns = "left", columns, right_columns
+    elif how == "right":
+        side, side_columns, other_columns = "right", right_columns, columns
+    else:
+        return None
+    if not used <= set(side_columns):
+        return None
+    if any(c in other_columns and c not in shared_keys for c in used):
+        return None
+
+    def d2_func(d1):
+        left, right = d1.pandas_df, _right_frame(params).pandas_df
+        outer, inner = (left, right) if side == "left" else (right, left)
+        mask = np.asarray(outer.eval(query_str), dtype=bool)
+        if side == "left":
+            left = left[mask]
+        else:
+            right = right[mask]
+        merged = _merge(left, right, params)
+        # Merging an empty frame can reorder the key columns
+        output = _join_columns(list(d1.pandas_df.columns), right_columns, params)
+        if list(merged.columns) != [name for name, _, _ in output]:
+            merged = merged[[name for name, _, _ in output]]
+
+        # Rebuild the index the filter would have left on the unfiltered merge
+        matches = _count_matches(outer, inner, params, side)
+        unmatched = matches == 0
+        if how in ("left", "right"):
+            matches = np.maximum(matches, 1)
+        full_mask = np.repeat(mask, matches)
+        merged.index = pd.RangeIndex(len(full_mask))[full_mask]
+
+        # Rows dropped by the filter may have been the only unmatched ones,
+        # which would have upcast the other side's columns (e.g. int to float)
+        if how in ("left", "right") and unmatched.any() and not unmatched[mask].any():
+            for name, source_side, source in output:
+                if source_side != side and name not in shared_keys:
+                    padded = inner[source].iloc[:0].reindex([0])
+                    merged[name] = merged[name].astype(padded.dtype)
+        return DplyFrame(merged)
+
+    return [Stage(d2_func, "join", dict(params, query_str=query_str))]
+
+
+def _merge(left, right, params):
+    """
+    `DataFrame.merge` with the parameters of a `join` stage
+    """
+    return left.merge(
+        right,
+        params["how"],
+        params["on"],
+        params["left_on"],
+        params["right_on"],
+        params["left_index"],
+        params["right_index"],
+        params["sort"],
+        params["suffixes"],
+    )
+
+
+# From pandas 2.2, inner merges keep the order of the left rows, as lookup joins do;
+# before, they group the rows by key
+_INNER_MERGE_KEEPS_ORDER = tuple(
+    int(part) for part in pd.__version__.split(".")[:2]
+) >= (2, 2)
+
+
+def _lookup_index(left, right, params):
+    """
+    :return: the index of the right-hand side's keys a `join` can look the left keys
+             up in (see `DplyFrame.index_keys`), or None if it has to merge
+    """
+    lookup = ("left", "inner") if _INNER_MERGE_KEEPS_ORDER else ("left",)
+    if (
+        params["how"] not in lookup
+        # DataFrame.merge gives an empty left side's result an object index
+        or len(left) == 0
+        or params["on"] is None
+        or params["left_index"]
+        or params["right_index"]
+        or params["sort"]
+    ):
+        return None
+    keys = _as_list(params["on"])
+    key_index = right._key_index(keys)
+    if key_index is None:
+        return None
+    right_columns = list(right.pandas_df.columns)
+    left_columns = list(left.columns)
+    if (
+        len(set(left_columns)) < len(left_columns)
+        or len(set(right_columns)) < len(right_columns)
+        or not set(keys) <= set(left_columns)
+        # DataFrame.merge casts keys of different types to a common one
+        or [left[key].dtype for key in keys] != key_index.dtypes
+    ):
+        return None
+    overlap = (set(left_columns) & set(right_columns)) - set(keys)
+    if overlap and not all(params["suffixes"]):
+        # Left to DataFrame.merge, which keeps or rejects the unsuffixed columns
+        return None
+    return key_index
+
+
+def _take(column, positions):
+    """
+    :return: the values of a column at `positions`, missing where they are -1
+    """
+    if isinstance(column.dtype, pd.api.extensions.ExtensionDtype):
+        values = column.array
+    else:
+        values = column.to_numpy()
+    return pd.api.extensions.take(values, positions, allow_fill=True)
+
+
+def _lookup_join(left, right, key_index, params):
+    """
+    Join two DataFrames like `DataFrame.merge` with the parameters of a `join` stage,
+    by looking the keys of the left rows up in the index of the right ones.
+    """
+    keys = key_index.keys
+    rows, matches = key_index.positions(
+        key_index.groups(left, keys), params["how"] == "left"
+    )
+    output = _join_columns(list(left.columns), list(right.columns), params)
+    # Columns are keyed by position until the frame is built: suffixes may make
+    # labels repeat
+    columns = {}
+    for position, (_, side, source) in enumerate(output):
+        if side == "left":
+            columns[position] = _take(left[source], rows)
+        else:
+            columns[position] = _take(right[source], matches)
+    joined = pd.DataFrame(columns, index=pd.RangeIndex(len(rows)), copy=False)
+    joined.columns = [name for name, _, _ in output]
+    return joined
+
+
+def _count_matches(outer, inner, params, side):
+    """
+    Count, for every row of `outer`, the rows of `inner` it is joined with.
+    Missing keys match each other, like they do in `DataFrame.merge`.
+    """
+    if params["how"] == "cross":
+        return np.full(len(outer), len(inner))
+    left_keys, right_keys = _join_keys(params)
+    outer_keys, inner_keys = (
+        (left_keys, right_keys) if side == "left" else (right_keys, left_keys)
+    )
+    codes = [
+        pd.factorize(pd.concat([outer[ok], inner[ik]], ignore_index=True))[0]
+        for ok, ik in zip(outer_keys, inner_keys)
+    ]
+    if len(codes) > 1:
+        codes = [pd.MultiIndex.from_arrays(codes).factorize()[0]]
+    codes = codes[0] + 1
+    counts = np.bincount(codes[len(outer) :], minlength=codes.max(initial=0) + 1)
+    return counts[codes[: len(outer)]]
+
+
+def _row_limit(stage):
+    """
+    :return: how many rows a `head`, `tail` or `slice_row` stage needs from the
+             front (False) or the end (True) of its input, e.g. (10, False),
+             or None if the stage is not such a limit
+    """
+    if not isinstance(stage, Stage):
+        return None
+    params = stage.params
+    if stage.verb in ("head", "tail"):
+        count = params["n"]
+    elif stage.verb == "slice_row" and len(params["args"]) == 2:
+        start, count = params["args"]
+        if not isinstance(start, (int, np.integer)) or start < 0:
+            return None
+    else:
+        return None
+    if not isinstance(count, (int, np.integer)) or count < 0:
+        return None
+    return count, stage.verb == "tail"
+
+
+def _fuse_top_k(stages):
+    """
+    Replace `arrange` followed by `head`, `tail` or `slice_row(start, stop)` with a
+    partial sort that only orders the rows that can end up in the result.
+    """
+    rewritten = []
+    for stage in stages:
+        limit = _row_limit(stage)
+        previous = rewritten[-1] if rewritten else None
+        if (
+            limit is not None
+            and isinstance(previous, Stage)
+            and previous.verb == "arrange"
+            and previous.params["axis"] in (0, "index")
+            and not {"head", "tail", "slice_row"} & set(previous.params)
+        ):
+            rewritten[-1] = _arrange_top_k(previous, stage, *limit)
+        else:
+            rewritten.append(stage)
+    return rewritten
+
+
+def _arrange_top_k(sort_stage, limit_stage, count, from_end):
+    """
+    Fuse an `arrange` stage with the `limit_stage` that follows it.
+    Candidate rows are picked with a partial sort (`numpy.partition`) on the first
+    sort key, keeping every row tied with the last one picked, and only the
+    candidates are then sorted. As `arrange` is a stable sort, this gives the
+    same rows, in the same order, as sorting everything.
+    """
+    params = sort_stage.params
+
+    def d2_func(d1):
+        candidates = _top_k_candidates(
+            d1.pandas_df, params["by"], params["ascending"], count, from_end
+        )
+        if candidates is None:
+            return limit_stage(sort_stage(d1))
+        return limit_stage(sort_stage(DplyFrame(d1.pandas_df.take(candidates))))
+
+    return Stage(d2_func, "arrange", dict(params, **{limit_stage.verb: limit_stage}))
+
+
+def _top_k_candidates(pandas_df, by, ascending, count, from_end):
+    """
+    Find the rows that can be among the first (or last) `count` rows of `pandas_df`
+    once sorted by `by`.
+
+    :return: the positions of the candidate rows, in increasing order,
+             or None if a full sort is as cheap or the first key is not a plain
+             numeric, boolean or datetime column
+    """
+    keys = _as_list(by)
+    if not keys or 4 * count >= len(pandas_df):
+        return None
+    try:
+        values = pandas_df[keys[0]]
+    except (KeyError, TypeError):
+        return None
+    if not isinstance(values, pd.Series) or not isinstance(values.dtype, np.dtype):
+        return None
+    if values.dtype.kind not in "biufmM":
+        return None
+    if isinstance(ascending, (list, tuple)):
+        ascending = ascending[0] if ascending else True
+    values = values.to_numpy()
+    missing = pd.isna(values)
+    present, absent = np.flatnonzero(~missing), np.flatnonzero(missing)
+
+    # Missing keys sort last; their order depends on the other keys, so they are
+    # either all candidates or none of them
+    if from_end:
+        needed = count - len(absent)
+        candidates = [absent]
+    else:
+        needed = min(count, len(present))
+        candidates = [absent] if count > len(present) else []
+    if 0 < needed < len(present):
+        values = values[present]
+        if ascending != from_end:
+            boundary = np.partition(values, needed - 1)[needed - 1]
+            present = present[values <= boundary]
+        else:
+            boundary = np.partition(values, len(values) - needed)[len(values) - needed]
+            present = present[values >= boundary]
+    if needed > 0:
+        candidates.append(present)
+    if not candidates:
+        return np.array([], dtype=np.intp)
+    return np.sort(np.concatenate(candidates))
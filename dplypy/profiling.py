@@ -0,0 +1,374 @@
+"""
+Per-stage profiling of pipelines (see `profile`).
+While a Profile is active, every stage a DplyFrame runs, eagerly with `+` or in the
+logical plan of a lazy DplyFrame, is timed and measured: wall and CPU time, the rows
+and columns it receives and returns, the memory used by these frames, the peak
+memory it allocates (with `tracemalloc`), how much of its output shares buffers
+with its input rather than copying it, and the peak resident memory of the process.
+"""
+import contextlib
+import itertools
+import sys
+import threading
+import time
+import tracemalloc
+import warnings
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: the peak resident memory is not measured
+    resource = None
+
+import numpy as np
+import pandas as pd
+
+# The Profile recording the stages that run, if any
+_active = None
+
+# The stages running in each thread, innermost last, to which the peak allocation of
+# the stages they run is carried over
+_running = threading.local()
+
+# The peak traced memory can only be reset from Python 3.9: before, the peak allocation
+# of a stage is approximated by the memory it still holds when it returns
+_RESET_PEAK = hasattr(tracemalloc, "reset_peak")
+
+
+class MemoryBudgetWarning(UserWarning):
+    """
+    Warned when a profiled stage uses more memory than the budget given to `profile`
+    """
+
+
+@contextlib.contextmanager
+def profile(trace_memory=True, deep=False, memory_budget=None):
+    """
+    Profile the stages run within the `with` block:
+
+    ```
+    with profile() as stats:
+        output = df + select("price > 0") + mutate(total="price * qty")
+    print(stats.report())
+    ```
+
+    Stages run in worker processes (see `DplyFrame.parallel`) are not recorded,
+    those run in threads are, but their peak allocations then overlap.
+
+    :param trace_memory: whether to measure the peak allocation of each stage, which
+                         slows down code that allocates many small objects (on
+                         Python 3.8, the memory a stage still holds when it returns
+                         is measured instead)
+    :param deep: whether the memory used by frames includes the contents of Python
+                 objects, e.g. strings, which takes time to measure
+    :param memory_budget: a number of bytes: a MemoryBudgetWarning is issued for
+                          each call of a stage whose peak allocation (or, when
+                          memory is not traced, the size of the buffers it newly
+                          allocated for its output) exceeds it
+    :return: a context manager yielding the Profile
+    """
+    global _active
+    previous = _active
+    stats = Profile(deep, memory_budget)
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _active = stats
+    try:
+        yield stats
+    finally:
+        _active = previous
+        if started:
+            tracemalloc.stop()
+
+
+def call(stage, d1):
+    """
+    Run a stage on a DplyFrame, and record it in the active Profile, if any.
+
+    :return: what the stage returns
+    """
+    stats = _active
+    if stats is None:
+        return stage(d1)
+    return stats.record(stage, d1)
+
+
+def _shape(data):
+    """
+    :return: the number of rows and columns of a pandas object, or (None, None)
+    """
+    if not isinstance(data, (pd.DataFrame, pd.Series)):
+        return None, None
+    return len(data), data.shape[1] if data.ndim == 2 else 1
+
+
+def _label(stage):
+    if hasattr(stage, "verb"):
+        return repr(stage)
+    return getattr(stage, "__qualname__", type(stage).__name__)
+
+
+def _short(label):
+    return label if len(label) <= 60 else label[:57] + "..."
+
+
+def _buffers(data):
+    """
+    :return: the numpy arrays holding the values of a pandas object's columns and
+             index (the codes of categoricals, the values and masks of nullable
+             arrays...), or an empty list
+    """
+    if not isinstance(data, (pd.DataFrame, pd.Series)):
+        return []
+    arrays = list(data._mgr.arrays)
+    if not isinstance(data.index, pd.RangeIndex):
+        # A RangeIndex has no buffer: its values are created when they are accessed
+        arrays.append(data.index.values)
+    buffers = []
+    for values in arrays:
+        if isinstance(values, np.ndarray):
+            buffers.append(values)
+            continue
+        for name in ("_ndarray", "_codes", "_data", "_mask"):
+            inner = getattr(values, name, None)
+            # Categoricals' codes are both their `_ndarray` and their `_codes`
+            if isinstance(inner, np.ndarray) and not any(
+                inner is other for other in buffers
+            ):
+                buffers.append(inner)
+    return buffers
+
+
+def _sharing(inputs, outputs):
+    """
+    :return: the number of bytes of the `outputs` buffers that share memory with one
+             of the `inputs` buffers, and of those that do not, i.e. were copied or
+             computed by the stage
+    """
+    shared = new = 0
+    for values in outputs:
+        if any(np.may_share_memory(values, other) for other in inputs):
+            shared += values.nbytes
+        else:
+            new += values.nbytes
+    return shared, new
+
+
+def _peak_rss():
+    """
+    :return: the peak resident memory of the process so far, in bytes, or None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _traced_peak():
+    """
+    :return: the peak traced memory since it was last reset, or without `_RESET_PEAK`
+             the memory traced now
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    return peak if _RESET_PEAK else current
+
+
+class _Running:
+    """
+    A stage running in a thread, and the peak memory traced since it started
+    """
+
+    def __init__(self, tracing):
+        self.start = self.peak = tracemalloc.get_traced_memory()[0] if tracing else 0
+
+
+class Profile:
+    """
+    The measurements of the stages run while profiling, one record per call: a stage
+    is called once per chunk or partition of rows in a chunked or parallel plan.
+    """
+
+    def __init__(self, deep=False, memory_budget=None):
+        """
+        :param deep: whether the memory used by frames includes the contents of
+                     Python objects
+        :param memory_budget: the number of bytes beyond which a stage's memory use
+                              is warned about (see `profile`), or None
+        """
+        self.deep = deep
+        self.memory_budget = memory_budget
+        self.records = []
+        self._lock = threading.Lock()
+        # Numbers the calls in the order they start
+        self._calls = itertools.count()
+
+    def _memory(self, data):
+        if not isinstance(data, (pd.DataFrame, pd.Series)):
+            return None
+        return int(np.sum(data.memory_usage(index=True, deep=self.deep)))
+
+    def record(self, stage, d1):
+        """
+        Run a stage on a DplyFrame, and record its measurements.
+
+        :return: what the stage returns
+        """
+        pandas_df = d1.pandas_df
+        rows_in, columns_in = _shape(pandas_df)
+        memory_in = self._memory(pandas_df)
+        buffers_in = _buffers(pandas_df)
+
+        stack = getattr(_running, "stack", None)
+        if stack is None:
+            stack = _running.stack = []
+        depth = len(stack)
+        number = next(self._calls)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            if stack:
+                # Keep the enclosing stage's peak before resetting it for this one
+                stack[-1].peak = max(stack[-1].peak, _traced_peak())
+            if _RESET_PEAK:
+                tracemalloc.reset_peak()
+        stack.append(_Running(tracing))
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            output = stage(d1)
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = None
+            running = stack.pop()
+            if tracing:
+                running.peak = max(running.peak, _traced_peak())
+                peak = running.peak - running.start
+                if stack:
+                    stack[-1].peak = max(stack[-1].peak, running.peak)
+
+        result = getattr(output, "pandas_df", output)
+        rows_out, columns_out = _shape(result)
+        buffers_out = _buffers(result)
+        shared, new = _sharing(buffers_in, buffers_out) if buffers_out else (None,) * 2
+        record = {
+            "stage": stage,
+            "wall_time": wall,
+            "cpu_time": cpu,
+            "rows_in": rows_in,
+            "rows_out": rows_out,
+            "columns_in": columns_in,
+            "columns_out": columns_out,
+            "memory_in": memory_in,
+            "memory_out": self._memory(result),
+            "peak_memory": peak,
+            "shared_bytes": shared,
+            "new_bytes": new,
+            "peak_rss": _peak_rss(),
+            # Stages run by another stage, e.g. a function adding stages, are nested
+            "depth": depth,
+            "number": number,
+        }
+        with self._lock:
+            self.records.append(record)
+        used = peak if tracing else new
+        if self.memory_budget is not None and used and used > self.memory_budget:
+            warnings.warn(
+                f"{_short(_label(stage))} used {_size(used)} of memory, beyond the "
+                f"budget of {_size(self.memory_budget)}",
+                MemoryBudgetWarning,
+                stacklevel=3,
+            )
+        return output
+
+    def to_frame(self):
+        """
+        :return: a pandas DataFrame with one row per stage, in the order they first
+                 ran: its label, the number of calls, the total wall and CPU times
+                 (in seconds), rows and memory (in bytes) received and returned
+                 over all calls, the columns received and returned by the last call,
+                 the peak memory allocated by a call (None when not traced), the
+                 bytes of the output buffers shared with the input and newly
+                 allocated over all calls, and the peak resident memory of the
+                 process after the stage
+        """
+        columns = [
+            "stage",
+            "calls",
+            "wall_time",
+            "cpu_time",
+            "rows_in",
+            "rows_out",
+            "columns_in",
+            "columns_out",
+            "memory_in",
+            "memory_out",
+            "peak_memory",
+            "shared_bytes",
+            "new_bytes",
+            "peak_rss",
+        ]
+        with self._lock:
+            records = list(self.records)
+        if not records:
+            return pd.DataFrame(columns=columns)
+        calls = pd.DataFrame.from_records(records).sort_values("number")
+        # Calls of the same stage object are grouped, in the order of their first call
+        calls["key"] = pd.factorize(calls["stage"].map(id))[0]
+        calls["stage"] = calls["stage"].map(_label)
+        grouped = calls.groupby("key", sort=True)
+        summed = ["wall_time", "cpu_time", "rows_in", "rows_out"]
+        summed += ["memory_in", "memory_out", "shared_bytes", "new_bytes"]
+        frame = grouped[summed].sum(min_count=1)
+        frame["stage"] = grouped["stage"].first()
+        frame["calls"] = grouped.size()
+        frame[["columns_in", "columns_out"]] = grouped[
+            ["columns_in", "columns_out"]
+        ].last()
+        frame[["peak_memory", "peak_rss"]] = grouped[["peak_memory", "peak_rss"]].max()
+        # Sinks return no frame, and peaks are not always traced
+        frame[columns[4:]] = frame[columns[4:]].astype("Int64")
+        return frame[columns].reset_index(drop=True)
+
+    def report(self):
+        """
+        :return: the table of `to_frame`, with readable times and sizes, and totals
+        """
+        frame = self.to_frame()
+        if frame.empty:
+            return "No stage was profiled"
+        table = frame.to_string(
+            formatters={
+                "stage": _short,
+                "wall_time": "{:.4f}s".format,
+                "cpu_time": "{:.4f}s".format,
+                "memory_in": _size,
+                "memory_out": _size,
+                "peak_memory": _size,
+                "shared_bytes": _size,
+                "new_bytes": _size,
+                "peak_rss": _size,
+            },
+        )
+        # Nested stages are already counted in the stages that run them
+        outer = [record for record in self.records if record["depth"] == 0]
+        total = (
+            f"{len(self.records)} calls of {len(frame)} stages: "
+            f"{sum(record['wall_time'] for record in outer):.4f}s wall time, "
+            f"{sum(record['cpu_time'] for record in outer):.4f}s CPU time"
+        )
+        return f"{table}\n{total}"
+
+    def __repr__(self):
+        return self.report()
+
+
+def _size(value):
+    """
+    :return: a number of bytes in a readable unit
+    """
+    if value is None or pd.isna(value):
+        return "-"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(value) < 1024 or unit == "GiB":
+            return f"{value:.0f}{unit}" if unit == "B" else f"{value:.1f}{unit}"
+        value /= 1024
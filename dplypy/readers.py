@@ -0,0 +1,293 @@
+"""
+Functions that create DplyFrames from files.
+Readers return lazy DplyFrames, so that the optimizer can push column selections
+into the reader and row-local pipeline stages can be streamed chunk by chunk.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from dplypy.compaction import compact_frame
+from dplypy.dplyframe import DplyFrame
+from dplypy.writers import LAYOUT_FILE
+
+
+class CsvSource:
+    """
+    A CSV file to be read, in one go or in chunks of rows,
+    by the logical plan of a lazy DplyFrame.
+    """
+
+    def __init__(self, file_path, chunksize=None, compact=False, **kwargs):
+        """
+        :param file_path: the path of the CSV file
+        :param chunksize: number of rows per chunk, or None to read the file at once
+        :param compact: whether to compact the types of the string columns read
+                        (see `compaction.compact_frame`)
+        :param kwargs: other arguments of `pandas.read_csv`
+        """
+        self.file_path = file_path
+        self.chunksize = chunksize
+        self.compact = compact
+        self.kwargs = kwargs
+        self._columns = None
+
+    @property
+    def columns(self):
+        """
+        The columns of the file, read from its header
+        """
+        if self._columns is None:
+            kwargs = dict(self.kwargs, nrows=0)
+            self._columns = pd.read_csv(self.file_path, **kwargs).columns
+        return self._columns
+
+    def fingerprint(self):
+        """
+        :return: what identifies the data read (see `cache.fingerprint`): the path,
+                 size and modification time of the file, and the reading options
+        """
+        stat = os.stat(self.file_path)
+        path = os.path.abspath(self.file_path)
+        return "csv", path, stat.st_size, stat.st_mtime_ns, self.compact, self.kwargs
+
+    def _read_kwargs(self, columns):
+        """
+        :param columns: the columns to read, or None for all of them
+        """
+        if columns is None:
+            return self.kwargs
+        return dict(self.kwargs, usecols=list(columns) + self._parsed(columns))
+
+    def _parsed(self, columns):
+        """
+        :return: the columns of `parse_dates` that are not in `columns`: they are
+                 read, parsed, and dropped
+        """
+        parse_dates = self.kwargs.get("parse_dates")
+        if not isinstance(parse_dates, (list, tuple)):
+            return []
+        return [column for column in parse_dates if column not in columns]
+
+    def _refers_by_position(self):
+        """
+        :return: whether the reading options refer to columns by position, or combine
+                 columns into new ones, which selecting columns would change
+        """
+        parse_dates = self.kwargs.get("parse_dates")
+        if isinstance(parse_dates, dict):
+            return True
+        labels = list(parse_dates) if isinstance(parse_dates, (list, tuple)) else []
+        for option in ("converters", "dtype", "na_values"):
+            if isinstance(self.kwargs.get(option), dict):
+                labels += list(self.kwargs[option])
+        return not all(isinstance(label, str) for label in labels)
+
+    def _selected(self, pandas_df, columns):
+        """
+        :param columns: the columns selected, or None for all of them
+        :return: the DataFrame without the columns only read for `parse_dates`
+        """
+        if columns is None or len(pandas_df.columns) == len(columns):
+            return pandas_df
+        return pandas_df.drop(columns=self._parsed(columns))
+
+    def _compacted(self, pandas_df):
+        return compact_frame(pandas_df)[0] if self.compact else pandas_df
+
+    def can_select(self):
+        """
+        :return: whether the reader itself can select columns (with `usecols`),
+                 which is not the case if the reading options already select
+                 or reorganize the columns, or refer to columns by position
+        """
+        return not (
+            {"usecols", "index_col", "names", "header"} & set(self.kwargs)
+            or self._refers_by_position()
+        )
+
+    def read(self, columns=None):
+        """
+        Read the whole file into a pandas DataFrame.
+
+        :param columns: the columns to read, or None for all of them
+        """
+        pandas_df = pd.read_csv(self.file_path, **self._read_kwargs(columns))
+        return self._compacted(self._selected(pandas_df, columns))
+
+    def chunks(self, columns=None):
+        """
+        Read the file in pandas DataFrames of (up to) `chunksize` rows.
+        At least one (possibly empty) chunk is always produced.
+
+        :param columns: the columns to read, or None for all of them
+        """
+        kwargs = self._read_kwargs(columns)
+        produced = False
+        with pd.read_csv(self.file_path, chunksize=self.chunksize, **kwargs) as reader:
+            for chunk in reader:
+                produced = True
+                yield self._compacted(self._selected(chunk, columns))
+        if not produced:
+            empty = pd.read_csv(self.file_path, **dict(kwargs, nrows=0))
+            yield self._selected(empty, columns)
+
+
+class ColumnsSource:
+    """
+    A column directory (see `writers.write_columns`) to be memory-mapped, in one go
+    or in chunks of rows, by the logical plan of a lazy DplyFrame.
+    """
+
+    def __init__(self, dir_path, chunksize=None):
+        """
+        :param dir_path: the path of the column directory
+        :param chunksize: number of rows per chunk, or None to map all of them at once
+        """
+        self.dir_path = dir_path
+        self.chunksize = chunksize
+        self._layout = None
+
+    @property
+    def layout(self):
+        """
+        The names and types of the columns and of the index, and the number of rows
+        """
+        if self._layout is None:
+            self._layout = pd.read_pickle(os.path.join(self.dir_path, LAYOUT_FILE))
+        return self._layout
+
+    @property
+    def columns(self):
+        """
+        The columns of the directory, read from its layout
+        """
+        return self.layout["columns"]
+
+    def fingerprint(self):
+        """
+        :return: what identifies the data mapped (see `cache.fingerprint`): the path
+                 of the directory, and the size and modification time of its layout,
+                 which is rewritten with the columns
+        """
+        stat = os.stat(os.path.join(self.dir_path, LAYOUT_FILE))
+        path = os.path.abspath(self.dir_path)
+        return "columns", path, stat.st_size, stat.st_mtime_ns
+
+    def can_select(self):
+        """
+        :return: True, columns are mapped one by one
+        """
+        return True
+
+    def _load(self, name, dtype):
+        """
+        Map a .npy file copy-on-write: its pages are only read when they are used,
+        are shared with other processes mapping the file, and can be modified
+        without changing the file. Python objects cannot be mapped, and are read.
+        """
+        path = os.path.join(self.dir_path, name)
+        if isinstance(dtype, np.dtype) and dtype != object:
+            # A plain ndarray view of the mapping, which it keeps open
+            return np.load(path, mmap_mode="c").view(np.ndarray)
+        return np.load(path, allow_pickle=True)
+
+    def _index(self):
+        index = self.layout["index"]
+        if isinstance(index, pd.RangeIndex):
+            return index
+        values = self._load("index.npy", index.dtype)
+        if isinstance(index, pd.MultiIndex):
+            return pd.MultiIndex.from_tuples(values, names=index.names)
+        return pd.Index(values, dtype=index.dtype, name=index.name)
+
+    def _map(self, columns):
+        """
+        :param columns: the columns to map, or None for all of them
+        :return: the index, and a dictionary of the columns' arrays by position
+        """
+        names = list(self.columns)
+        positions = range(len(names)) if columns is None else map(names.index, columns)
+        dtypes = self.layout["dtypes"]
+        arrays = {i: self._load(f"{i}.npy", dtypes[i]) for i in positions}
+        return self._index(), arrays
+
+    def _frame(self, index, arrays, rows):
+        """
+        :param rows: the slice of rows to return
+        :return: a pandas DataFrame whose numpy columns are views of the mapped files
+        """
+        columns = {}
+        for position, values in arrays.items():
+            dtype = self.layout["dtypes"][position]
+            columns[position] = values[rows]
+            if not isinstance(dtype, np.dtype):
+                columns[position] = pd.array(columns[position], dtype=dtype)
+        # Columns are keyed by position until the frame is built: names may repeat
+        pandas_df = pd.DataFrame(columns, index=index[rows], copy=False)
+        pandas_df.columns = self.columns[list(columns)]
+        return pandas_df
+
+    def read(self, columns=None):
+        """
+        Map the whole directory into a pandas DataFrame.
+
+        :param columns: the columns to map, or None for all of them
+        """
+        return self._frame(*self._map(columns), slice(None))
+
+    def chunks(self, columns=None):
+        """
+        Map the directory in pandas DataFrames of (up to) `chunksize` rows.
+        At least one (possibly empty) chunk is always produced.
+
+        :param columns: the columns to map, or None for all of them
+        """
+        index, arrays = self._map(columns)
+        for start in range(0, max(self.layout["length"], 1), self.chunksize):
+            yield self._frame(index, arrays, slice(start, start + self.chunksize))
+
+
+def read_columns(dir_path, chunksize=None):
+    """
+    Read a column directory, written by `write_file` to a path ending with
+    ".columns", into a lazy DplyFrame.
+    Instead of being read, the files of the columns the plan needs are memory-mapped:
+    the DplyFrame's numpy columns are views of them, and their pages are only read
+    from disk when a stage uses them (and then shared with the other processes that
+    map them, e.g. the workers of `DplyFrame.parallel`). Columns of other types
+    (strings, categoricals...) are read into memory. With `chunksize`, the plan runs
+    chunk by chunk as with `read_csv`.
+
+    :param dir_path: the path of the column directory
+    :param chunksize: number of rows per chunk, or None to map all of them at once
+    :return: a lazy DplyFrame
+    """
+    return DplyFrame._from_source(ColumnsSource(dir_path, chunksize))
+
+
+def read_csv(file_path, chunksize=None, compact=False, **kwargs):
+    """
+    Read a CSV file into a lazy DplyFrame.
+    The file is only read once the DplyFrame's plan is run, and only the columns the
+    plan needs are read (and those of `parse_dates`; all of them if the reading
+    options refer to columns by position). With `chunksize`, row-local stages (`select`, `filter`,
+    `mutate(axis=1)`, `drop`, `drop_na`, `fill_na(value=...)`, and `one_hot` with
+    fixed `categories`) and out-of-core sorts and joins (`arrange` and `join` with
+    a `memory_limit`) are run chunk by chunk, decomposable aggregations (e.g. a
+    `pivot_table` of means) merge partial summaries of the chunks, and a CSV,
+    Parquet or Feather `write_file` at the end of the plan is written chunk by chunk,
+    so that the whole file is never in memory.
+    With `compact`, string columns with few distinct values are read into categoricals
+    (see `compact` in pipeline.py), chunk by chunk with `chunksize`: like the types
+    pandas infers, they may then differ from one chunk to the next. Numeric columns
+    keep the types pandas infers; smaller ones can be asked for with `dtype`.
+
+    :param file_path: the path of the CSV file
+    :param chunksize: number of rows per chunk, or None to read the file at once
+    :param compact: whether to compact the types of the string columns read
+    :param kwargs: other arguments of `pandas.read_csv`
+    :return: a lazy DplyFrame
+    """
+    return DplyFrame._from_source(CsvSource(file_path, chunksize, compact, **kwargs))
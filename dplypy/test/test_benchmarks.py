@@ -0,0 +1,79 @@
+import json
+import os
+
+from benchmarks import run as benchmarks_run
+from benchmarks.cases import CASES, Case
+from benchmarks.run import compare, main, run
+
+
+def test_benchmarks():
+    cases = ["select", "join", "pipeline_lazy"]
+    results = run(
+        rows=[100], schemas=["narrow"], cardinalities=["high"], cases=cases, repeat=1
+    )
+    assert [result["case"] for result in results] == cases
+    for result in results:
+        assert result["rows"] == 100
+        assert result["dplypy"] > 0 and result["pandas"] > 0
+        assert result["overhead"] == result["dplypy"] / result["pandas"]
+
+    # A case that got slower than its baseline is flagged
+    slower = [dict(result) for result in results]
+    slower[0]["dplypy"] += 1
+    comparison = compare(slower, results)
+    assert list(comparison["slowdown"]) == [True, False, False]
+    assert (comparison["change"].iloc[1:] == 1).all()
+
+
+def test_summarise_speed():
+    # Grouped kernels sharing one factorization of the keys are not slower than
+    # pandas' groupby, with one aggregation or several
+    def overheads():
+        results = run(
+            rows=[10**6],
+            schemas=["narrow"],
+            cases=["summarise", "summarise_many"],
+            repeat=10,
+            log=lambda message: None,
+        )
+        return {(r["case"], r["cardinality"]): r["overhead"] for r in results}
+
+    measured = overheads()
+    assert len(measured) == 4
+    if max(measured.values()) >= 1:
+        # Timings are noisy on a busy machine: measure again before failing
+        again = overheads()
+        measured = {case: min(measured[case], again[case]) for case in measured}
+    for case, overhead in measured.items():
+        assert overhead < 1, (case, overhead)
+
+
+def _fail(pandas_df, context):
+    raise RuntimeError("broken verb")
+
+
+def test_benchmark_failures(monkeypatch):
+    monkeypatch.setattr(benchmarks_run, "CASES", CASES + [Case("broken", _fail, _fail)])
+    # A failing case is recorded, and makes the run fail
+    try:
+        status = main(
+            [
+                "--rows=100",
+                "--schemas=narrow",
+                "--cardinalities=low",
+                "--cases",
+                "select",
+                "broken",
+                "--repeat=1",
+                "--output=benchmark_test.json",
+            ]
+        )
+        with open("benchmark_test.json", encoding="utf-8") as file:
+            results = json.load(file)["results"]
+    finally:
+        if os.path.exists("benchmark_test.json"):
+            os.remove("benchmark_test.json")
+    assert status == 1
+    assert [result["case"] for result in results] == ["select", "broken"]
+    assert "broken verb" in results[1]["error"]
+    assert len(compare(results, results)) == 1
@@ -0,0 +1,79 @@
+import logging
+import os
+import shutil
+
+import pandas as pd
+import numpy as np
+
+from dplypy.cache import fingerprint
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import select, mutate, arrange, head, write_file
+
+
+def test_cache(caplog):
+    caplog.set_level(logging.INFO, logger="dplypy.cache")
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {"col1": rng.integers(0, 100, 1000), "col2": rng.random(1000)}
+    )
+    expected = pandas_df.query("col1 > 50").assign(col3=lambda d: d.col1 * d.col2)
+    factor = 2
+
+    def plan(cache_df):
+        return (
+            DplyFrame(cache_df).cache("cache_test", every_stage=True)
+            + select("col1 > 50")
+            + mutate(col3="col1 * col2")
+            + mutate(lambda d: d * factor)
+        )
+
+    # Nothing is reused the first time, and the same plan then reuses everything
+    pd.testing.assert_frame_equal(plan(pandas_df).collect().pandas_df, expected * 2)
+    assert "No cached result for any of 3 stages" in caplog.text
+    caplog.clear()
+    pd.testing.assert_frame_equal(
+        plan(pandas_df.copy()).collect().pandas_df, expected * 2
+    )
+    assert "Reused the result of 3 of 3 stages (select, mutate, mutate)" in caplog.text
+
+    # Plans resume from their longest cached prefix
+    caplog.clear()
+    output = (
+        DplyFrame(pandas_df).cache("cache_test")
+        + select("col1 > 50")
+        + mutate(col3="col1 * col2")
+        + arrange(by="col2")
+        + head(5)
+        + write_file("cache_test.csv")
+    )
+    assert "Reused the result of 2 of 4 stages (select, mutate)" in caplog.text
+    pd.testing.assert_frame_equal(
+        pd.read_csv("cache_test.csv", index_col=0),
+        expected.sort_values(by="col2").head(5),
+    )
+    pd.testing.assert_frame_equal(
+        output.pandas_df, expected.sort_values("col2").head(5)
+    )
+    os.remove("cache_test.csv")
+
+    # Changing the data or a variable a function uses invalidates the results
+    factor = 3
+    caplog.clear()
+    pd.testing.assert_frame_equal(plan(pandas_df).collect().pandas_df, expected * 3)
+    assert "Reused the result of 2 of 3 stages" in caplog.text
+    caplog.clear()
+    plan(pandas_df.head(10)).collect()
+    assert "No cached result" in caplog.text
+    assert fingerprint(lambda d: d * factor) != fingerprint(lambda d: d * 2)
+    assert fingerprint(pandas_df) == fingerprint(pandas_df.copy())
+    assert fingerprint(pandas_df) != fingerprint(pandas_df.rename(columns=str.upper))
+
+    # Least recently used results are evicted beyond the size limit
+    (
+        DplyFrame(pandas_df).cache("cache_test", max_bytes=0)
+        + head(3)
+        + write_file("cache_test.csv")
+    )
+    assert os.listdir("cache_test") == []
+    os.remove("cache_test.csv")
+    shutil.rmtree("cache_test")
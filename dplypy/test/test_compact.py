@@ -0,0 +1,114 @@
+import logging
+import os
+
+import pandas as pd
+import numpy as np
+import pytest
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import compact, drop, mutate, select, pivot_table
+from dplypy.readers import read_csv
+
+
+def test_compact(caplog):
+    caplog.set_level(logging.INFO, logger="dplypy.compaction")
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {
+            "col1": rng.integers(0, 200, 1000),
+            "col2": rng.integers(-1000, 1000, 1000),
+            "col3": rng.random(1000),
+            "col4": rng.integers(0, 8, 1000) / 2,
+            "col5": rng.choice(["a", "b", "c"], 1000).astype(object),
+            "col6": [f"id{i}" for i in range(1000)],
+            "col7": rng.random(1000) > 0.5,
+        }
+    )
+
+    # By default, only strings are compacted
+    compacted = (DplyFrame(pandas_df) + compact()).pandas_df
+    assert list(compacted.dtypes.astype(str)) == [
+        "int64",
+        "int64",
+        "float64",
+        "float64",
+        "category",
+        "object",
+        "bool",
+    ]
+    assert "Compacted 1 of 7 columns" in caplog.text
+
+    # Numeric columns are downcast on request, to signed types
+    compacted = (
+        DplyFrame(pandas_df)
+        + compact(columns=["col1", "col2", "col3", "col4"], dtypes={"col7": "int8"})
+    ).pandas_df
+    assert list(compacted.dtypes.astype(str)) == [
+        "int16",
+        "int16",
+        "float64",
+        "float32",
+        "category",
+        "object",
+        "int8",
+    ]
+    # The values do not change, only their types
+    pd.testing.assert_frame_equal(compacted.astype(pandas_df.dtypes), pandas_df)
+    before = pandas_df.drop(columns="col6").memory_usage(deep=True).sum()
+    assert compacted.drop(columns="col6").memory_usage(deep=True).sum() < before / 3
+    with pytest.raises(ValueError):
+        DplyFrame(pandas_df) + compact(dtypes={"col3": "float32"})
+    with pytest.raises(KeyError):
+        DplyFrame(pandas_df) + compact(columns=["col8"])
+
+    # Arithmetic after compact() gives the same results as before it
+    prices = pd.DataFrame(
+        {"price": [150, 20, 250], "qty": [4, 2, 1], "cost": [200, 5, 9]}
+    )
+    output = (
+        DplyFrame(prices)
+        + compact()
+        + mutate(total="price * qty", margin="price - cost")
+        + select("price - cost > 0")
+        + mutate(lambda c: c * 2)
+    )
+    expected = prices.assign(
+        total=prices["price"] * prices["qty"], margin=prices["price"] - prices["cost"]
+    )
+    expected = expected[expected["margin"] > 0] * 2
+    pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    # In a lazy plan, only the columns the plan needs are compacted
+    lazy = (
+        DplyFrame(pandas_df).lazy()
+        + compact(columns=["col1", "col2"], dtypes={"col7": "int8"})
+        + select("col1 > 100")
+        + drop(columns=["col7"])
+    )
+    expected = pandas_df.query("col1 > 100")
+    pd.testing.assert_frame_equal(
+        lazy.collect().pandas_df,
+        expected.drop(columns=["col7"]).astype(
+            {"col1": "int16", "col2": "int16", "col5": "category"}
+        ),
+    )
+    # Columns named but not needed by the plan are neither read nor converted
+    lazy = (
+        DplyFrame(pandas_df).lazy()
+        + compact(columns=["col2"])
+        + pivot_table(values="col3", index="col5", aggfunc="sum")
+    )
+    pivoted = pandas_df.pivot_table(values="col3", index="col5", aggfunc="sum")
+    assert list(lazy.collect().pandas_df["col3"]) == list(pivoted["col3"])
+
+    # Columns read from a CSV file can be compacted as they are read
+    pandas_df.to_csv("compact_test.csv", index=False)
+    try:
+        for chunksize in (None, 300):
+            read = read_csv("compact_test.csv", chunksize, compact=True)
+            read = (read + select("col1 > 100")).collect().pandas_df
+            assert read["col1"].dtype == np.int64
+            assert read["col5"].dtype == "category"
+            assert np.array_equal(read["col1"], expected["col1"])
+    finally:
+        os.remove("compact_test.csv")
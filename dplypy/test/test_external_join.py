@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+import numpy as np
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.readers import read_csv
+from dplypy.external import join_chunks
+from dplypy.pipeline import select, join, write_file
+
+
+def test_external_join():
+    rng = np.random.default_rng(0)
+    left = pd.DataFrame(
+        {
+            "key": rng.integers(0, 300, 3000).astype(float),
+            "name": rng.choice(["a", "b", "c"], 3000),
+            "value": rng.random(3000),
+        },
+        index=rng.permutation(3000),
+    )
+    left.loc[left.index[:30], "key"] = np.nan
+    right = pd.DataFrame(
+        {
+            "key": rng.integers(0, 400, 500),
+            "name": rng.choice(["a", "b"], 500),
+            "fare": rng.integers(0, 10, 500),
+        }
+    )
+
+    # Small budgets partition the sides on disk; rows come out in the order
+    # of DataFrame.merge
+    for memory_limit in (50000, 10**9):
+        for how in ("inner", "left", "right", "outer"):
+            for options in (
+                dict(on="key"),
+                dict(on=["key", "name"], sort=True),
+                dict(left_on="key", right_on="fare", suffixes=("_l", "_r")),
+            ):
+                output = DplyFrame(left) + join(
+                    DplyFrame(right), how=how, memory_limit=memory_limit, **options
+                )
+                expected = left.merge(right, how=how, **options)
+                pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    # Chunks are joined in the same order too, whichever side has rows
+    for how in ("inner", "left", "right", "outer"):
+        for left_rows, right_rows in ((3000, 500), (0, 500), (3000, 0)):
+            chunks = join_chunks(
+                [left.iloc[: min(left_rows, 1000)], left.iloc[1000:left_rows]],
+                [right.iloc[:right_rows]],
+                how,
+                on="key",
+                memory_limit=20000,
+            )
+            expected = left.iloc[:left_rows].merge(
+                right.iloc[:right_rows], how=how, on="key"
+            )
+            pd.testing.assert_frame_equal(
+                pd.concat(chunks), expected, check_index_type=False
+            )
+
+    # Both sides of a file join are read chunk by chunk
+    left.to_csv("external_join_left.csv", index=False)
+    right.to_csv("external_join_right.csv", index=False)
+    output = (
+        read_csv("external_join_left.csv", chunksize=500)
+        + select("value > 0.5")
+        + join(
+            read_csv("external_join_right.csv", chunksize=100),
+            how="left",
+            on="key",
+            memory_limit=20000,
+        )
+        + write_file("external_join_output.csv", index=False)
+    )
+    assert output.stages
+    expected = (
+        left.reset_index(drop=True)
+        .query("value > 0.5")
+        .merge(right, how="left", on="key")
+    )
+    read_df = pd.read_csv("external_join_output.csv")
+    pd.testing.assert_frame_equal(read_df, expected)
+
+    os.remove("external_join_left.csv")
+    os.remove("external_join_right.csv")
+    os.remove("external_join_output.csv")
@@ -0,0 +1,86 @@
+import os
+
+import pandas as pd
+import numpy as np
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.readers import read_csv
+from dplypy.external import sort_chunks, split_rows
+from dplypy.pipeline import select, arrange, head, write_file
+
+
+def test_external_sort():
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {
+            "col1": rng.integers(0, 5, 2000).astype(float),
+            "col2": rng.choice(["a", "b", "c"], 2000),
+            "col3": rng.random(2000),
+        },
+        index=rng.permutation(2000),
+    )
+    pandas_df.loc[pandas_df.index[:100], "col1"] = np.nan
+
+    # Small budgets spill many runs, which are merged in several passes
+    for memory_limit in (3000, 10**9):
+        for by, ascending in (
+            ("col1", True),
+            ("col1", False),
+            (["col2", "col1"], [True, False]),
+        ):
+            output = DplyFrame(pandas_df) + arrange(
+                by=by, ascending=ascending, memory_limit=memory_limit
+            )
+            expected = pandas_df.sort_values(by=by, ascending=ascending, kind="stable")
+            pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    # Categories sort in their order, and missing values of any type come last
+    keyed_df = pandas_df.assign(
+        col4=pd.Categorical(pandas_df["col2"], categories=["c", "a", "b"]),
+        col5=pd.array(pandas_df["col1"].to_numpy(), dtype="Int64"),
+    )
+    keyed_df.loc[keyed_df.index[50:150], "col4"] = np.nan
+    for by, ascending in ((["col4", "col5"], [False, True]), ("col5", False)):
+        output = DplyFrame(keyed_df) + arrange(
+            by=by, ascending=ascending, memory_limit=3000
+        )
+        expected = keyed_df.sort_values(by=by, ascending=ascending, kind="stable")
+        pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    chunks = list(sort_chunks(split_rows(pandas_df, 5000), "col3", memory_limit=5000))
+    assert len(chunks) > 1
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks), pandas_df.sort_values(by="col3", kind="stable")
+    )
+    empty = pandas_df.iloc[:0]
+    pd.testing.assert_frame_equal(next(sort_chunks([empty], "col1")), empty)
+
+    # Chunks of a file are sorted and written out without being all in memory
+    pandas_df.to_csv("external_sort_input.csv", index=False)
+    output = (
+        read_csv("external_sort_input.csv", chunksize=100)
+        + select("col3 > 0.5")
+        + arrange(by=["col1", "col3"], memory_limit=10000)
+        + write_file("external_sort_output.csv", index=False)
+    )
+    assert output.stages
+    expected = (
+        pandas_df.query("col3 > 0.5")
+        .sort_values(by=["col1", "col3"], kind="stable")
+        .reset_index(drop=True)
+    )
+    read_df = pd.read_csv("external_sort_output.csv")
+    pd.testing.assert_frame_equal(read_df, expected)
+
+    output = (
+        read_csv("external_sort_input.csv", chunksize=100)
+        + arrange(by="col3", ascending=False, memory_limit=10000)
+        + head(3)
+    )
+    expected = (
+        pandas_df.reset_index(drop=True).sort_values(by="col3", ascending=False).head(3)
+    )
+    pd.testing.assert_frame_equal(output.collect().pandas_df, expected)
+
+    os.remove("external_sort_input.csv")
+    os.remove("external_sort_output.csv")
@@ -1,7 +1,13 @@
 import pandas as pd
 
 from dplypy.dplyframe import DplyFrame
-from dplypy.pipeline import join
+from dplypy.pipeline import (
+    join,
+    optimize,
+    pivot_table,
+    _INNER_MERGE_KEEPS_ORDER,
+    _lookup_index,
+)
 
 
 def test_join():
@@ -161,3 +167,87 @@ def test_join():
         pass
     else:
         raise AssertionError("MergeError was not raised")
+
+
+def test_join_key_index():
+    left = pd.DataFrame(
+        {
+            "key": [3, 1, 2, 3, 5, 1],
+            "tag": ["a", "b", "a", None, "b", "a"],
+            "value": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        }
+    )
+    right = pd.DataFrame(
+        {
+            "key": [1, 2, 3, 3, 4],
+            "tag": ["b", "a", None, "a", "b"],
+            "value": [10, 20, 30, 40, 50],
+            "flag": [True, False, True, False, True],
+        }
+    )
+    df_r = DplyFrame(right.copy()).index_keys("key")
+    key_index = df_r._key_index(["key"])
+
+    for how in ("inner", "left"):
+        output = DplyFrame(left) + join(df_r, how=how, on="key")
+        pd.testing.assert_frame_equal(output.pandas_df, left.merge(right, how, "key"))
+    # The index is built once and reused
+    assert df_r._key_index(["key"]) is key_index
+    params = join(df_r, how="left", on="key").params
+    assert _lookup_index(left, df_r, params) is key_index
+    params = join(df_r, how="inner", on="key").params
+    looked_up = _lookup_index(left, df_r, params) is key_index
+    assert looked_up == _INNER_MERGE_KEEPS_ORDER
+
+    # Inner joins only look keys up where DataFrame.merge keeps the left row order
+    df_l = pd.DataFrame({"k": [3, 1, 2, 3, 9], "x": range(5)})
+    df_k = DplyFrame(pd.DataFrame({"k": [2, 3, 1, 7, 3], "y": range(5)}))
+    output = DplyFrame(df_l) + join(df_k.index_keys("k"), on="k")
+    pd.testing.assert_frame_equal(output.pandas_df, df_l.merge(df_k.pandas_df, on="k"))
+
+    # Several keys, with missing values matching each other
+    df_r.index_keys(["key", "tag"])
+    for how in ("inner", "left"):
+        output = DplyFrame(left) + join(df_r, how=how, on=["key", "tag"])
+        pd.testing.assert_frame_equal(
+            output.pandas_df, left.merge(right, how, ["key", "tag"])
+        )
+
+    # Empty sides, with one key or several
+    for keys in (["key"], ["key", "tag"]):
+        for df_left, df_right in [
+            (left, right[:0]),
+            (left[:0], right),
+            (left[:0], right[:0]),
+        ]:
+            indexed = DplyFrame(df_right.copy()).index_keys(keys)
+            for how in ("inner", "left"):
+                output = DplyFrame(df_left) + join(indexed, how=how, on=keys)
+                pd.testing.assert_frame_equal(
+                    output.pandas_df, df_left.merge(df_right, how, keys)
+                )
+
+    # Setting a column discards the index, which the next join rebuilds
+    df_r["key"] = [1, 2, 3, 5, 5]
+    right["key"] = [1, 2, 3, 5, 5]
+    assert df_r._key_indexes[("key",)] is None
+    output = DplyFrame(left) + join(df_r, how="left", on="key")
+    pd.testing.assert_frame_equal(output.pandas_df, left.merge(right, "left", "key"))
+    assert df_r._key_index(["key"]) is not key_index
+
+    # Other joins merge
+    output = DplyFrame(left) + join(df_r, how="right", on="key")
+    pd.testing.assert_frame_equal(output.pandas_df, left.merge(right, "right", "key"))
+
+    # The optimizer does not project the right-hand side away from its index
+    plan = [
+        join(df_r, how="left", on="key"),
+        pivot_table(values="value_x", index="key"),
+    ]
+    params = optimize(plan, list(left.columns))[0].params
+    assert params["right"] is df_r and "right_columns" not in params
+    output = DplyFrame(left).lazy() + plan[0] + plan[1]
+    pd.testing.assert_frame_equal(
+        output.collect().pandas_df,
+        left.merge(right, "left", "key").pivot_table(values="value_x", index="key"),
+    )
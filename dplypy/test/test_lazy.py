@@ -0,0 +1,119 @@
+import os
+
+import pandas as pd
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import (
+    head,
+    select,
+    drop,
+    mutate,
+    count_null,
+    write_file,
+    side_effect,
+)
+
+
+def test_lazy():
+    pandas_df = pd.DataFrame(
+        data={
+            "col1": [0, 1, 2, 3],
+            "col2": [3, 4, None, 6],
+            "col3": [6, 7, 8, 9],
+        }
+    )
+    df = DplyFrame(pandas_df)
+    lazy_df = df.lazy()
+    assert lazy_df.is_lazy
+    assert not df.is_lazy
+    assert df.collect() is df
+
+    # Nothing runs until the plan is forced
+    calls = []
+    output1 = (
+        lazy_df
+        + select("col1 > 0")
+        + side_effect(lambda d: calls.append(len(d.pandas_df)))
+        + drop(columns="col3")
+    )
+    assert output1.is_lazy
+    assert calls == []
+    assert [stage.verb for stage in output1.stages] == [
+        "select",
+        "side_effect",
+        "drop",
+    ]
+
+    expected1 = pandas_df.query("col1 > 0").drop(columns="col3")
+    collected1 = output1.collect()
+    assert not collected1.is_lazy
+    assert calls == [3]
+    pd.testing.assert_frame_equal(collected1.pandas_df, expected1)
+
+    # Branches share the source but not the plan
+    output2 = lazy_df + head(2)
+    output3 = output2 + mutate(lambda c: c * 2)
+    pd.testing.assert_frame_equal(output2.pandas_df, pandas_df.head(2))
+    pd.testing.assert_frame_equal(output3.pandas_df, pandas_df.head(2) * 2)
+    pd.testing.assert_frame_equal(lazy_df.pandas_df, pandas_df)
+
+    # Plain functions can be part of the plan
+    output4 = lazy_df + (lambda d1: DplyFrame(d1.pandas_df + 1))
+    pd.testing.assert_frame_equal(output4.collect().pandas_df, pandas_df + 1)
+
+    # Sinks force the plan
+    assert lazy_df + select("col1 < 2") + count_null() == 0
+    assert lazy_df + count_null("col2") == 1
+
+    output5 = lazy_df + select("col1 > 1") + write_file("lazy.csv", index=False)
+    assert output5.is_lazy
+    assert output5.stages == []
+    read_df = pd.read_csv("lazy.csv")
+    os.remove("lazy.csv")
+    pd.testing.assert_frame_equal(
+        read_df, pandas_df.query("col1 > 1").reset_index(drop=True)
+    )
+
+    # A prefix shared by several branches runs once, and is released after them
+    calls = []
+    base = (
+        lazy_df
+        + side_effect(lambda d: calls.append(len(d.pandas_df)))
+        + select("col1 > 0")
+    )
+    branch1 = base + head(1)
+    branch2 = base + drop(columns="col3") + mutate(lambda c: c * 2)
+    branch3 = base + select("col1 > 2")
+    pd.testing.assert_frame_equal(
+        branch1.pandas_df, pandas_df.query("col1 > 0").head(1)
+    )
+    assert branch2 + count_null() == 1
+    assert base._shared is not None
+    pd.testing.assert_frame_equal(
+        branch3.collect().pandas_df, pandas_df.query("col1 > 2")
+    )
+    assert calls == [4]
+    assert base._shared is None
+    pd.testing.assert_frame_equal(
+        branch2.collect().pandas_df,
+        pandas_df.query("col1 > 0").drop(columns="col3") * 2,
+    )
+    assert calls == [4, 4]
+
+    # Changing a branch's result does not change the shared prefix of the others
+    base = lazy_df + select("col1 > 0")
+    branch1 = base + side_effect(lambda d: None)
+    branch2 = base + head(2)
+    branch3 = base + drop(columns="col3")
+    output6 = branch1.collect()
+    output6["z"] = 99
+    output6.pandas_df.iloc[0, 0] = -5
+    output7 = branch2.collect()
+    pd.testing.assert_frame_equal(
+        output7.pandas_df, pandas_df.query("col1 > 0").head(2)
+    )
+    output7.pandas_df.iloc[0, 0] = -5
+    pd.testing.assert_frame_equal(
+        branch3.collect().pandas_df,
+        pandas_df.query("col1 > 0").drop(columns="col3"),
+    )
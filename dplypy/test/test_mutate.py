@@ -41,3 +41,28 @@ def test_mutate():
         pass
     else:
         raise AssertionError("TypeError was not raised")
+
+    # Columns computed from expressions, which can use the ones created before them
+    pandas_df3 = pd.DataFrame(
+        {"price": [10.0, 20.0, 5.0], "cost": [4.0, 15.0, 5.0], "qty": [1, 3, 2]}
+    )
+    output5 = DplyFrame(pandas_df3) + mutate(
+        total="price * qty",
+        margin="(price - cost) / price",
+        profit=lambda d: d["total"] * d["margin"],
+        price="price + 1",
+    )
+    expected5 = pandas_df3.assign(
+        total=pandas_df3["price"] * pandas_df3["qty"],
+        margin=(pandas_df3["price"] - pandas_df3["cost"]) / pandas_df3["price"],
+    )
+    expected5["profit"] = expected5["total"] * expected5["margin"]
+    expected5["price"] = expected5["price"] + 1
+    pd.testing.assert_frame_equal(output5.pandas_df, expected5)
+
+    try:
+        df1 + mutate(np.sum, total="price * qty")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError was not raised")
@@ -1,8 +1,11 @@
+import os
+
 import pandas as pd
 import numpy as np
 
 from dplypy.dplyframe import DplyFrame
-from dplypy.pipeline import one_hot
+from dplypy.pipeline import OneHotEncoder, one_hot
+from dplypy.readers import read_csv
 
 
 def test_one_hot():
@@ -117,3 +120,60 @@ def test_one_hot():
         pass
     else:
         raise AssertionError("TypeError was not raised")
+
+
+def test_one_hot_encoder():
+    pandas_df = pd.DataFrame(
+        {
+            "col1": ["B", "A", "C", "D", "A", "E"],
+            "col2": [3, 1, 2, 1, np.nan, 3],
+            "col3": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        }
+    )
+    pandas_df.to_csv("encoder_test.csv", index=False)
+    try:
+        # Fitted chunk by chunk, reading only the encoded columns
+        encoder = OneHotEncoder(["col1", "col2"])
+        encoder.fit(read_csv("encoder_test.csv", chunksize=2))
+        assert encoder.categories == {
+            "col1": ["A", "B", "C", "D", "E"],
+            "col2": [1.0, 2.0, 3.0],
+        }
+        expected = pd.get_dummies(pandas_df, columns=["col1", "col2"], dtype=np.uint8)
+
+        # Every chunk gets the same columns, in the same order
+        chunked = read_csv("encoder_test.csv", chunksize=2) + encoder.one_hot()
+        pd.testing.assert_frame_equal(chunked.collect().pandas_df, expected)
+        first = (DplyFrame(pandas_df.head(1)) + encoder.one_hot()).pandas_df
+        assert list(first.columns) == list(expected.columns)
+        assert first.iloc[0].tolist() == expected.iloc[0].tolist()
+
+        # Saved and loaded back, e.g. by a serving pipeline
+        encoder.save("encoder_test.json")
+        loaded = OneHotEncoder.load("encoder_test.json")
+        assert loaded.columns == encoder.columns
+        assert loaded.categories == encoder.categories
+    finally:
+        os.remove("encoder_test.csv")
+        if os.path.exists("encoder_test.json"):
+            os.remove("encoder_test.json")
+
+    # Unseen values are encoded as missing
+    unseen = pd.DataFrame({"col1": ["F"], "col2": [2.0], "col3": [7.0]})
+    output = (DplyFrame(unseen) + loaded.one_hot()).pandas_df
+    assert output.filter(like="col1_").sum(axis=1).tolist() == [0]
+    assert output["col2_2.0"].tolist() == [1]
+
+    sparse = (DplyFrame(pandas_df) + encoder.one_hot(sparse=True)).pandas_df
+    assert isinstance(sparse["col1_A"].dtype, pd.SparseDtype)
+    dense = sparse.apply(
+        lambda column: column.sparse.to_dense() if column.name != "col3" else column
+    )
+    pd.testing.assert_frame_equal(dense, expected)
+
+    try:
+        OneHotEncoder("col1").one_hot()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError was not raised")
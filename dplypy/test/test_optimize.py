@@ -0,0 +1,232 @@
+import pandas as pd
+import numpy as np
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import (
+    optimize,
+    select,
+    filter,
+    join,
+    one_hot,
+    fill_na,
+    drop,
+    gather,
+    mutate,
+    pivot_table,
+    arrange,
+    count_null,
+    side_effect,
+    head,
+    tail,
+    slice_row,
+    _right_frame,
+)
+
+
+def run_both(pandas_df, *stages):
+    eager = DplyFrame(pandas_df)
+    lazy = DplyFrame(pandas_df).lazy()
+    for stage in stages:
+        eager = eager + stage
+        lazy = lazy + stage
+    if isinstance(eager, DplyFrame):
+        pd.testing.assert_frame_equal(eager.pandas_df, lazy.collect().pandas_df)
+    else:
+        assert eager == lazy
+    return optimize(stages, list(pandas_df.columns))
+
+
+def test_predicate_pushdown():
+    pandas_df = pd.DataFrame(
+        {
+            "key": [1, 2, 1, 3, np.nan, 2],
+            "age": [20, 30, 40, 50, 60, 70],
+            "sex": ["f", "m", "f", "m", "f", "m"],
+        }
+    )
+    right = DplyFrame(pd.DataFrame({"key": [1, 1, 2, np.nan], "fare": [5, 6, 7, 8]}))
+
+    # Adjacent selects are combined, then pushed into the left side of the join
+    plan = run_both(
+        pandas_df,
+        join(right, on="key", how="left"),
+        select("age > 25"),
+        select("key > 1"),
+    )
+    assert [stage.verb for stage in plan] == ["join"]
+    assert plan[0].params["query_str"] == "(age > 25) and (key > 1)"
+
+    # Rows removed by the predicate were the only unmatched ones (int -> float)
+    run_both(pandas_df, join(right, on="key", how="left"), select("age < 40"))
+    run_both(pandas_df, join(right, on="key", how="left"), select("age > 100"))
+
+    # Predicates on the right side of a right join
+    plan = run_both(pandas_df, join(right, on="key", how="right"), select("fare > 5"))
+    assert [stage.verb for stage in plan] == ["join"]
+    plan = run_both(pandas_df, join(right, how="cross"), select("age > 25"))
+    assert [stage.verb for stage in plan] == ["join"]
+
+    # Predicates that have to stay after the join
+    plan = run_both(pandas_df, join(right, on="key", how="left"), select("fare > 5"))
+    assert [stage.verb for stage in plan] == ["join", "select"]
+    plan = run_both(pandas_df, join(right, on="key", how="inner"), select("age > 25"))
+    assert [stage.verb for stage in plan] == ["join", "select"]
+    plan = run_both(pandas_df, join(right, on="key", how="outer"), select("age > 25"))
+    assert [stage.verb for stage in plan] == ["join", "select"]
+
+    # Row-preserving verbs
+    plan = run_both(
+        pandas_df,
+        one_hot(columns=["sex"]),
+        fill_na(value={"key": 0}),
+        drop(columns="key"),
+        select("age > 25"),
+    )
+    assert [stage.verb for stage in plan] == ["one_hot", "fill_na", "drop"]
+    assert plan[0].params["query_str"] == "age > 25"
+    # The indicator columns do not depend on the rows that were filtered out
+    plan = run_both(pandas_df, one_hot(columns=["sex"]), select("age < 25"))
+    assert [stage.verb for stage in plan] == ["one_hot"]
+    # Missing values upcast the categories of numeric columns in the indicator names
+    plan = run_both(
+        pandas_df, one_hot(columns=["key"], dummy_na=True), select("age > 25")
+    )
+    assert [stage.verb for stage in plan] == ["one_hot"]
+    run_both(
+        pandas_df.astype({"key": "Int64"}),
+        one_hot(columns=["key", "sex"], dummy_na=True),
+        select("age > 25"),
+    )
+    run_both(pandas_df, one_hot(columns=["sex"], dummy_na=True), select("age > 25"))
+    plan = run_both(pandas_df, one_hot(columns=["sex"]), select("sex_f == 1"))
+    assert [stage.verb for stage in plan] == ["one_hot", "select"]
+    plan = run_both(pandas_df, fill_na(value={"key": 0}), select("key > 1"))
+    assert [stage.verb for stage in plan] == ["fill_na", "select"]
+    plan = run_both(pandas_df, mutate(lambda c: c), select("age > 25"))
+    assert [stage.verb for stage in plan] == ["mutate", "select"]
+    plan = run_both(pandas_df, mutate(old="age + 1"), select("age > 25"))
+    assert [stage.verb for stage in plan] == ["select", "mutate"]
+    plan = run_both(pandas_df, mutate(old="age + 1"), select("old > 25"))
+    assert [stage.verb for stage in plan] == ["mutate", "select"]
+
+    # Expression-based filters
+    mask = pandas_df["sex"] == "f"
+    plan = run_both(pandas_df, fill_na(value=0), drop(columns="key"), filter(mask))
+    assert [stage.verb for stage in plan] == ["filter", "fill_na", "drop"]
+    plan = run_both(pandas_df, mutate(old="age + 1"), filter(mask))
+    assert [stage.verb for stage in plan] == ["filter", "mutate"]
+    plan = run_both(pandas_df, one_hot(columns=["sex"]), filter(mask))
+    assert [stage.verb for stage in plan] == ["one_hot", "filter"]
+
+    # gather renumbers its rows unless ignore_index is False
+    plan = run_both(
+        pandas_df, gather(id_vars=["sex"], value_vars=["age"]), select("sex == 'f'")
+    )
+    assert [stage.verb for stage in plan] == ["project", "gather"]
+    plan = run_both(
+        pandas_df,
+        gather(id_vars=["sex"], value_vars=["age", "key"], ignore_index=False),
+        select("sex == 'f'"),
+    )
+    assert [stage.verb for stage in plan] == ["select", "gather"]
+    plan = run_both(pandas_df, gather(id_vars=["sex"]), select("value > 25"))
+    assert [stage.verb for stage in plan] == ["gather", "select"]
+
+
+def test_projection_pushdown():
+    pandas_df = pd.DataFrame(
+        {
+            "key": [1, 2, 1, 3],
+            "who": ["man", "woman", "child", "man"],
+            "age": [20, 30, 40, 50],
+            "unused": [0.1, 0.2, 0.3, 0.4],
+            "fare": [1.0, 2.0, 3.0, 4.0],
+        }
+    )
+    right = DplyFrame(
+        pd.DataFrame(
+            {
+                "key": [1, 2, 3],
+                "fare": [5.0, 6.0, 7.0],
+                "deck": ["A", "B", "C"],
+                "wide": [0, 0, 0],
+            }
+        )
+    )
+
+    # Columns found on both sides keep their suffixes
+    plan = run_both(
+        pandas_df,
+        join(right, on="key"),
+        pivot_table(values=["fare_y"], index=["who"]),
+    )
+    assert [stage.verb for stage in plan] == ["project", "join", "pivot_table"]
+    assert plan[0].params["columns"] == ["key", "who", "fare"]
+    assert list(_right_frame(plan[1].params).pandas_df.columns) == ["key", "fare"]
+
+    # Columns used by a select, or dropped later on, are kept until then
+    plan = run_both(
+        pandas_df,
+        select("age > 25"),
+        drop(columns="unused"),
+        gather(id_vars=["who"], value_vars=["fare"]),
+    )
+    assert [stage.verb for stage in plan] == ["project", "select", "drop", "gather"]
+    assert plan[0].params["columns"] == ["who", "age", "unused", "fare"]
+
+    # Expressions read only the columns they name
+    plan = run_both(
+        pandas_df,
+        mutate(double="fare * 2", total="double + age"),
+        select("total > 50"),
+        pivot_table(values=["total"], index=["who"]),
+    )
+    assert [stage.verb for stage in plan] == [
+        "project",
+        "mutate",
+        "select",
+        "pivot_table",
+    ]
+    assert plan[0].params["columns"] == ["who", "age", "fare"]
+
+    plan = run_both(pandas_df, arrange(by="age"), count_null("who"))
+    assert [stage.verb for stage in plan] == ["project", "arrange", "count_null"]
+
+    # Every column ends up in the result or is seen by a side effect
+    plan = run_both(pandas_df, join(right, on="key"), select("age > 25"))
+    assert [stage.verb for stage in plan] == ["join", "select"]
+    plan = run_both(
+        pandas_df,
+        side_effect(lambda d: None),
+        gather(id_vars=["who"], value_vars=["fare"]),
+    )
+    assert [stage.verb for stage in plan] == ["side_effect", "gather"]
+
+
+def test_top_k():
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {
+            "col1": rng.integers(0, 5, 200).astype(float),
+            "col2": rng.integers(0, 3, 200),
+        },
+        index=rng.permutation(200),
+    )
+    pandas_df.loc[pandas_df.index[:20], "col1"] = np.nan
+
+    for ascending in (True, False):
+        plan = run_both(pandas_df, arrange(by="col1", ascending=ascending), head(10))
+        assert [stage.verb for stage in plan] == ["arrange"]
+        run_both(pandas_df, arrange(by="col1", ascending=ascending), tail(10))
+        run_both(pandas_df, arrange(by="col1", ascending=ascending), tail(30))
+        run_both(pandas_df, arrange(by="col1", ascending=ascending), slice_row(5, 15))
+        run_both(
+            pandas_df,
+            arrange(by=["col2", "col1"], ascending=[ascending, not ascending]),
+            head(10),
+        )
+
+    # Ties are broken by the original row order, like a stable sort
+    output = DplyFrame(pandas_df) + arrange(by="col2")
+    expected = pandas_df.sort_values(by="col2", kind="stable")
+    pd.testing.assert_frame_equal(output.pandas_df, expected)
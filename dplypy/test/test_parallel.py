@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+import numpy as np
+import pytest
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.readers import read_csv
+from dplypy.pipeline import select, filter, mutate, drop, fill_na, arrange, head
+
+
+def test_parallel():
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {
+            "col1": rng.integers(0, 10, 1000).astype(float),
+            "col2": rng.random(1000),
+            "col3": rng.choice(["a", "b"], 1000),
+        },
+        index=rng.permutation(1000),
+    )
+    pandas_df.loc[pandas_df.index[:50], "col1"] = np.nan
+
+    expected = (
+        DplyFrame(pandas_df)
+        + fill_na(value={"col1": -1})
+        + select("col2 > 0.3")
+        + filter(pandas_df["col3"] == "a")
+        + drop(columns="col3")
+        + mutate(lambda row: row * 2, axis=1)
+        + arrange(by="col2")
+        + head(100)
+    )
+    for backend in ("process", "thread"):
+        output = (
+            DplyFrame(pandas_df).parallel(4, backend)
+            + fill_na(value={"col1": -1})
+            + select("col2 > 0.3")
+            + filter(pandas_df["col3"] == "a")
+            + drop(columns="col3")
+            + mutate(lambda row: row * 2, axis=1)
+            + arrange(by="col2")
+            + head(100)
+        )
+        assert len(output.stages) == 7
+        pd.testing.assert_frame_equal(output.pandas_df, expected.pandas_df)
+
+    # More workers than rows, and no rows left
+    output = DplyFrame(pandas_df.head(3)).parallel(8) + select("col2 > 0.5")
+    pd.testing.assert_frame_equal(
+        output.pandas_df, pandas_df.head(3).query("col2 > 0.5")
+    )
+    output = DplyFrame(pandas_df).parallel(2) + select("col2 > 2")
+    pd.testing.assert_frame_equal(output.pandas_df, pandas_df.query("col2 > 2"))
+
+    # The chunks of a file are handed to the workers in turn
+    pandas_df.to_csv("parallel_input.csv", index=False)
+    output = (
+        read_csv("parallel_input.csv", chunksize=100).parallel(3)
+        + select("col2 > 0.3")
+        + drop(columns="col3")
+    )
+    expected = pandas_df.reset_index(drop=True).query("col2 > 0.3").drop(columns="col3")
+    pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    with pytest.raises(ValueError):
+        DplyFrame(pandas_df).parallel(backend="gpu")
+
+    os.remove("parallel_input.csv")
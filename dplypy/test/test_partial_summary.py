@@ -0,0 +1,104 @@
+import os
+import warnings
+
+import pandas as pd
+import numpy as np
+import pytest
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.execution import UndecomposableWarning
+from dplypy.readers import read_csv
+from dplypy.aggregate import (
+    final_summary,
+    merge_summaries,
+    partial_summary,
+    summarise_frame,
+)
+from dplypy.pipeline import select, pivot_table, group_by, summarise
+
+
+def test_partial_summary():
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {
+            "who": rng.choice(["man", "woman", "child"], 3000),
+            "deck": rng.integers(0, 5, 3000),
+            "fare": np.where(rng.random(3000) < 0.1, np.nan, rng.random(3000)),
+            "age": rng.integers(0, 80, 3000),
+        }
+    )
+
+    # Merging the partial summaries of chunks gives the summary of all the rows
+    aggregations = {
+        "n": "size",
+        "mean_fare": ("fare", "mean"),
+        "var_fare": ("fare", "var"),
+        "std_age": ("age", "std"),
+        "oldest": ("age", "max"),
+        "first_fare": ("fare", "first"),
+    }
+    partials = [
+        partial_summary(pandas_df.iloc[start : start + 100], ["who"], aggregations)
+        for start in range(0, 3000, 100)
+    ]
+    summary = merge_summaries(partials, ["who"], aggregations)
+    pd.testing.assert_frame_equal(
+        final_summary(summary, aggregations),
+        summarise_frame(pandas_df, ["who"], aggregations),
+    )
+
+    # Chunks of a file, or partitions of the rows, are summarised separately
+    pandas_df.to_csv("partial_summary_input.csv", index=False)
+    for aggfunc in ("mean", "std", "count"):
+        expected = pandas_df.query("age > 20").pivot_table(
+            values=["fare", "age"], index="who", columns="deck", aggfunc=aggfunc
+        )
+        for frame in (
+            read_csv("partial_summary_input.csv", chunksize=200),
+            DplyFrame(pandas_df).parallel(3),
+        ):
+            output = (
+                frame
+                + select("age > 20")
+                + pivot_table(
+                    values=["fare", "age"], index="who", columns="deck", aggfunc=aggfunc
+                )
+            )
+            pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    output = (
+        read_csv("partial_summary_input.csv", chunksize=200).parallel(2)
+        + group_by(["who", "deck"])
+        + summarise(n="size", mean_age=("age", "mean"))
+    )
+    expected = summarise_frame(
+        pandas_df, ["who", "deck"], {"n": "size", "mean_age": ("age", "mean")}
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", UndecomposableWarning)
+        pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    # Functions cannot be decomposed: all the rows are pivoted at once, with a warning
+    output = read_csv("partial_summary_input.csv", chunksize=200) + pivot_table(
+        values="fare", index="who", aggfunc=np.median
+    )
+    expected = pandas_df.pivot_table(values="fare", index="who", aggfunc=np.median)
+    with pytest.warns(UndecomposableWarning, match="pivot_table with aggfunc median"):
+        pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    aggregations = {"n": "size", "median_age": ("age", "median")}
+    expected = summarise_frame(pandas_df, ["who"], aggregations)
+    for output in [
+        read_csv("partial_summary_input.csv", chunksize=200),
+        DplyFrame(pandas_df).parallel(2, backend="thread"),
+        read_csv("partial_summary_input.csv", chunksize=200).parallel(2),
+    ]:
+        output = output + group_by("who") + summarise(**aggregations)
+        with pytest.warns(UndecomposableWarning) as record:
+            pd.testing.assert_frame_equal(output.pandas_df, expected)
+        assert [str(warning.message) for warning in record] == [
+            "summarise with aggfunc 'median' cannot be computed from partial "
+            "summaries of chunks or partitions of rows: it runs on all the rows at once"
+        ]
+
+    os.remove("partial_summary_input.csv")
@@ -0,0 +1,86 @@
+import pandas as pd
+import numpy as np
+import pytest
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import (
+    Pipeline,
+    select,
+    drop,
+    mutate,
+    count_null,
+    head,
+    join,
+    pivot_table,
+)
+
+
+def test_pipeline():
+    pandas_df = pd.DataFrame(
+        {"col1": np.arange(10), "col2": np.arange(10) * 0.5, "col3": list("abcdefghij")}
+    )
+    cleaning = select("col1 > 2") + drop(columns="col2")
+    pipeline = cleaning + mutate(col4="col1 * 2") + (lambda d1: d1 + head(3))
+    assert isinstance(pipeline, Pipeline)
+    assert len(pipeline.stages) == 4
+    assert len(cleaning.stages) == 2
+    assert repr(cleaning) == (
+        "select(query_str='col1 > 2') + "
+        "drop(labels=None, axis=0, index=None, columns='col2')"
+    )
+
+    # Applying the pipeline is the same as adding its stages one by one
+    expected = (
+        DplyFrame(pandas_df)
+        + select("col1 > 2")
+        + drop(columns="col2")
+        + mutate(col4="col1 * 2")
+        + head(3)
+    ).pandas_df
+    pd.testing.assert_frame_equal((DplyFrame(pandas_df) + pipeline).pandas_df, expected)
+    lazy = DplyFrame(pandas_df).lazy() + pipeline
+    assert len(lazy.stages) == 4
+    pd.testing.assert_frame_equal(lazy.collect().pandas_df, expected)
+
+    # Compiled once for all the data with the same columns
+    compiled = pipeline.compile(pandas_df.columns)
+    assert pipeline.compile(pandas_df.head(5).columns) is compiled
+    assert pipeline.compile(["col1", "col2", "col3", "col5"]) is not compiled
+
+    # Invalid pipelines are rejected before running
+    with pytest.raises(KeyError):
+        (cleaning + select("col5 > 1")).validate(pandas_df.columns)
+    with pytest.raises(KeyError):
+        DplyFrame(pandas_df) + (cleaning + mutate(col4="col2 * 2"))
+    with pytest.raises(ValueError):
+        (count_null() + cleaning).validate()
+    assert (DplyFrame(pandas_df) + (cleaning + count_null())) == 0
+
+    # Applied to many inputs in a pool of workers
+    inputs = [pandas_df, DplyFrame(pandas_df.iloc[::-1]), DplyFrame(pandas_df).lazy()]
+    for backend in ("thread", "process"):
+        results = pipeline.map(inputs, workers=2, backend=backend)
+        assert [type(result) for result in results] == [DplyFrame] * 3
+        pd.testing.assert_frame_equal(results[0].pandas_df, expected)
+        pd.testing.assert_frame_equal(
+            results[1].pandas_df, (DplyFrame(pandas_df.iloc[::-1]) + pipeline).pandas_df
+        )
+        pd.testing.assert_frame_equal(results[2].pandas_df, expected)
+    assert (cleaning + count_null()).map(inputs, backend="thread") == [0, 0, 0]
+
+
+def test_compiled_join():
+    left = DplyFrame(pd.DataFrame({"key": [1, 2], "x": [1.0, 2.0]}))
+    right = DplyFrame(pd.DataFrame({"key": [1, 2], "y": [10, 20], "z": [0, 0]}))
+    # The join's right-hand side is projected on `y`, which the pivot table needs
+    pipeline = join(right, on="key") + pivot_table(values="y", index="key")
+    output = left + pipeline
+    assert list(output.pandas_df["y"]) == [10, 20]
+
+    # A compiled pipeline joins the data the right-hand side holds when it runs
+    right["y"] = [100, 200]
+    output = left + pipeline
+    assert list(output.pandas_df["y"]) == [100, 200]
+    right.pandas_df = pd.DataFrame({"key": [1, 2], "y": [7, 8], "z": [0, 0]})
+    output = left + pipeline
+    assert list(output.pandas_df["y"]) == [7, 8]
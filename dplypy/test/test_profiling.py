@@ -0,0 +1,78 @@
+import pandas as pd
+import numpy as np
+import pytest
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import select, mutate, head, count_null
+from dplypy import profiling
+from dplypy.profiling import MemoryBudgetWarning, profile
+
+
+def test_profiling():
+    pandas_df = pd.DataFrame({"col1": np.arange(1000), "col2": np.arange(1000) * 0.5})
+
+    with profile() as stats:
+        output = (
+            DplyFrame(pandas_df)
+            + select("col1 >= 100")
+            + mutate(col3="col1 * col2")
+            + (lambda d1: d1 + head(10))
+        )
+        nulls = DplyFrame(pandas_df).lazy() + select("col1 < 10") + count_null()
+    assert len(output.pandas_df) == 10
+    assert nulls == 0
+
+    frame = stats.to_frame()
+    assert list(frame["stage"]) == [
+        "select(query_str='col1 >= 100')",
+        "mutate(func=None, axis=0, exprs={'col3': 'col1 * col2'})",
+        "test_profiling.<locals>.<lambda>",
+        "head(n=10)",
+        "select(query_str='col1 < 10')",
+        "count_null(column=None, index=None)",
+    ]
+    assert list(frame["rows_in"]) == [1000, 900, 900, 900, 1000, 10]
+    assert list(frame["rows_out"].iloc[:5]) == [900, 900, 10, 10, 10]
+    assert pd.isna(frame["rows_out"].iloc[5])
+    assert list(frame["columns_out"].iloc[:4]) == [2, 3, 3, 3]
+    assert (frame["calls"] == 1).all()
+    assert (frame["wall_time"] >= 0).all() and (frame["cpu_time"] >= 0).all()
+    assert frame["memory_in"].iloc[0] == pandas_df.memory_usage(index=True).sum()
+    assert (frame["peak_memory"] >= 0).all()
+    # The function's times include those of the stage it runs
+    assert frame["wall_time"].iloc[2] >= frame["wall_time"].iloc[3]
+    assert "6 calls of 6 stages" in stats.report()
+
+    # Nothing is recorded outside of the `with` block, nor when memory is not traced
+    DplyFrame(pandas_df) + head(1)
+    assert len(stats.records) == 6
+    with profile(trace_memory=False) as stats:
+        DplyFrame(pandas_df) + head(1)
+    assert pd.isna(stats.to_frame()["peak_memory"]).all()
+
+    # Without tracemalloc.reset_peak (Python 3.8), the memory held is measured
+    reset_peak = profiling._RESET_PEAK
+    profiling._RESET_PEAK = False
+    try:
+        with profile() as stats:
+            DplyFrame(pandas_df) + mutate(col3="col1 * col2")
+    finally:
+        profiling._RESET_PEAK = reset_peak
+    assert stats.to_frame()["peak_memory"].iloc[0] >= 1000 * 8
+
+
+def test_memory_instrumentation():
+    pandas_df = pd.DataFrame(
+        {"col1": np.arange(10000), "col2": pd.Categorical(["a", "b"] * 5000)}
+    )
+
+    with pytest.warns(MemoryBudgetWarning, match="col1 \\* 2"):
+        with profile(memory_budget=50000) as stats:
+            DplyFrame(pandas_df) + head(5000) + mutate(col3="col1 * 2")
+    frame = stats.to_frame()
+    # `head` returns views of the columns, `mutate` computes a new column
+    assert frame["new_bytes"].iloc[0] == 0
+    # The integers, and the codes of the categorical
+    assert frame["shared_bytes"].iloc[0] == 5000 * 8 + 5000
+    assert frame["new_bytes"].iloc[1] >= 5000 * 8
+    assert (frame["peak_rss"] > 0).all()
@@ -0,0 +1,67 @@
+import os
+import shutil
+
+import pandas as pd
+import numpy as np
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.readers import read_columns
+from dplypy.pipeline import select, drop, pivot_table, write_file
+
+
+def _is_mapped(array):
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_read_columns():
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {
+            "col1": rng.integers(0, 100, 1000),
+            "col2": rng.choice(["a", "b", "c"], 1000),
+            "col3": np.where(rng.random(1000) < 0.1, np.nan, rng.random(1000)),
+            "col4": pd.Categorical(rng.choice(["x", "y"], 1000)),
+        },
+        index=pd.Index(np.arange(1000) * 2, name="key"),
+    )
+    DplyFrame(pandas_df) + write_file("read_columns_input.columns")
+    assert os.path.isdir("read_columns_input.columns")
+
+    # Columns of numpy types are memory-mapped rather than read
+    df = read_columns("read_columns_input.columns")
+    assert df.is_lazy
+    pd.testing.assert_frame_equal(df.pandas_df, pandas_df)
+    assert _is_mapped(df.pandas_df["col1"].to_numpy())
+    assert _is_mapped(df.pandas_df["col3"].to_numpy())
+
+    # Only the columns the plan needs are mapped, and they can be modified in memory
+    output1 = read_columns("read_columns_input.columns") + drop(columns=["col2"])
+    output1 = output1.collect()
+    pd.testing.assert_frame_equal(output1.pandas_df, pandas_df.drop(columns=["col2"]))
+    output1.pandas_df.loc[0, "col1"] = -1
+    pd.testing.assert_frame_equal(
+        read_columns("read_columns_input.columns").pandas_df, pandas_df
+    )
+
+    # Chunk by chunk
+    expected2 = pandas_df.query("col1 > 50").pivot_table(
+        values="col3", index="col2", aggfunc="mean"
+    )
+    output2 = (
+        read_columns("read_columns_input.columns", chunksize=100)
+        + select("col1 > 50")
+        + pivot_table(values="col3", index="col2", aggfunc="mean")
+    )
+    pd.testing.assert_frame_equal(output2.pandas_df, expected2)
+
+    # Without the index
+    DplyFrame(pandas_df) + write_file("read_columns_input.columns", index=False)
+    pd.testing.assert_frame_equal(
+        read_columns("read_columns_input.columns", chunksize=300).pandas_df,
+        pandas_df.reset_index(drop=True),
+    )
+    shutil.rmtree("read_columns_input.columns")
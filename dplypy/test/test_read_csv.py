@@ -0,0 +1,123 @@
+import os
+
+import pandas as pd
+import numpy as np
+
+from dplypy.dplyframe import DplyFrame
+from dplypy.readers import read_csv
+from dplypy.pipeline import (
+    select,
+    filter,
+    mutate,
+    drop,
+    fill_na,
+    one_hot,
+    arrange,
+    head,
+    count_null,
+    write_file,
+    pivot_table,
+)
+
+
+def test_read_csv():
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {
+            "col1": rng.integers(0, 100, 1000),
+            "col2": rng.choice(["a", "b", "c"], 1000),
+            "col3": np.where(rng.random(1000) < 0.1, np.nan, rng.random(1000)),
+            "col4": rng.random(1000),
+        }
+    )
+    pandas_df.to_csv("read_csv_input.csv", index=False)
+
+    # Reading at once
+    df = read_csv("read_csv_input.csv")
+    assert df.is_lazy
+    pd.testing.assert_frame_equal(df.pandas_df, pandas_df)
+
+    expected1 = (
+        pandas_df.query("col1 > 50")
+        .sort_values(by="col4", kind="stable")
+        .head(5)
+        .drop(columns=["col2", "col3"])
+    )
+    output1 = (
+        read_csv("read_csv_input.csv", chunksize=100)
+        + select("col1 > 50")
+        + arrange(by="col4")
+        + head(5)
+        + drop(columns=["col2", "col3"])
+    )
+    pd.testing.assert_frame_equal(output1.collect().pandas_df, expected1)
+
+    # Row-local stages are streamed into the output file chunk by chunk
+    output2 = (
+        read_csv("read_csv_input.csv", chunksize=100)
+        + select("col1 > 50")
+        + filter(pandas_df["col4"] > 0.5)
+        + mutate(lambda row: row, axis=1)
+        + fill_na(value=0)
+        + one_hot(columns=["col2"], categories={"col2": ["a", "b", "c", "d"]})
+        + drop(columns="col1")
+        + write_file("read_csv_output.csv")
+    )
+    assert output2.stages
+    expected2 = pd.get_dummies(
+        pandas_df[pandas_df["col4"] > 0.5]
+        .query("col1 > 50")
+        .fillna(0)
+        .astype({"col2": pd.CategoricalDtype(["a", "b", "c", "d"])}),
+        columns=["col2"],
+    ).drop(columns="col1")
+    read_df = pd.read_csv("read_csv_output.csv", index_col=0)
+    pd.testing.assert_frame_equal(read_df, expected2, check_dtype=False)
+
+    output3 = read_csv("read_csv_input.csv", chunksize=100) + count_null()
+    assert output3 == pandas_df.isna().sum().sum()
+
+    os.remove("read_csv_input.csv")
+    os.remove("read_csv_output.csv")
+
+
+def test_read_csv_options():
+    pandas_df = pd.DataFrame(
+        {
+            "x": [1, 2, 3, 4],
+            "y": ["a", "b", "a", "b"],
+            "d": ["2020-01-01", "2020-01-02", "2020-01-03", "2020-01-04"],
+            "z": ["yes", "no", "-", "yes"],
+        }
+    )
+    pandas_df.to_csv("read_csv_options.csv", index=False)
+    try:
+        # Columns the reading options refer to are read even if they are not used
+        options = [
+            dict(parse_dates=["d"]),
+            dict(parse_dates=["d"], dtype={"x": "float64", "z": "string"}),
+            dict(converters={"z": str.upper}, na_values={"z": ["-"]}),
+            dict(converters={3: str.upper}, parse_dates=[2]),
+            dict(true_values=["a"], false_values=["b"]),
+        ]
+        for kwargs in options:
+            data = pd.read_csv("read_csv_options.csv", **kwargs)
+            expected = data.query("x > 1").pivot_table(values="x", index="y")
+            for chunksize in [None, 3]:
+                output = (
+                    read_csv("read_csv_options.csv", chunksize=chunksize, **kwargs)
+                    + select("x > 1")
+                    + pivot_table(values="x", index="y")
+                )
+                pd.testing.assert_frame_equal(output.collect().pandas_df, expected)
+                output = (
+                    read_csv("read_csv_options.csv", chunksize=chunksize, **kwargs)
+                    + select("x > 1")
+                    + drop(columns="y")
+                )
+                pd.testing.assert_frame_equal(
+                    output.collect().pandas_df.reset_index(drop=True),
+                    data.query("x > 1").drop(columns="y").reset_index(drop=True),
+                )
+    finally:
+        os.remove("read_csv_options.csv")
@@ -1,5 +1,9 @@
+import threading
+
 import pandas as pd
+import numpy as np
 
+from dplypy.background import flush_side_effects
 from dplypy.dplyframe import DplyFrame
 from dplypy.pipeline import side_effect, s
 
@@ -30,3 +34,66 @@ def test_side_effect(capsys):
 
     df_post_pipe = dplyf + s(my_side_effect_func)
     pd.testing.assert_frame_equal(dplyf.pandas_df, df_post_pipe.pandas_df)
+
+    # Side effects share the data instead of copying it, and cannot write to it
+    def share(d1):
+        assert np.shares_memory(d1["col1"].to_numpy(), dplyf["col1"].to_numpy())
+        d1.pandas_df.loc[0, "col1"] = "z"
+
+    try:
+        dplyf + s(share)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError was not raised")
+    pd.testing.assert_frame_equal(dplyf.pandas_df, pandas_df)
+
+    # A deep copy can be modified in place
+    def write(d1):
+        d1.pandas_df.loc[0, "col1"] = "z"
+
+    df_post_pipe = dplyf + side_effect(write, deep_copy=True)
+    pd.testing.assert_frame_equal(df_post_pipe.pandas_df, pandas_df)
+
+    # Background side effects run while the pipeline goes on, until it is collected
+    started = threading.Event()
+
+    def wait(d1):
+        started.set()
+        assert not d1.pandas_df["col1"].to_numpy().flags.writeable
+        return len(d1.pandas_df)
+
+    output = (
+        dplyf.lazy()
+        + s(wait, background=True)
+        + side_effect(lambda d1: started.wait(10), background=True)
+    )
+    pd.testing.assert_frame_equal(output.collect().pandas_df, pandas_df)
+    dplyf + s(lambda d1: d1["col1"][3], background=True)
+    assert flush_side_effects() == ["d"]
+    assert flush_side_effects() == []
+
+    # Their exceptions are raised once they are all done
+    def fail(d1):
+        raise KeyError("col2")
+
+    dplyf + s(fail, background=True) + s(wait, background=True)
+    try:
+        dplyf.collect()
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("KeyError was not raised")
+    assert flush_side_effects() == []
+
+    # Each pipeline only waits for its own, and only raises their exceptions
+    other = DplyFrame(pandas_df.copy())
+    other + s(fail, background=True)
+    assert (dplyf + s(wait, background=True)).collect() is dplyf
+    try:
+        other.collect()
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("KeyError was not raised")
+    assert flush_side_effects() == []
@@ -0,0 +1,124 @@
+import pandas as pd
+import numpy as np
+
+from dplypy import aggregate
+from dplypy.dplyframe import DplyFrame
+from dplypy.pipeline import group_by, summarise, select, optimize
+
+
+def test_summarise():
+    pandas_df = pd.DataFrame(
+        {
+            "who": ["man", "woman", "child", "man", "woman", None, "man"],
+            "deck": ["A", "B", "A", "A", "B", "C", "B"],
+            "fare": [7.25, 71.3, np.nan, 8.05, 53.1, 8.46, 51.9],
+            "age": [22, 38, 4, 35, 35, 54, 2],
+            "alive": [False, True, True, False, True, False, False],
+        }
+    )
+    df = DplyFrame(pandas_df)
+
+    output = (
+        df
+        + group_by(["who", "deck"])
+        + summarise(
+            n="size",
+            mean_fare=("fare", "mean"),
+            total_fare=("fare", "sum"),
+            fares=("fare", "count"),
+            oldest=("age", "max"),
+            survivors=("alive", "sum"),
+            spread=("age", "std"),
+            first_fare=("fare", "first"),
+            decks=("deck", "nunique"),
+        )
+    )
+    grouped = pandas_df.groupby(["who", "deck"])
+    expected = grouped.agg(
+        mean_fare=("fare", "mean"),
+        total_fare=("fare", "sum"),
+        fares=("fare", "count"),
+        oldest=("age", "max"),
+        survivors=("alive", "sum"),
+        spread=("age", "std"),
+        first_fare=("fare", "first"),
+        decks=("deck", "nunique"),
+    ).reset_index()
+    expected.insert(2, "n", grouped.size().to_numpy())
+    pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    # Without group_by, all the rows form one group
+    output = df + summarise(n="size", youngest=("age", "min"))
+    expected = pd.DataFrame({"n": [7], "youngest": [2]})
+    pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+    # Only the columns the summary reads are kept in a lazy plan
+    output = (
+        df.lazy()
+        + select("age > 3")
+        + group_by("deck")
+        + summarise(mean_age=("age", "mean"))
+    )
+    plan = optimize(output.stages, list(pandas_df.columns))
+    assert plan[0].params == {"columns": ["deck", "age"]}
+    expected = (
+        pandas_df.query("age > 3")
+        .groupby("deck")
+        .agg(mean_age=("age", "mean"))
+        .reset_index()
+    )
+    pd.testing.assert_frame_equal(output.collect().pandas_df, expected)
+
+    try:
+        summarise(n="fare")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError was not raised")
+
+    # Only summarise can follow group_by: other stages would drop the grouping
+    for frame in (df, df.lazy(), df.parallel(2)):
+        try:
+            frame + group_by("deck") + select("age > 3") + summarise(n="size")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("ValueError was not raised")
+    try:
+        (group_by("deck") + select("age > 3") + summarise(n="size"))(df)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError was not raised")
+    output = (df.lazy() + group_by("deck")).collect() + summarise(n="size")
+    expected = pd.DataFrame({"deck": ["A", "B", "C"], "n": [3, 3, 1]})
+    pd.testing.assert_frame_equal(output.pandas_df, expected)
+
+
+def test_summarise_kernels(monkeypatch):
+    rng = np.random.default_rng(0)
+    pandas_df = pd.DataFrame(
+        {
+            "key": rng.integers(0, 300, 5000),
+            "x": rng.integers(-50, 50, 5000),
+            "big": rng.integers(2**60, 2**61, 5000),
+            "y": np.where(rng.random(5000) < 0.1, np.nan, rng.random(5000)),
+        }
+    )
+    aggregations = {
+        "sum_x": ("x", "sum"),
+        "sum_big": ("big", "sum"),
+        "mean_x": ("x", "mean"),
+        "var_y": ("y", "var"),
+        "min_x": ("x", "min"),
+        "max_y": ("y", "max"),
+        "first_y": ("y", "first"),
+        "last_x": ("x", "last"),
+    }
+    grouped = pandas_df.groupby("key")
+    expected = grouped.agg(**aggregations).reset_index()
+    # Before numpy 1.25, minimums and maximums are also computed in sorted order
+    for fast_at in (True, False):
+        monkeypatch.setattr(aggregate, "_FAST_AT", fast_at)
+        output = aggregate.summarise_frame(pandas_df, ["key"], aggregations)
+        pd.testing.assert_frame_equal(output, expected)
@@ -3,8 +3,11 @@ import os
 import pandas as pd
 import pytest
 
+from dplypy import background
+from dplypy.background import flush_writes
 from dplypy.dplyframe import DplyFrame
 from dplypy.pipeline import write_file
+from dplypy.readers import read_csv
 
 
 def test_write_file():
@@ -63,3 +66,86 @@ def test_write_file():
     # Error case
     with pytest.raises(IOError):
         df + write_file("df.abc")
+
+    # In the background, in a thread or in a forked process
+    output = (
+        df
+        + write_file("df_thread.csv", index=False, background=True)
+        + write_file("df_process.pkl", background=True, backend="process")
+    )
+    output.collect()
+    pd.testing.assert_frame_equal(pd.read_csv("df_thread.csv"), pandas_df)
+    pd.testing.assert_frame_equal(pd.read_pickle("df_process.pkl"), pandas_df)
+    os.remove("df_thread.csv")
+    os.remove("df_process.pkl")
+
+    # Chunk by chunk from a chunked source
+    pandas_df.to_csv("df_source.csv", index=False)
+    read_csv("df_source.csv", chunksize=3) + write_file(
+        "df_chunks.csv", index=False, background=True
+    )
+    flush_writes()
+    pd.testing.assert_frame_equal(pd.read_csv("df_chunks.csv"), pandas_df)
+    os.remove("df_source.csv")
+    os.remove("df_chunks.csv")
+
+    # Errors are raised by the next write, `collect()` or `flush_writes()`
+    df + write_file(os.path.join("missing", "df.csv"), background=True)
+    with pytest.raises(OSError):
+        df + write_file("df.pkl")
+    assert not os.path.exists("df.pkl")
+    df + write_file(os.path.join("missing", "df.pkl"), background=True)
+    with pytest.raises(OSError):
+        flush_writes()
+    flush_writes()
+
+    # Another pipeline's failed write is not raised, but reported at exit if nothing
+    # waited for it
+    other = DplyFrame(pandas_df.copy())
+    other + write_file(os.path.join("missing", "other.csv"), background=True)
+    try:
+        df + write_file("df.pkl", background=True)
+        df.collect()
+        pd.testing.assert_frame_equal(pd.read_pickle("df.pkl"), pandas_df)
+    finally:
+        os.remove("df.pkl")
+    with pytest.warns(RuntimeWarning, match="missing"):
+        background._report()
+    with pytest.raises(OSError):
+        other.collect()
+
+
+def test_write_columnar_file():
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    pandas_df = pd.DataFrame(
+        data={"col1": [0, 1, 2, 3, 4], "col2": ["a", "b", "c", "d", "e"]}
+    )
+    df = DplyFrame(pandas_df)
+
+    # To parquet and feather files, with a chosen compression
+    df + write_file("df.parquet", compression="zstd", row_group_size=2)
+    pd.testing.assert_frame_equal(pd.read_parquet("df.parquet"), pandas_df)
+    metadata = pyarrow.parquet.ParquetFile("df.parquet").metadata
+    assert metadata.num_row_groups == 3
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+    os.remove("df.parquet")
+
+    df + write_file("df.feather", index=False, compression="uncompressed")
+    pd.testing.assert_frame_equal(pd.read_feather("df.feather"), pandas_df)
+    os.remove("df.feather")
+
+    # Chunk by chunk from a chunked source, into a single file
+    pandas_df.to_csv("df_source.csv", index=False)
+    read_csv("df_source.csv", chunksize=2) + write_file("df.arrow", index=False)
+    pd.testing.assert_frame_equal(pd.read_feather("df.arrow"), pandas_df)
+    read_csv("df_source.csv", chunksize=2) + write_file(
+        "df.parquet", index=False, background=True
+    )
+    flush_writes()
+    pd.testing.assert_frame_equal(pd.read_parquet("df.parquet"), pandas_df)
+    assert pyarrow.parquet.ParquetFile("df.parquet").metadata.num_row_groups == 3
+    os.remove("df_source.csv")
+    os.remove("df.arrow")
+    os.remove("df.parquet")
@@ -0,0 +1,151 @@
+"""
+Writers of columnar files for `pipeline.write_file`.
+Parquet and Feather/Arrow IPC files are written incrementally, one DplyFrame or chunk
+of rows at a time, so that a chunked plan can stream its output into a single file.
+They require pyarrow.
+Column directories hold one .npy file per column, which `readers.read_columns`
+memory-maps instead of reading.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# Suffixes of the files written by ColumnarWriter
+COLUMNAR_SUFFIXES = (".parquet", ".feather", ".arrow")
+
+# Suffix of the column directories written by `write_columns`
+COLUMNS_SUFFIX = ".columns"
+
+# The file of a column directory describing its columns and index
+LAYOUT_FILE = "layout.pkl"
+
+# Compression used when none is given: pyarrow's defaults for each format
+_DEFAULT_COMPRESSION = {"parquet": "snappy", "ipc": "lz4"}
+
+
+def _pyarrow():
+    """
+    :return: the pyarrow module, which is an optional dependency
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(
+            "Writing Parquet and Feather files requires pyarrow: pip install pyarrow"
+        ) from error
+    return pyarrow
+
+
+class ColumnarWriter:
+    """
+    A Parquet or Feather/Arrow IPC file being written, one pandas DataFrame at a time.
+    The file is created by the first `write`, whose DataFrame sets its schema: the
+    following DataFrames must have the same columns, and are cast to their types.
+    """
+
+    def __init__(self, file_path, index=True, compression=None, row_group_size=None):
+        """
+        :param file_path: the path of the file, ending with .parquet, .feather or .arrow
+        :param index: whether to write the index of the DataFrames as a column
+        :param compression: "zstd", "lz4", "snappy" (Parquet only), "gzip"
+                            (Parquet only) or "uncompressed"; by default snappy
+                            for Parquet and lz4 for Feather
+        :param row_group_size: maximum number of rows per Parquet row group or
+                               Arrow record batch, by default one per DataFrame
+                               written (up to pyarrow's limit)
+        """
+        if not file_path.endswith(COLUMNAR_SUFFIXES):
+            raise IOError("The file format is not supported.")
+        self.file_path = file_path
+        self.index = index
+        self.format = "parquet" if file_path.endswith(".parquet") else "ipc"
+        self.compression = compression or _DEFAULT_COMPRESSION[self.format]
+        self.row_group_size = row_group_size
+        self._writer = None
+        self._schema = None
+
+    def _open(self, schema):
+        pyarrow = _pyarrow()
+        compression = self.compression
+        if self.format == "parquet":
+            if compression == "uncompressed":
+                compression = "none"
+            return pyarrow.parquet.ParquetWriter(
+                self.file_path, schema, compression=compression
+            )
+        if compression == "uncompressed":
+            compression = None
+        options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+        return pyarrow.ipc.new_file(self.file_path, schema, options=options)
+
+    def write(self, pandas_df):
+        """
+        Append the rows of a pandas DataFrame to the file
+        """
+        pyarrow = _pyarrow()
+        table = pyarrow.Table.from_pandas(
+            pandas_df, schema=self._schema, preserve_index=self.index
+        )
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = self._open(self._schema)
+        if self.format == "parquet":
+            self._writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            self._writer.write_table(table, max_chunksize=self.row_group_size)
+
+    def close(self):
+        """
+        Finish writing the file
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_columnar(
+    pandas_df, file_path, index=True, compression=None, row_group_size=None
+):
+    """
+    Write a pandas DataFrame to a Parquet or Feather/Arrow IPC file.
+    See ColumnarWriter for the parameters.
+    """
+    with ColumnarWriter(file_path, index, compression, row_group_size) as writer:
+        writer.write(pandas_df)
+
+
+def write_columns(pandas_df, dir_path, index=True):
+    """
+    Write a pandas DataFrame to a column directory: one .npy file per column (named
+    after its position), the index in index.npy unless it is a RangeIndex, and
+    their names and types in layout.pkl.
+    Columns of numpy types can be memory-mapped by `readers.read_columns`; the
+    others (strings, categoricals...) are pickled, and read into memory.
+
+    :param index: whether to write the index, rather than number the rows from 0
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    for position, (_, column) in enumerate(pandas_df.items()):
+        values = np.asarray(column)
+        np.save(os.path.join(dir_path, f"{position}.npy"), values, allow_pickle=True)
+    row_index = pandas_df.index if index else pd.RangeIndex(len(pandas_df))
+    if not isinstance(row_index, pd.RangeIndex):
+        np.save(os.path.join(dir_path, "index.npy"), np.asarray(row_index), True)
+        # An empty index of the same type and names
+        row_index = row_index[:0]
+    layout = {
+        "columns": pandas_df.columns,
+        "dtypes": list(pandas_df.dtypes),
+        "length": len(pandas_df),
+        "index": row_index,
+    }
+    pd.to_pickle(layout, os.path.join(dir_path, LAYOUT_FILE))
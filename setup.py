@@ -3,7 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name="dplypy",
     version="0.1.0",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     install_requires=[
         "pandas>=1.4.1>=1.4.1",
         "pytest>=6.2.3",
@@ -13,4 +13,8 @@ setup(
         "cython>=0.29.23",
         "missingno>=0.5.1",
     ],
+    extras_require={
+        # Parquet and Feather output (see dplypy/writers.py)
+        "arrow": ["pyarrow>=7.0.0"],
+    },
 )